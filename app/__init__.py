@@ -1,11 +1,24 @@
 # ./app/__init__.py
-from fastapi import FastAPI
+import asyncio
+import os
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.utils.db import get_async_db_pool, close_all_connections
+from app.utils.db import get_async_db_pool, get_qdrant_client, close_all_connections
 from app.routes import api_router
 from app.utils.app_logger import app_log_manager, logger
+from app.utils.metrics_sink import metrics_sink
+from app.utils.tracing import start_trace, current_trace_id
+from app.utils.log_policy import configure_log_levels, request_log_scope
+from app.utils.sampling_profiler import install_signal_handler
+from app.utils.admission import AdmissionRejected, admission, retry_after_header
+from app.utils.readiness import readiness
+from app.config import Config
 
 app_log_manager.setup_logging()
+# 套用 LOG_LEVEL / LOG_MODULE_LEVELS (需在 setup_logging 之後，否則會被其預設層級覆蓋)
+configure_log_levels()
 
 # --- FastAPI 初始化 ---
 app = FastAPI(title="Place Search Service", version="2.0.0")
@@ -20,6 +33,79 @@ app.add_middleware(
 
 app.include_router(api_router)
 
+
+# 各入口通道需要就緒的依賴 (None 代表全部)
+_LANE_DEPENDENCIES = {"page": ("redis",), "search": None}
+
+
+def _lane_for(path: str) -> str:
+    # 翻頁、重新排序與追加過濾只讀寫既有 Session (Redis)，不經過 MySQL / Qdrant，走輕量的 page 通道
+    if path.startswith("/place_search/page") or path.endswith(("/resort", "/refine")):
+        return "page"
+    return "search"
+
+
+@app.middleware("http")
+async def instrument_search_requests(request: Request, call_next):
+    """
+    為搜尋相關請求建立 Root Span，底下的 Builder / Repository / VectorService Span 會自動掛在此節點。
+    回應標頭帶上 X-Trace-Id，方便以此 ID 在 traces.jsonl / OTLP 後端找到對應的 Span 樹。
+    同時開啟請求層級的日誌範圍：被取樣略過的細節日誌只在慢請求時補印 (見 app/utils/log_policy.py)。
+    為什麼只處理 /place_search：/metrics、/docs 等端點的 Trace 沒有分析價值，只會稀釋取樣。
+
+    就緒檢查 (app/utils/readiness.py) 與准入控制 (app/utils/admission.py) 也在這裡：
+    依賴尚未暖機完成、或超過入口名額的請求，在進入 Route 之前就以 503 回絕；
+    翻頁走獨立的 page 通道，搜尋塞車時仍可取得已算好的結果。
+    """
+    if not request.url.path.startswith("/place_search"):
+        return await call_next(request)
+
+    lane = _lane_for(request.url.path)
+
+    # 暖機尚未完成的 Worker 不接流量：翻頁只需要 Redis，搜尋需要全部依賴
+    pending = readiness.missing(_LANE_DEPENDENCIES[lane])
+    if pending:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": {"status": "warming_up", "pending": pending}},
+            headers={"Retry-After": str(Config.WARMUP_RETRY_AFTER_S)},
+        )
+
+    try:
+        async with admission.limit(lane):
+            return await _instrumented(request, call_next)
+    except AdmissionRejected as e:
+        logger.warning(f"[Admission] 卸載 {request.method} {request.url.path}: {e}")
+        return JSONResponse(
+            status_code=503,
+            content={"detail": {"status": "overloaded", "stage": e.stage, "reason": e.reason}},
+            headers=retry_after_header(e),
+        )
+
+
+async def _instrumented(request: Request, call_next):
+    t_start = time.perf_counter()
+    with request_log_scope(f"{request.method} {request.url.path}"), start_trace(
+        f"{request.method} {request.url.path}",
+        force_export=request.headers.get("x-trace-export") == "1",
+        http_method=request.method,
+        http_path=request.url.path,
+    ) as root:
+        response = await call_next(request)
+        root.set_attribute("http_status", response.status_code)
+        trace_id = current_trace_id()
+        if trace_id:
+            response.headers["X-Trace-Id"] = trace_id
+
+        # Server-Timing (W3C)：各階段毫秒數，瀏覽器 DevTools 與 benchmarks/loadtest.py 皆可直接讀取
+        timings = getattr(request.state, "server_timing", None)
+        if Config.SERVER_TIMING_ENABLED and timings is not None:
+            entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+            entries.append(f"app;dur={(time.perf_counter() - t_start) * 1000:.2f}")
+            entries.append(f'source;desc="{getattr(request.state, "pipeline_source", "unknown")}"')
+            response.headers["Server-Timing"] = ", ".join(entries)
+        return response
+
 # --- FastAPI 事件管理 ---
 
 @app.on_event("startup")
@@ -27,71 +113,145 @@ async def startup_event():
     """
     FastAPI 服務啟動事件。
 
-    設計動機（為什麼要在 startup 預熱？）
+    設計動機（為什麼改為背景暖機？）
     ─────────────────────────────────────
-    • 冷啟動問題：VectorService 內的 BGE-M3 嵌入模型首次載入約需 1.7 秒。
-      若放在每次請求中初始化，第一位用戶每次都會等待這段延遲，嚴重影響 UX。
+    • 冷啟動問題：BGE-M3 嵌入模型載入 (首次還要 snapshot_download) 與 torch 匯入需要數秒到數分鐘，
+      原本在 startup 內依序完成才開始服務，期間連存活探針都無法回應。
     • 共用單例：透過 app.state 將重型物件以「單例」形式掛載，
-      所有請求皆共用同一份實例，避免記憶體重複占用。
-    • 啟動順序設計：先建立 DB 連線池 → 再建立 Redis Cache → 最後載入 AI 模型，
-      確保下游依賴的基礎設施（DB、快取）一定先於業務層就緒。
+      所有請求皆共用同一份實例，避免記憶體重複占用。這些物件的建構本身很便宜 (不連線、不載入模型)，仍在 startup 內完成。
+    • 背景暖機：MySQL 連線池、Redis、Qdrant 與模型載入 + 暖機推論在背景 Task 平行進行，各自失敗各自重試；
+      GET /readyz 在全部完成前回傳 503，滾動部署不會把流量送到冷的 Worker (見 app/utils/readiness.py)。
+    • 快速失敗改為「看得見的失敗」：依賴連不上時 /readyz 會列出是哪一個依賴與最後一次錯誤，
+      而不是等第一個請求以 AttributeError 回傳 500。
     """
-    logger.info("FastAPI service is starting (Pre-warming services)...")
-
-    # ── Step 1：初始化資料庫連線池 ──────────────────────────────────────────
-    # 為什麼先建 DB 連線池：
-    # HybridSQLBuilder 與 RdbmsRepository 在執行查詢時需要從池中借用連線。
-    # 若連線池尚未準備好，第一個進來的請求就會觸發初始化，造成不可預期的延遲或競態條件。
-    await get_async_db_pool()
-    logger.info("[DB] 資料庫連線池已就緒。")
-
-    # ── Step 2：初始化 Redis Session Cache ──────────────────────────────────
-    # 為什麼先於 AI 模型建立 Cache：
-    # SearchSessionCache 負責跨請求儲存分頁結果（TTL 短暫的 Redis Key）。
-    # 若 AI 模型先於 Cache 就緒，而 startup 中途失敗，
-    # 則 Redis 連線從未被驗證，首次翻頁請求才會爆出連線錯誤，難以診斷。
-    # 提前建立可在服務啟動階段就發現 Redis 連線問題，做到「快速失敗（Fail Fast）」。
-    try:
-        from app.utils.search_session_cache import SearchSessionCache
+    logger.info("FastAPI service is starting (Pre-warming services in background)...")
 
-        # 將 Cache 實例掛載到 app.state，讓所有路由都能透過 request.app.state.session_cache 取用
-        app.state.session_cache = SearchSessionCache()
-        logger.info("[Cache] Redis Session Cache 已就緒。")
+    # ── Step 0：啟動效能指標背景寫入器 ───────────────────────────────────
+    # 請求端只把指標放進記憶體緩衝區，檔案寫入一律由此背景執行緒批次處理
+    metrics_sink.start()
 
-        # ── Step 3：載入 AI 模型與業務層 Service ────────────────────────────
-        # 為什麼放在最後：
-        # AI 模型（BGE-M3）是最耗時的初始化步驟（約 1.7 秒）。
-        # 讓它在 DB 與 Cache 確認就緒後才開始載入。
-        # 能確保整條服務鏈路（DB→Cache→AI）依序驗證，任何一環失敗都能在啟動日誌中清楚定位。
-        from app.services.vector_service import VectorService
-        from app.services.hybrid_SQL_builder_service_v2 import HybridSQLBuilder
-        from app.repository.rdbms_repository import RdbmsRepository
+    # kill -USR2 <pid> 觸發取樣分析 (閒置時不佔任何資源，見 app/utils/sampling_profiler.py)
+    install_signal_handler()
 
-        # VectorService()：內部會載入 BGE-M3 嵌入模型，首次執行約 1.7 秒
-        # 掛載到 app.state 後，後續所有請求共用此實例，不再重複付出載入代價
-        app.state.vector_service = VectorService()
+    # 先登記要等待的依賴：開始服務的那一刻 /readyz 就必須回報未就緒
+    readiness.expect("mysql", "redis", "qdrant", "embedding")
 
-        # HybridSQLBuilder：解析 AI 傳入的 JSON intent，動態組裝 SQL 語句
-        app.state.builder = HybridSQLBuilder()
+    # ── Step 1：組裝業務層單例 (不做任何 I/O) ───────────────────────────
+    # 為什麼在函式內 import：只在真正啟動服務時載入 Service 層，匯入 app (例如 benchmarks、CLI 工具) 時不需付出成本
+    from app.utils.search_session_cache import SearchSessionCache
+    from app.services.vector_service import VectorService
+    from app.services.hybrid_SQL_builder_service_v2 import HybridSQLBuilder
+    from app.repository.rdbms_repository import RdbmsRepository
+    from app.services.search_pipeline_service import SearchPipelineService
+    from app.utils.intent_result_cache import GeoCandidateCache, IntentResultCache
+    from app.utils.single_flight import SingleFlight
 
-        # RdbmsRepository：封裝 MySQL 非同步查詢邏輯；use_mock=False 代表連接真實資料庫
-        app.state.rdbms_repo = RdbmsRepository(use_mock=False)
+    # SearchSessionCache 負責跨請求儲存分頁結果（TTL 短暫的 Redis Key）；建立連線池不會立即連線，實際連線在背景驗證
+    # 將 Cache 實例掛載到 app.state，讓所有路由都能透過 request.app.state.session_cache 取用
+    app.state.session_cache = SearchSessionCache()
 
-        logger.info("[AI] BGE-M3 模型與所有 Service 預熱完成。")
+    # VectorService(load_model=False)：模型改由背景暖機載入，startup 不再被模型載入卡住
+    app.state.vector_service = VectorService(load_model=False)
 
-    except Exception as e:
-        # 記錄詳細錯誤但不讓服務崩潰；
-        # 若模型載入失敗，後續請求進到路由時會因 app.state 缺失屬性而拋出 AttributeError，
-        # 屆時 500 回應可提示開發者查看此段啟動日誌
-        logger.error(f"[Startup] 服務預熱失敗，請確認 Redis / DB / 模型檔案是否就緒: {e}")
+    # HybridSQLBuilder：解析 AI 傳入的 JSON intent，動態組裝 SQL 語句
+    app.state.builder = HybridSQLBuilder()
+
+    # RdbmsRepository：封裝 MySQL 非同步查詢邏輯；use_mock=False 代表連接真實資料庫
+    app.state.rdbms_repo = RdbmsRepository(use_mock=False)
 
-    logger.info("FastAPI service started successfully.")
+    # 意圖結果快取：相同意圖 (標準化指紋) 直接重用排序結果；L2 與 Session 共用同一個 Redis 連線池
+    app.state.intent_cache = (
+        IntentResultCache(redis_client=app.state.session_cache.redis)
+        if Config.INTENT_CACHE_ENABLED else None
+    )
+
+    # 位置感知候選快取：同一 Geohash 網格內的相同意圖重用 SQL + Qdrant 候選，只依本次座標重算距離與排序
+    app.state.geo_cache = (
+        GeoCandidateCache(redis_client=app.state.session_cache.redis)
+        if Config.GEO_CACHE_ENABLED else None
+    )
+
+    # SearchPipelineService：SQL → 向量搜尋 → 排序 → 格式化 的檢索主流程
+    app.state.search_pipeline = SearchPipelineService(
+        builder=app.state.builder,
+        rdbms_repo=app.state.rdbms_repo,
+        vector_service=app.state.vector_service,
+        result_cache=app.state.intent_cache,
+        # Single-Flight：同一時間的相同意圖只執行一次檢索，其餘請求等待共用結果
+        single_flight=SingleFlight() if Config.SINGLE_FLIGHT_ENABLED else None,
+        geo_cache=app.state.geo_cache
+    )
+
+    # ── Step 2：背景暖機 (平行、各自重試) ───────────────────────────────
+    app.state.warmup_task = asyncio.create_task(_warmup_dependencies())
+
+    # 多 Worker 時 Gauge 以 livesum 加總各 Worker 的 mmap 檔，每個 Worker 需自行定期更新 (見 metrics_registry.py)
+    app.state.gauge_task = None
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR") and Config.METRICS_GAUGE_REFRESH_S > 0:
+        from app.utils.metrics_registry import run_gauge_refresher
+        app.state.gauge_task = asyncio.create_task(run_gauge_refresher(app.state, Config.METRICS_GAUGE_REFRESH_S))
+
+    logger.info("FastAPI service started; dependencies are warming up (see GET /readyz).")
+
+
+async def _warm_mysql():
+    # 建立連線池 (minsize 條連線) 後實際執行一次查詢，確認帳號權限與資料庫都可用
+    pool = await get_async_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT 1")
+    return {"pool_size": pool.size}
+
+
+async def _warm_redis():
+    await app.state.session_cache.redis.ping()
+    # 重新排序會覆寫 Session，需接收其他 Worker 的 L1 失效通知
+    app.state.session_cache.start_invalidation_listener()
+
+
+async def _warm_qdrant():
+    # 讀取 Collection 資訊：同時驗證連線與 COLLECTION_NAME 是否存在
+    client = await get_qdrant_client()
+    info = await client.get_collection(Config.COLLECTION_NAME)
+    return {"points": getattr(info, "points_count", None)}
+
+
+async def _warmup_dependencies():
+    interval = Config.WARMUP_RETRY_INTERVAL_S
+    await asyncio.gather(
+        readiness.warm("mysql", _warm_mysql, interval),
+        readiness.warm("redis", _warm_redis, interval),
+        readiness.warm("qdrant", _warm_qdrant, interval),
+        readiness.warm("embedding", app.state.vector_service.warmup, interval),
+    )
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("FastAPI service is shutting down...")
+
+    # 仍在重試中的背景暖機 (例如依賴一直連不上) 直接取消
+    warmup_task = getattr(app.state, "warmup_task", None)
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+
+    gauge_task = getattr(app.state, "gauge_task", None)
+    if gauge_task is not None:
+        gauge_task.cancel()
+
+    # 0. 先等待 Session 背景寫入完成再關閉 Redis 連線 (避免最後幾筆搜尋結果無法翻頁)
+    session_cache = getattr(app.state, "session_cache", None)
+    if session_cache is not None:
+        try:
+            await session_cache.close()
+        except Exception as e:
+            logger.error(f"[Cache] 關閉 Session Cache 時發生錯誤: {e}")
     
+    # 0-1. 關閉與 Embedding Sidecar 的閒置連線 (sidecar 模式)
+    vector_service = getattr(app.state, "vector_service", None)
+    if vector_service is not None and vector_service.embedding_client is not None:
+        await vector_service.embedding_client.close()
+
     # 1. 先關閉資料庫連線池
     try:
         await close_all_connections()
@@ -99,5 +259,9 @@ async def shutdown_event():
     except Exception as e:
         logger.error(f"[DB] 關閉連線池時發生錯誤: {e}")
 
-    # 2. 最後才關閉日誌監聽器 (確保最後的日誌有被寫入)
+    # 2. 停止效能指標背景寫入器 (寫出緩衝區內剩餘的指標)
+    metrics_sink.stop()
+    logger.info(f"[Metrics] 效能指標寫入器已停止: {metrics_sink.stats()}")
+
+    # 3. 最後才關閉日誌監聽器 (確保最後的日誌有被寫入)
     app_log_manager.stop_logging()
\ No newline at end of file
@@ -25,6 +25,139 @@ class Config:
     SEARCH_ARCHITECTURE = os.getenv("SEARCH_ARCHITECTURE", "Default_Hybrid")
     CURRENT_PLACE_COUNT = os.getenv("CURRENT_PLACE_COUNT", "0")
     PERFORMANCE_LOG_PATH = os.getenv("PERFORMANCE_LOG_PATH", "performance_metrics.csv")
+    # Service 層個別函式耗時 (預設放在 PERFORMANCE_LOG_PATH 旁，加上 _detail 字尾)
+    FUNC_TIMING_LOG_PATH = os.getenv("FUNC_TIMING_LOG_PATH", PERFORMANCE_LOG_PATH.replace(".csv", "_detail.csv"))
+
+    # -------- 效能指標背景寫入 (MetricsSink) --------
+    # 輸出格式：csv / jsonl / parquet (parquet 需安裝 pyarrow)
+    METRICS_FORMAT = os.getenv("METRICS_FORMAT", "csv")
+    # 記憶體緩衝區上限 (筆)；滿了就丟棄並累加 drop 計數，不阻塞請求
+    METRICS_BUFFER_SIZE = int(os.getenv("METRICS_BUFFER_SIZE", 10000))
+    # 累積到此筆數或超過 METRICS_FLUSH_INTERVAL 秒即批次寫入
+    METRICS_FLUSH_BATCH = int(os.getenv("METRICS_FLUSH_BATCH", 256))
+    METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 2.0))
+    # 單檔超過此大小即輪替，並保留最近 METRICS_BACKUP_COUNT 份
+    METRICS_ROTATE_BYTES = int(os.getenv("METRICS_ROTATE_BYTES", 50 * 1024 * 1024))
+    METRICS_BACKUP_COUNT = int(os.getenv("METRICS_BACKUP_COUNT", 10))
+    # 多 Worker (PROMETHEUS_MULTIPROC_DIR) 時每個 Worker 更新自身 Gauge 的間隔秒數 (0 = 停用)
+    METRICS_GAUGE_REFRESH_S = float(os.getenv("METRICS_GAUGE_REFRESH_S", 5))
+
+    # -------- 請求追蹤 (Tracing Spans) --------
+    TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+    # 匯出格式：json (每個請求一棵 Span 樹) / otlp (OTLP/JSON，可匯入 Jaeger、Tempo 等) / both
+    TRACE_EXPORT = os.getenv("TRACE_EXPORT", "both")
+    # 尾端取樣：超過 TRACE_SLOW_MS 的請求一律匯出，其餘依 TRACE_SAMPLE_RATE 隨機匯出
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.05))
+    TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 1000))
+    # 單一請求最多記錄的 Span 數，避免異常迴圈讓記憶體無限成長
+    TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 256))
+    TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(os.path.dirname(PERFORMANCE_LOG_PATH), "traces.jsonl"))
+    TRACE_OTLP_PATH = os.getenv("TRACE_OTLP_PATH", os.path.join(os.path.dirname(PERFORMANCE_LOG_PATH), "traces_otlp.jsonl"))
+    TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "place-search-service")
+    # 回應標頭 Server-Timing (各階段毫秒數)；會暴露內部耗時，預設只在壓測 / 開發環境開啟
+    SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+    # -------- 正式流量擷取 (Request Capture，供 benchmarks/replay.py 重播) --------
+    CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() == "true"
+    # 依比例抽樣 /place_search 請求；被抽中的搜尋，其後續翻頁請求也會一併記錄
+    CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", 0.01))
+    CAPTURE_PATH = os.getenv("CAPTURE_PATH", os.path.join(os.path.dirname(PERFORMANCE_LOG_PATH), "capture", "requests.jsonl"))
+    # 擷取檔格式：jsonl.zst (需安裝 zstandard) / jsonl；輪替沿用 METRICS_ROTATE_BYTES / METRICS_BACKUP_COUNT
+    CAPTURE_FORMAT = os.getenv("CAPTURE_FORMAT", "jsonl.zst")
+    # user_location 的處理方式：jitter (隨機偏移 CAPTURE_JITTER_METERS 公尺內) / keep / drop
+    CAPTURE_LOCATION_MODE = os.getenv("CAPTURE_LOCATION_MODE", "jitter")
+    CAPTURE_JITTER_METERS = float(os.getenv("CAPTURE_JITTER_METERS", 500))
+    # 追蹤最近被抽中的 search_ssid 數量 (用來判斷翻頁請求是否要記錄)
+    CAPTURE_TRACKED_SESSIONS = int(os.getenv("CAPTURE_TRACKED_SESSIONS", 5000))
+
+    # -------- 請求截止時間與降級 (Deadline Propagation) --------
+    # 每個 /place_search 的整體時間預算 (毫秒)；呼叫端可用 X-Request-Deadline-Ms 標頭覆寫，0 代表不設限
+    REQUEST_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS", 0))
+    # 標頭值的上限，避免呼叫端要求過長的預算
+    REQUEST_DEADLINE_MAX_MS = float(os.getenv("REQUEST_DEADLINE_MAX_MS", 30000))
+    # 剩餘預算低於此值時略過 COUNT 查詢 (total_count 改以取回筆數為下限)
+    DEADLINE_COUNT_MIN_MS = float(os.getenv("DEADLINE_COUNT_MIN_MS", 400))
+    # 剩餘預算低於此值時不呼叫 Embedding / Qdrant，直接走純指標排序；COUNT 也會為向量階段保留這段時間
+    DEADLINE_VECTOR_MIN_MS = float(os.getenv("DEADLINE_VECTOR_MIN_MS", 250))
+    # Qdrant 等待時為排序與格式化保留的時間
+    DEADLINE_RANKING_RESERVE_MS = float(os.getenv("DEADLINE_RANKING_RESERVE_MS", 50))
+    # 剩餘預算低於 DEADLINE_CAP_BELOW_MS 時，候選只保留前 DEADLINE_CANDIDATE_CAP 筆
+    DEADLINE_CAP_BELOW_MS = float(os.getenv("DEADLINE_CAP_BELOW_MS", 600))
+    DEADLINE_CANDIDATE_CAP = int(os.getenv("DEADLINE_CANDIDATE_CAP", 50))
+
+    # -------- 准入控制與負載卸載 (Admission Control) --------
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    # 每個 Worker 各階段的限制，格式 "階段=並行上限/佇列上限/最長等待毫秒" (見 app/utils/admission.py)
+    # mysql 的並行上限應與連線池 maxsize (app/utils/db.py) 一致；inference 即同時推論的執行緒數
+    ADMISSION_LIMITS = os.getenv(
+        "ADMISSION_LIMITS",
+        "search=64/128/1000,page=256/512/2000,inference=2/32/500,mysql=20/64/500,qdrant=16/64/500"
+    )
+    # 被卸載時回應 503 的 Retry-After 秒數
+    ADMISSION_RETRY_AFTER_S = int(os.getenv("ADMISSION_RETRY_AFTER_S", 1))
+
+    # -------- 用戶端斷線偵測 (Disconnect Cancellation) --------
+    # 用戶端斷線後中止檢索：階段之間檢查斷線旗標，進行中的檢索在斷線當下即取消 (見 app/utils/client_disconnect.py)
+    DISCONNECT_CHECK_ENABLED = os.getenv("DISCONNECT_CHECK_ENABLED", "true").lower() == "true"
+    # 被取消的 MySQL 查詢以獨立連線送出 KILL QUERY (需 PROCESS / CONNECTION_ADMIN 權限或同一使用者)
+    MYSQL_KILL_ON_CANCEL = os.getenv("MYSQL_KILL_ON_CANCEL", "true").lower() == "true"
+    MYSQL_KILL_CONNECT_TIMEOUT = float(os.getenv("MYSQL_KILL_CONNECT_TIMEOUT", 2))
+
+    # -------- 回應投影 --------
+    # 未帶 ?view= 時的預設檢視：full (完整回應，與舊版相同) / llm / minimal，見 app/utils/response_projection.py
+    RESPONSE_DEFAULT_VIEW = os.getenv("RESPONSE_DEFAULT_VIEW", "full")
+
+    # -------- 批次搜尋 (POST /place_search/batch) --------
+    # 單一批次最多的意圖數；整批只佔一個 search 准入名額，過大的批次會讓單一請求霸佔連線池
+    BATCH_MAX_INTENTS = int(os.getenv("BATCH_MAX_INTENTS", 8))
+
+    # -------- 多 Worker 部署與 Embedding Sidecar --------
+    # uvicorn Worker 數 (run.py)；每個 Worker 是獨立程序，admission / 快取 L1 等單例各自一份
+    UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS", 1))
+    # local  ：每個 Worker 各自載入 BGE-M3 (約 2 GB，Worker 數多時記憶體 / VRAM 隨之倍增)
+    # sidecar：模型只在 Embedding Sidecar 程序載入一次，Worker 經 Unix Socket 取得向量 (見 app/services/embedding_sidecar.py)
+    EMBEDDING_MODE = os.getenv("EMBEDDING_MODE", "local").lower()
+    EMBEDDING_SOCKET_PATH = os.getenv("EMBEDDING_SOCKET_PATH", "/tmp/place-search-embedding.sock")
+    # Sidecar 微批次：湊滿 EMBEDDING_BATCH_MAX 筆或第一筆等待超過 EMBEDDING_BATCH_WAIT_MS 即送進模型
+    EMBEDDING_BATCH_MAX = int(os.getenv("EMBEDDING_BATCH_MAX", 32))
+    EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 5))
+    # Worker 端等待 Sidecar 回應的上限秒數，以及每個 Worker 保留的閒置連線數
+    EMBEDDING_CLIENT_TIMEOUT = float(os.getenv("EMBEDDING_CLIENT_TIMEOUT", 5))
+    EMBEDDING_CLIENT_POOL_SIZE = int(os.getenv("EMBEDDING_CLIENT_POOL_SIZE", 8))
+    # sidecar 模式下由 run.py 啟動 Sidecar 子程序，並在 Socket 就緒 (模型載入完成) 後才啟動 Worker
+    EMBEDDING_SIDECAR_AUTOSTART = os.getenv("EMBEDDING_SIDECAR_AUTOSTART", "true").lower() == "true"
+    EMBEDDING_SIDECAR_START_TIMEOUT = float(os.getenv("EMBEDDING_SIDECAR_START_TIMEOUT", 300))
+
+    # -------- 啟動暖機與就緒探針 (Readiness) --------
+    # 依賴 (MySQL / Redis / Qdrant / Embedding) 暖機失敗時的首次重試間隔秒數 (之後指數退避，上限 60 秒)
+    WARMUP_RETRY_INTERVAL_S = float(os.getenv("WARMUP_RETRY_INTERVAL_S", 2))
+    # 暖機期間被擋下的請求 (503) 建議的 Retry-After 秒數
+    WARMUP_RETRY_AFTER_S = int(os.getenv("WARMUP_RETRY_AFTER_S", 5))
+
+    # -------- 管理端點與取樣分析器 (Sampling Profiler) --------
+    # /admin/* 需帶 X-Admin-Token 標頭；未設定時所有管理端點一律拒絕
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+    PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", 60))
+    PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", 5))
+    # kill -USR2 <worker pid> 觸發取樣 PROFILER_SIGNAL_SECONDS 秒，結果寫入 PROFILER_OUTPUT_DIR (speedscope 格式)
+    PROFILER_SIGNAL_ENABLED = os.getenv("PROFILER_SIGNAL_ENABLED", "true").lower() == "true"
+    PROFILER_SIGNAL_SECONDS = float(os.getenv("PROFILER_SIGNAL_SECONDS", 15))
+    PROFILER_OUTPUT_DIR = os.getenv("PROFILER_OUTPUT_DIR", os.path.join(os.path.dirname(PERFORMANCE_LOG_PATH), "profiles"))
+
+    # -------- 日誌策略 (熱路徑層級 / 取樣 / 慢請求升級) --------
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    # 逐模組層級 (完整 Logger 名稱)，例如 "FastAPIApp.rdbms=WARNING,uvicorn.access=WARNING"
+    LOG_MODULE_LEVELS = os.getenv("LOG_MODULE_LEVELS", "")
+    # 熱路徑細節日誌依訊息類別取樣 (0 ~ 1)；未列出的類別使用 LOG_SAMPLE_DEFAULT
+    LOG_SAMPLE_RATES = os.getenv(
+        "LOG_SAMPLE_RATES",
+        "request_payload=0.01,sql_body=0.01,sql_params=0.01,sql_sample_row=0.01,"
+        "parse_node=0,candidate_sample=0.01,rank_row=0"
+    )
+    LOG_SAMPLE_DEFAULT = float(os.getenv("LOG_SAMPLE_DEFAULT", 0.01))
+    # 超過此毫秒數的請求，補印其被取樣略過的細節日誌 (每個請求最多暫存 LOG_ESCALATION_MAX_RECORDS 筆)
+    LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", 1500))
+    LOG_ESCALATION_MAX_RECORDS = int(os.getenv("LOG_ESCALATION_MAX_RECORDS", 500))
 
     
 
@@ -40,4 +173,57 @@ class Config:
     SEARCH_SESSION_TTL = int(os.getenv("SEARCH_SESSION_TTL", 600))
 
     # 每頁回傳的店家筆數（固定為 3，與原本 top_k 語意對齊）
-    PAGE_SIZE = int(os.getenv("PAGE_SIZE", 3))
\ No newline at end of file
+    PAGE_SIZE = int(os.getenv("PAGE_SIZE", 3))
+
+    # -------- Session 序列化與壓縮設定 --------
+    # 為什麼預設 orjson + zstd：Redis 記憶體是 600 秒 TTL 下的擴展瓶頸，
+    # 依 benchmarks/bench_session_codec.py 實測，照片 URL 與中文摘要重複度高，zstd 壓縮後約為原始 JSON 的 1/9，
+    # 而 orjson 的編解碼速度在三種格式中最快，足以抵銷壓縮成本
+    # 可用選項：SESSION_CODEC = json / orjson / msgpack；SESSION_COMPRESSION = none / zlib / zstd / lz4
+    SESSION_CODEC = os.getenv("SESSION_CODEC", "orjson")
+    SESSION_COMPRESSION = os.getenv("SESSION_COMPRESSION", "zstd")
+    # 序列化後超過此大小 (bytes) 才壓縮，避免小 Session 因壓縮標頭反而變大
+    SESSION_COMPRESS_THRESHOLD = int(os.getenv("SESSION_COMPRESS_THRESHOLD", 2048))
+    SESSION_COMPRESS_LEVEL = int(os.getenv("SESSION_COMPRESS_LEVEL", 3))
+
+    # Session 寫入模式
+    # write_behind：第 1 頁於記憶體中切出後立即回應，Redis SET 改由背景任務完成 (單一 Worker 時的預設)
+    # sync：等待 Redis 寫入完成後才回應 (多 Worker 時的預設)
+    # 為什麼多 Worker 必須 sync：背景寫入完成前，落在其他 Worker 的翻頁 / resort / refine 在 Redis 找不到 Session，
+    # 只有同一個 Worker 能從寫入暫存讀到；UVICORN_WORKERS > 1 時即使設定 write_behind 也會改用 sync (見 SearchSessionCache)
+    SESSION_WRITE_MODE = os.getenv("SESSION_WRITE_MODE", "write_behind" if UVICORN_WORKERS <= 1 else "sync")
+    # 背景寫入失敗時的重試次數
+    SESSION_WRITE_RETRIES = int(os.getenv("SESSION_WRITE_RETRIES", 1))
+
+    # -------- Worker 內 L1 Session 快取 (位於 Redis 之前) --------
+    # 為什麼需要：使用者翻頁時同一個 search_ssid 會在數秒內被讀取多次，L1 命中可省去 Redis 往返與整包解碼
+    SESSION_L1_ENABLED = os.getenv("SESSION_L1_ENABLED", "true").lower() == "true"
+    # 容量以 bytes 計算 (已解碼物件的估算大小)，預設每個 Worker 64 MB
+    SESSION_L1_MAX_BYTES = int(os.getenv("SESSION_L1_MAX_BYTES", 64 * 1024 * 1024))
+    # L1 存活秒數，實際值不會超過 SEARCH_SESSION_TTL
+    SESSION_L1_TTL = int(os.getenv("SESSION_L1_TTL", 120))
+
+    # -------- 意圖結果快取 (Whole-Pipeline Memoization) --------
+    # 相同意圖 (logic_tree / sort_conditions / info_needed / 網格化位置) 在 TTL 內直接重用排序結果
+    INTENT_CACHE_ENABLED = os.getenv("INTENT_CACHE_ENABLED", "true").lower() == "true"
+    # 為什麼預設只有 60 秒：店家資料會更新，意圖快取只為吸收短時間內的重複請求，不取代資料庫
+    INTENT_CACHE_TTL = int(os.getenv("INTENT_CACHE_TTL", 60))
+    INTENT_CACHE_MAX_BYTES = int(os.getenv("INTENT_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+    # user_location 四捨五入的小數位數 (3 位 ≈ 110 公尺網格)
+    INTENT_CACHE_GRID_DECIMALS = int(os.getenv("INTENT_CACHE_GRID_DECIMALS", 3))
+    # 是否啟用跨 Worker 的 Redis 第二層快取
+    INTENT_CACHE_REDIS_ENABLED = os.getenv("INTENT_CACHE_REDIS_ENABLED", "false").lower() == "true"
+
+    # -------- 位置感知候選快取 (Geo Candidate Cache) --------
+    # 意圖相同、位置落在同一個 Geohash 網格時重用 SQL + Qdrant 的候選集合，只重算距離與排序
+    # 為什麼與意圖結果快取分開：結果快取的距離固定為網格內第一位使用者的位置，候選快取則依每個請求的座標重算
+    GEO_CACHE_ENABLED = os.getenv("GEO_CACHE_ENABLED", "true").lower() == "true"
+    # Geohash 精度 (6 ≈ 1.2 km x 0.6 km；5 ≈ 4.9 km x 4.9 km)
+    GEO_CACHE_PRECISION = int(os.getenv("GEO_CACHE_PRECISION", 6))
+    GEO_CACHE_TTL = int(os.getenv("GEO_CACHE_TTL", 60))
+    # 每筆保存 150 筆候選的原始欄位，比排序結果大，另設容量上限
+    GEO_CACHE_MAX_BYTES = int(os.getenv("GEO_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+    # -------- Single-Flight 合併同時抵達的相同搜尋 --------
+    # 僅合併「進行中」的計算，完成後立即釋放，不會提供過期資料
+    SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
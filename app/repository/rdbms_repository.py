@@ -1,18 +1,28 @@
 # app/repository/rdbms_repository.py
 import time
+import json
 import asyncio
 from typing import List, Dict, Any, Tuple 
 import logging
 import aiomysql  
-from app.utils.app_logger import logger
+from app.utils.log_policy import get_logger, log_detail, lazy
+from app.utils.tracing import traced, annotate
 
-from app.utils.db import get_async_db_pool 
+from app.utils.db import get_async_db_pool, schedule_kill_query
+from app.config import Config
+
+logger = get_logger("rdbms")
+
+
+def _describe_params(params: Dict[str, Any]) -> str:
+    return ", ".join(f"{k}: {v} ({type(v).__name__})" for k, v in params.items())
 
 class RdbmsRepository:
     def __init__(self, use_mock: bool = False):
         logger.info("[RDBMS Repo] 初始化模式: REAL DB (Async)")
 
     # 這裡加入 s_id 參數，預設為 None 增加相容性
+    @traced("mysql.execute_dynamic_query")
     async def execute_dynamic_query(self, sql: str, params: Dict[str, Any], s_id: str = None) -> Tuple[List[Dict[str, Any]], float]:
         """
         執行動態 SQL 查詢並回傳結果與執行時間。
@@ -27,24 +37,36 @@ class RdbmsRepository:
                 async with conn.cursor(aiomysql.DictCursor) as cursor:
                     
                     # 1. Log 記錄 (參數內容與型別檢查對除錯非常有幫助)
-                    logger.info(f"{log_prefix} 執行 SQL: {sql}")
-                    param_info = ", ".join([f"{k}: {v} ({type(v).__name__})" for k, v in params.items()])
-                    logger.info(f"{log_prefix} 綁定參數: {param_info}")
+                    # 為什麼改用 log_detail：SQL 本文與參數每個請求都有，只取樣輸出，慢請求才完整補印
+                    log_detail(logger, "sql_body", "%s 執行 SQL: %s", log_prefix, sql)
+                    log_detail(logger, "sql_params", "%s 綁定參數: %s", log_prefix, lazy(_describe_params, params))
                     
                     # 2. 執行查詢
-                    await cursor.execute(sql, params)
-                    records = await cursor.fetchall()
+                    try:
+                        await cursor.execute(sql, params)
+                        records = await cursor.fetchall()
+                    except asyncio.CancelledError:
+                        # 請求截止時間到 (wait_for 取消) 或用戶端已斷線：回應封包可能只讀了一半，連線狀態不明，
+                        # 直接關閉而不是放回連線池，避免下一個請求讀到殘留的結果
+                        thread_id = conn.thread_id()
+                        conn.close()
+                        # 關閉連線不會停止伺服器端的查詢，另以 KILL QUERY 中止，釋放 MySQL 的執行資源
+                        if Config.MYSQL_KILL_ON_CANCEL and thread_id:
+                            logger.warning(f"{log_prefix} 查詢已取消，送出 KILL QUERY (thread_id={thread_id})")
+                            schedule_kill_query(thread_id)
+                        raise
                     
                     # 3. 計算執行時間
                     execution_time = time.time() - start_time
+                    annotate(rows=len(records))
                     
                     # 4. 結果診斷
                     if records:
-                        logger.info(f"{log_prefix} 取得第一筆資料範例: {records[0]}")
+                        log_detail(logger, "sql_sample_row", "%s 取得第一筆資料範例: %s", log_prefix, records[0])
                     else:
-                        logger.warning(f"{log_prefix} 查詢結果為空，請確認資料庫是否有對應資料")
+                        logger.warning("%s 查詢結果為空，請確認資料庫是否有對應資料", log_prefix)
                     
-                    logger.info(f"{log_prefix} 成功取得 {len(records)} 筆資料，耗時: {execution_time:.5f}秒")
+                    logger.info("%s 成功取得 %d 筆資料，耗時: %.5f秒", log_prefix, len(records), execution_time)
                     return list(records), execution_time
 
         except aiomysql.Error as e:
@@ -52,4 +74,47 @@ class RdbmsRepository:
             return [], 0.0
         except Exception as e:
             logger.error(f"{log_prefix} 系統程式碼錯誤: {e}")
-            return [], 0.0
\ No newline at end of file
+            return [], 0.0
+
+
+    @traced("mysql.explain")
+    async def explain_query(self, sql: str, params: Dict[str, Any], analyze: bool = False, s_id: str = None) -> Dict[str, Any]:
+        """
+        取得查詢的執行計畫 (供 /place_search 的 profile / dry_run 模式使用)。
+        :param analyze: True 使用 EXPLAIN ANALYZE (MySQL 8.0.18+，會真正執行查詢並回報實際列數與耗時)；
+                        False 使用 EXPLAIN FORMAT=JSON，只估算不執行
+        為什麼 analyze 失敗時退回 EXPLAIN：MariaDB 與舊版 MySQL 不支援 EXPLAIN ANALYZE 語法，退回後仍能看到索引選擇。
+        """
+        log_prefix = f"[RDBMS Repo][SID: {s_id}]" if s_id else "[RDBMS Repo]"
+        start_time = time.perf_counter()
+        try:
+            pool = await get_async_db_pool()
+            async with pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    if analyze:
+                        try:
+                            await cursor.execute("EXPLAIN ANALYZE " + sql, params)
+                            rows = await cursor.fetchall()
+                            return {
+                                "mode": "analyze",
+                                "plan": "\n".join(str(next(iter(row.values()))) for row in rows),
+                                "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2),
+                            }
+                        except aiomysql.Error as e:
+                            logger.warning(f"{log_prefix} EXPLAIN ANALYZE 不支援，退回 EXPLAIN: {e}")
+
+                    await cursor.execute("EXPLAIN FORMAT=JSON " + sql, params)
+                    rows = await cursor.fetchall()
+                    raw = next(iter(rows[0].values())) if rows else "{}"
+                    try:
+                        plan = json.loads(raw)
+                    except (TypeError, ValueError):
+                        plan = raw
+                    return {
+                        "mode": "json",
+                        "plan": plan,
+                        "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2),
+                    }
+        except Exception as e:
+            logger.error(f"{log_prefix} 取得執行計畫失敗: {e}")
+            return {"mode": "error", "error": str(e)}
@@ -1,20 +1,23 @@
 # app/repository/vector_repository.py
-from typing import List, Any
+from typing import List, Any, Tuple
 from app.models.search_dto import VectorSearchResult
 from qdrant_client.http import models as qmodels
 from app.config import Config
 from app.utils.db import get_qdrant_client
 from app.utils.app_logger import logger
+from app.utils.tracing import traced, annotate
+from app.utils.request_profile import profile_record
+from app.utils.admission import admission
 import asyncio
+import time
 
 
 class VectorRepository:
-    def __init__(self, use_mock: bool = False):
-        self.gpu_limit = asyncio.Semaphore(10)
+    def __init__(self, use_mock: bool = False, client=None, collection_name: str = None):
         self.use_mock = use_mock
-        self.collection_name = Config.COLLECTION_NAME
-        # 內部快取變數
-        self._cached_client = None 
+        self.collection_name = collection_name or Config.COLLECTION_NAME
+        # 內部快取變數；可注入現成的 AsyncQdrantClient (例如壓測用的 location=":memory:" 本機模式)
+        self._cached_client = client 
 
     async def _ensure_client(self):
         """確保 client 已從 db.py 載入並返回"""
@@ -50,8 +53,9 @@ class VectorRepository:
         search_filter = qmodels.Filter(must=filter_conditions)
 
         # 將自然語言搜尋字串轉成向量
-        async with self.gpu_limit:
-            query_vector = self.model.encode(query_str, normalize_embeddings=True).tolist()
+        # 與 VectorService 共用 inference 名額 (原本獨立的 Semaphore(10) 並未限制到真正的推論)
+        async with admission.limit("inference"):
+            query_vector = (await asyncio.to_thread(self.model.encode, query_str, normalize_embeddings=True)).tolist()
         
 
         try:
@@ -84,6 +88,7 @@ class VectorRepository:
                 ]
     
 
+    @traced("qdrant.search_in_ids_hybrid")
     async def search_in_ids_hybrid(
         self, 
         query_vector: List[float],
@@ -93,28 +98,14 @@ class VectorRepository:
         
         self.client = await self._ensure_client()
 
-        try:
-            clean_ids = [int(i) for i in rdbms_ids if i is not None]
-        except (ValueError, TypeError):
-            return []
-        if not clean_ids: return []
-
-        # 1. 基礎 Place ID 範圍過濾
-        filter_conditions = [
-            qmodels.FieldCondition(key="place_id", match=qmodels.MatchAny(any=clean_ids))
-        ]
-
-        # 2. 硬性屬性過濾 (Filtering)
-        if facility_tags:
-            for tag in facility_tags:
-                filter_conditions.append(
-                    qmodels.FieldCondition(key="facility_tags", match=qmodels.MatchValue(value=tag))
-                )
-
-        search_filter = qmodels.Filter(must=filter_conditions)
+        built = self._hybrid_filter(rdbms_ids, facility_tags)
+        if built is None: return []
+        search_filter, clean_ids, filter_conditions = built
+        annotate(candidate_ids=len(clean_ids), facility_tags=len(facility_tags or []))
 
 
         # 4. 執行搜尋
+        t_query = time.perf_counter()
         try:
             logger.info(f"執行混合過濾搜尋，範圍筆數: {len(clean_ids)}, 硬性標籤: {facility_tags}")
             response = await self.client.query_points(
@@ -134,6 +125,17 @@ class VectorRepository:
                 with_payload=True
             )
 
+        profile_record(
+            "qdrant",
+            mode="hybrid",
+            filter_ids=len(clean_ids),
+            facility_tags=list(facility_tags or []),
+            filter_conditions=len(filter_conditions),
+            limit=30,
+            returned=len(results),
+            ms=round((time.perf_counter() - t_query) * 1000, 2),
+        )
+
         return [VectorSearchResult(
                 id=res.payload.get("place_id"), 
                 score=res.score,
@@ -142,6 +144,92 @@ class VectorRepository:
     
 
 
+    @staticmethod
+    def _hybrid_filter(rdbms_ids: List[Any], facility_tags: List[str] = None):
+        """
+        組出混合搜尋的過濾條件 (Place ID 範圍 + 硬性屬性標籤)。
+        :return: (Filter, clean_ids, filter_conditions)；沒有有效 ID 時回傳 None
+        """
+        try:
+            clean_ids = [int(i) for i in rdbms_ids if i is not None]
+        except (ValueError, TypeError):
+            return None
+        if not clean_ids: return None
+
+        # 1. 基礎 Place ID 範圍過濾
+        filter_conditions = [
+            qmodels.FieldCondition(key="place_id", match=qmodels.MatchAny(any=clean_ids))
+        ]
+
+        # 2. 硬性屬性過濾 (Filtering)
+        if facility_tags:
+            for tag in facility_tags:
+                filter_conditions.append(
+                    qmodels.FieldCondition(key="facility_tags", match=qmodels.MatchValue(value=tag))
+                )
+
+        return qmodels.Filter(must=filter_conditions), clean_ids, filter_conditions
+
+    @traced("qdrant.search_in_ids_hybrid_batch")
+    async def search_in_ids_hybrid_batch(
+        self,
+        requests: List[Tuple[List[float], List[Any], List[str]]]
+    ) -> List[List[VectorSearchResult]]:
+        """
+        批次版的 search_in_ids_hybrid：requests 為 (query_vector, rdbms_ids, facility_tags) 列表，回傳順序與輸入一致。
+        為什麼需要：POST /place_search/batch 一次處理多個意圖，合併成一次 Qdrant 往返，而不是 N 次 query_points。
+        """
+        self.client = await self._ensure_client()
+
+        results: List[List[VectorSearchResult]] = [[] for _ in requests]
+        sendable = []
+        for idx, (query_vector, rdbms_ids, facility_tags) in enumerate(requests):
+            built = self._hybrid_filter(rdbms_ids, facility_tags)
+            if built is not None:
+                sendable.append((idx, query_vector, built[0]))
+        annotate(batch_size=len(requests), batch_sent=len(sendable))
+        if not sendable:
+            return results
+
+        t_query = time.perf_counter()
+        try:
+            logger.info(f"執行批次混合過濾搜尋，共 {len(sendable)} 組查詢")
+            responses = await self.client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[
+                    qmodels.QueryRequest(query=vector, filter=search_filter, limit=30, with_payload=True)
+                    for _, vector, search_filter in sendable
+                ],
+            )
+            batches = [response.points for response in responses]
+        except AttributeError:
+            # 舊版 qdrant-client 沒有 Query API
+            batches = await self.client.search_batch(
+                collection_name=self.collection_name,
+                requests=[
+                    qmodels.SearchRequest(vector=vector, filter=search_filter, limit=30, with_payload=True)
+                    for _, vector, search_filter in sendable
+                ],
+            )
+
+        profile_record(
+            "qdrant",
+            mode="hybrid_batch",
+            batch_size=len(sendable),
+            limit=30,
+            returned=sum(len(points) for points in batches),
+            ms=round((time.perf_counter() - t_query) * 1000, 2),
+        )
+
+        for (idx, _, _), points in zip(sendable, batches):
+            results[idx] = [VectorSearchResult(
+                id=res.payload.get("place_id"),
+                score=res.score,
+                review_summary=res.payload.get("review_summary", "")
+            ) for res in points if res.payload]
+        return results
+
+
     async def get_dtos_by_ids(self, rdbms_ids: List[Any]) -> List[VectorSearchResult]:
 
         self.client = await self._ensure_client()
@@ -149,6 +237,7 @@ class VectorRepository:
         clean_ids = [int(i) for i in rdbms_ids if i is not None]
         
         # 使用 scroll 進行精確抓取
+        t_query = time.perf_counter()
         response, _ = await self.client.scroll(
             collection_name=self.collection_name,
             scroll_filter=qmodels.Filter(must=[
@@ -157,6 +246,13 @@ class VectorRepository:
             with_payload=True, # 必須設為 True 才能拿回 review_summary 等資料
             limit=len(clean_ids)
         )
+        profile_record(
+            "qdrant",
+            mode="scroll",
+            filter_ids=len(clean_ids),
+            returned=len(response),
+            ms=round((time.perf_counter() - t_query) * 1000, 2),
+        )
         
         # 直接回傳封裝好的 DTO，LLM 拿到的就是完整的上下文 (Context)
         return [VectorSearchResult(
@@ -11,6 +11,9 @@ Controller 層匯入中心
 """
 from fastapi import APIRouter
 from .hybird_search_routes import place_search
+from .metrics_routes import metrics_router
+from .admin_routes import admin_router
+from .health_routes import health_router
 
 
 # 建立一個總路由
@@ -19,5 +22,8 @@ api_router = APIRouter()
 # 註冊所有子路由
 # 未來如果有新的路由，直接在這裡增加一行即可
 api_router.include_router(place_search, tags=["Search"])
+api_router.include_router(metrics_router, tags=["Monitoring"])
+api_router.include_router(admin_router, tags=["Admin"])
+api_router.include_router(health_router, tags=["Monitoring"])
 
 __all__ = ["api_router"]
\ No newline at end of file
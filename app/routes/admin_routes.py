@@ -0,0 +1,82 @@
+# app/routes/admin_routes.py
+import asyncio
+import hmac
+import json
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+
+from app.config import Config
+from app.utils.app_logger import logger
+from app.utils.sampling_profiler import ProfilerBusyError, sampling_profiler
+
+
+admin_router = APIRouter(prefix="/admin")
+
+
+def verify_admin_token(token: str) -> bool:
+    """
+    比對 X-Admin-Token 與 Config.ADMIN_TOKEN；未設定 ADMIN_TOKEN 時一律回傳 False。
+    也供 /place_search 的 profile / dry_run 模式使用 (會回傳 SQL 與執行計畫)。
+    """
+    if not Config.ADMIN_TOKEN:
+        return False
+    # compare_digest：避免以回應時間差逐字元猜出 Token
+    return hmac.compare_digest((token or "").encode("utf-8"), Config.ADMIN_TOKEN.encode("utf-8"))
+
+
+def require_admin_token(x_admin_token: str = Header(default="")) -> None:
+    """
+    管理端點驗證：比對 X-Admin-Token 與 Config.ADMIN_TOKEN。
+    為什麼未設定 ADMIN_TOKEN 時一律拒絕：管理端點能讀到所有執行緒的堆疊 (含檔案路徑)，不能因為漏設環境變數而對外開放。
+    """
+    if not Config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not verify_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail={"status": "forbidden", "message": "Invalid admin token"})
+
+
+@admin_router.get("/profile", include_in_schema=False, dependencies=[Depends(require_admin_token)])
+async def profile(
+    seconds: float = Query(10.0, gt=0, description="取樣秒數 (上限 Config.PROFILER_MAX_SECONDS)"),
+    interval_ms: float = Query(None, ge=1, le=1000, description="取樣間隔 (毫秒)；預設 Config.PROFILER_INTERVAL_MS"),
+    format: str = Query("speedscope", pattern="^(speedscope|collapsed)$", description="輸出格式"),
+    tag_spans: bool = Query(True, description="以目前所在的 Trace Span 標記樣本"),
+    include_idle: bool = Query(False, description="保留閒置 (等待 I/O / 等待工作) 的樣本"),
+):
+    """
+    對本 Worker 進行 N 秒的取樣分析，回傳火焰圖檔案。
+
+    呼叫範例：
+    curl -H "X-Admin-Token: $ADMIN_TOKEN" "http://127.0.0.1:5003/admin/profile?seconds=15" -o profile.speedscope.json
+
+    注意：多 Worker 部署時只會分析「接到這個請求的那一個」Worker；要指定 Worker 請改用 kill -USR2 <pid>。
+    """
+    seconds = min(seconds, Config.PROFILER_MAX_SECONDS)
+    interval = (interval_ms or Config.PROFILER_INTERVAL_MS) / 1000
+
+    # 取樣在執行緒池中進行：Event Loop 必須保持運作，才能取樣到正在處理的搜尋請求
+    try:
+        result = await asyncio.to_thread(sampling_profiler.profile, seconds, interval, tag_spans, include_idle)
+    except ProfilerBusyError:
+        raise HTTPException(status_code=409, detail={"status": "busy", "message": "Profiler is already running"})
+
+    logger.info(f"[Profiler] /admin/profile 取樣完成: {result.summary()}")
+    summary_header = json.dumps(result.summary())
+
+    if format == "collapsed":
+        return Response(
+            content=result.to_collapsed(),
+            media_type="text/plain; charset=utf-8",
+            headers={
+                "Content-Disposition": 'attachment; filename="profile.collapsed.txt"',
+                "X-Profile-Summary": summary_header,
+            },
+        )
+    return Response(
+        content=json.dumps(result.to_speedscope()),
+        media_type="application/json",
+        headers={
+            "Content-Disposition": 'attachment; filename="profile.speedscope.json"',
+            "X-Profile-Summary": summary_header,
+        },
+    )
@@ -0,0 +1,31 @@
+# app/routes/health_routes.py
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.utils.readiness import readiness
+
+
+health_router = APIRouter()
+
+_STARTED_AT = time.time()
+
+
+@health_router.get("/healthz", include_in_schema=False)
+async def healthz():
+    """
+    存活探針 (Liveness)：只要 Event Loop 能回應就回傳 200。
+    為什麼不檢查依賴：MySQL / Qdrant 暫時斷線時重啟 Worker 無濟於事，只會讓所有 Worker 同時重新載入模型。
+    """
+    return {"status": "ok", "uptime_s": round(time.time() - _STARTED_AT, 1)}
+
+
+@health_router.get("/readyz", include_in_schema=False)
+async def readyz():
+    """
+    就緒探針 (Readiness)：所有依賴 (mysql / redis / qdrant / embedding) 暖機完成才回傳 200，否則 503。
+    回應附上各依賴的耗時、嘗試次數與最後一次錯誤，滾動部署卡住時可直接看出是哪一個依賴。
+    """
+    snapshot = readiness.snapshot()
+    return JSONResponse(status_code=200 if snapshot["ready"] else 503, content=snapshot)
@@ -1,15 +1,30 @@
 
 # app/routes/hybrid_search_routes.py
-from fastapi import APIRouter, HTTPException, Body, Query,Request
+from fastapi import APIRouter, HTTPException, Body, Query,Request, Header, Response
+from fastapi.responses import StreamingResponse
 from app.utils.performance_tracker import log_performance_to_csv
-from app.utils.data_formatter import format_response_data   # 格式化搜尋結果與補上照片
 from app.config import Config
-from app.utils.app_logger import logger
+from app.utils.log_policy import get_logger, log_detail
 from app.utils.quality_checker import check_search_status
 from app.utils.quality_checker import evaluate_search_quality
 from app.utils.quality_checker import analyze_search_results
+from app.utils.metrics_registry import observe_search, record_search_result, PAGE_REQUESTS, SESSION_OPERATIONS
+from app.utils.tracing import annotate_root
+from app.utils.request_capture import capture_payload, capture_search, capture_page
+from app.utils.request_profile import profile_scope
+from app.utils.deadline import DeadlineExceeded, deadline_scope
+from app.utils.admission import AdmissionRejected, admission, retry_after_header
+from app.utils.client_disconnect import CLIENT_CLOSED_REQUEST, ClientDisconnected, disconnect_guard
+from app.utils.json_response import FastJSONResponse, dumps as json_dumps
+from app.utils.response_projection import parse_fields, project_response
+from app.routes.admin_routes import verify_admin_token
+from contextlib import nullcontext
+from typing import Optional
+import asyncio
 import time
 
+logger = get_logger("search_route")
+
 
 place_search = APIRouter()
 
@@ -18,13 +33,29 @@ place_search = APIRouter()
 @place_search.post("/place_search")
 async def generate_query_and_search(
     request: Request,
-    ai_to_api_data: dict = Body(...)
+    ai_to_api_data: dict = Body(...),
+    profile: bool = Query(False, description="剖析模式：回應附上 SQL、EXPLAIN ANALYZE、Qdrant 過濾範圍與各階段耗時 (需 X-Admin-Token)"),
+    dry_run: bool = Query(False, description="只產生 SQL 與向量查詢計畫，不執行查詢 (需 X-Admin-Token)"),
+    view: Optional[str] = Query(None, pattern="^(minimal|llm|full)$", description="回應檢視：minimal / llm / full (預設 Config.RESPONSE_DEFAULT_VIEW)"),
+    fields: Optional[str] = Query(None, description="逗號分隔的店家欄位 (例如 id,restaurant_name)，優先於 view"),
+    x_admin_token: str = Header(default=""),
+    x_request_deadline_ms: Optional[float] = Header(default=None, gt=0)
     ):
         """
         RAG混和查詢端點
         資料流說明: SQL BUILDER --> MYSQL --> VECTOR SERVICE --> QDRANT --> VECTOR SERVICE
         輸出內容會是第一頁
 
+        除錯模式 (皆需 X-Admin-Token，回應會包含 SQL 與參數，不可對一般呼叫端開放)：
+        POST /place_search?profile=true  正常執行搜尋 (繞過意圖結果快取)，回應多一個 "profile" 欄位
+        POST /place_search?dry_run=true  只回傳 SQL、EXPLAIN 與向量查詢計畫，不建立 Session
+
+        回應檢視：?view=minimal|llm|full 或 ?fields=id,restaurant_name 裁切每筆店家的欄位 (翻頁端點相同)，
+        只需要店名與 ID 的呼叫端不必接收照片、分數明細與向量診斷。
+
+        時間預算：X-Request-Deadline-Ms 標頭 (或 Config.REQUEST_DEADLINE_MS) 會傳遞到各階段作為 timeout，
+        預算不足時依序略過 COUNT、縮減候選、改走純指標排序，並在 search_status 標記 degraded；主 SQL 超時回傳 504。
+
         GENERATE MODEL呼叫範例：
         POST https://192.168.1.118:5004/place_search
 
@@ -69,206 +100,586 @@ async def generate_query_and_search(
         #   2. 所有請求共用同一份實例（Singleton），節省記憶體，避免競態
         #   3. 若 startup 失敗，服務不會啟動，而非等到請求進來才發現問題
         builder       = request.app.state.builder
-        vector_service = request.app.state.vector_service
-        rdbms_repo    = request.app.state.rdbms_repo
         session_cache = request.app.state.session_cache  # key 名稱需與 __init__.py 中 app.state.session_cache 一致
+        search_pipeline = request.app.state.search_pipeline  # 封裝 RdbmsRepository 與 VectorService 的檢索主流程
 
         # 獲取並檢查資料
         if not ai_to_api_data:
             # FastAPI 使用 raise HTTPException 來處理錯誤，這會自動轉換為 JSON 回傳給前端
             raise HTTPException(status_code=400, detail={"status": "fail", "message": "No data"})
+
+        # 必須在 try 之外檢查：try 內的 HTTPException 會被轉成 500
+        if (profile or dry_run) and not verify_admin_token(x_admin_token):
+            raise HTTPException(status_code=403, detail={"status": "forbidden", "message": "profile / dry_run require a valid X-Admin-Token"})
         
-        logger.info(f"fetched data: {ai_to_api_data}")
+        # 整包請求內容只取樣輸出 (慢請求會完整補印)，避免每個請求都格式化大型 dict
+        log_detail(logger, "request_payload", "fetched data: %s", ai_to_api_data)
 
-        try:
+        # 流量擷取 (Config.CAPTURE_ENABLED)：未被抽中時為 None，之後不做任何事
+        # 除錯請求不代表正式流量，不擷取
+        capture_snapshot = capture_payload(ai_to_api_data) if not (profile or dry_run) else None
 
-            all_ranked_results = []
-            first_page_results = []
-            quality_label = "no_data" # 預設狀態
+        try:
 
             # 針對輸入的json進行分析意圖
             plan = builder.analyze_intent(ai_to_api_data)
 
             s_id = plan.get("s_id")
+            annotate_root(s_id=s_id)
 
-            # --- 階段一：SQL 查詢 ---
-            rdb_info = {"status": "sql_no_data", "total_count": 0, "is_fallback": False}
+            if dry_run:
+                return {
+                    "s_id": s_id,
+                    "status": "dry_run",
+                    "data": await search_pipeline.dry_run(plan)
+                }
 
-            t_sql_start = time.perf_counter()
+            # 剖析模式要看到完整流程的實際耗時，不套用截止時間
+            budget_ms = None if profile else _deadline_budget_ms(x_request_deadline_ms, t0)
+
+            # --- SQL → 向量搜尋 → 權重排序 → 格式化 (含意圖結果快取) ---
+            # 命中快取時會直接跳過檢索，進入下方的品質分析與 Session 建立
+            # 用戶端斷線 (LLM 調度端逾時) 時取消檢索：進行中的 MySQL 查詢會被 KILL，Qdrant 請求隨之中止
+            with (profile_scope() if profile else nullcontext()) as request_profile, deadline_scope(budget_ms), \
+                    disconnect_guard(request) as client_guard:
+                if client_guard is not None:
+                    # 在准入佇列中等待期間就已斷線的請求，連 SQL 都不必送出
+                    client_guard.checkpoint("pipeline")
+                    outcome = await client_guard.watch(search_pipeline.run(plan, profile=profile), "pipeline")
+                else:
+                    outcome = await search_pipeline.run(plan, profile=profile)
+
+            response = await _finalize_search(
+                request, plan, outcome, session_cache, t0,
+                capture_snapshot=capture_snapshot, client_guard=client_guard
+            )
+            # 在序列化之前裁切 (?view= / ?fields=)，並跳過 jsonable_encoder 直接以 orjson 輸出
+            response = project_response(response, view, parse_fields(fields))
+            if request_profile is not None:
+                response["profile"] = _finish_profile(request_profile, outcome["timings"], time.perf_counter() - t0)
+            return FastJSONResponse(response)
+
+        except ClientDisconnected as e:
+            # 回應不會被讀取；499 只留在存取日誌與 Trace 中
+            logger.warning(f"[Search] 用戶端已斷線，中止後續工作 (階段: {e.stage})")
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        except AdmissionRejected as e:
+            # MySQL 滿載：主查詢無法降級，快速回絕讓呼叫端稍後重試
+            logger.warning(f"[Search] {e}，回傳 503")
+            raise HTTPException(
+                status_code=503,
+                detail={"status": "overloaded", "stage": e.stage, "reason": e.reason},
+                headers=retry_after_header(e)
+            )
+        except DeadlineExceeded as e:
+            logger.warning(f"[Search] 超過請求截止時間 (階段: {e.stage})，回傳 504")
+            raise HTTPException(
+                status_code=504,
+                detail={"status": "deadline_exceeded", "stage": e.stage, "message": "搜尋超過時間預算"}
+            )
+        except Exception as e:
+            logger.error(f"Search API Error: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
 
-            final_sql, query_params = builder.build_sql(plan)
-            logger.info(f"[Search][SID: {s_id}] 執行 SQL 查詢")
 
-            db_results, _ = await rdbms_repo.execute_dynamic_query(final_sql, query_params, s_id)
+@place_search.post("/place_search/batch")
+async def batch_search(
+    request: Request,
+    payload: dict = Body(...),
+    view: Optional[str] = Query(None, pattern="^(minimal|llm|full)$", description="回應檢視：minimal / llm / full (預設 Config.RESPONSE_DEFAULT_VIEW)"),
+    fields: Optional[str] = Query(None, description="逗號分隔的店家欄位 (例如 id,restaurant_name)，優先於 view"),
+    x_request_deadline_ms: Optional[float] = Header(default=None, gt=0)
+    ):
+        """
+        批次混和查詢端點：一次送出多個意圖 (例如 LLM 把「附近的拉麵、咖啡廳、停車場」拆成三個查詢)。
 
-            count_sql, count_params = builder.build_count_sql(plan)
-            count_results, _ = await rdbms_repo.execute_dynamic_query(count_sql, count_params, s_id)
+        為什麼需要：逐一呼叫 POST /place_search 時，每個意圖各自做一次 Embedding 推論與一次 Qdrant 請求；
+        批次端點讓所有意圖的 SQL 平行執行，查詢字串合併成一次 model.encode，Qdrant 以 query_batch_points 一次送出。
 
-            t_sql_done = time.perf_counter()
+        • 每個意圖各自建立 Session (search_ssid) 並回傳第一頁，格式與 POST /place_search 相同
+        • 重複的意圖 (指紋相同) 只執行一次，回應標記 pipeline_source = "coalesced"
+        • 單一意圖失敗 (解析錯誤 / 逾時 / 過載) 只影響該項，其餘照常回傳；整批共用一個時間預算
+        • 意圖數上限為 Config.BATCH_MAX_INTENTS
 
-            sql_service_duration = t_sql_done - t_sql_start
+        POST /place_search/batch
+        {
+        "intents": [
+            { "s_id": "abc123", "status": "success", "data": { ... } },
+            { "s_id": "abc124", "status": "success", "data": { ... } }
+            ]
+        }
+        """
+        t0 = time.perf_counter()
 
+        builder       = request.app.state.builder
+        session_cache = request.app.state.session_cache
+        search_pipeline = request.app.state.search_pipeline
 
-            total_count = count_results[0]['total'] if count_results else 0
+        intents = payload.get("intents") if isinstance(payload, dict) else None
+        if not isinstance(intents, list) or not intents:
+            raise HTTPException(status_code=400, detail={"status": "fail", "message": "intents must be a non-empty list"})
+        if len(intents) > Config.BATCH_MAX_INTENTS:
+            raise HTTPException(
+                status_code=400,
+                detail={"status": "fail", "message": f"at most {Config.BATCH_MAX_INTENTS} intents per batch"}
+            )
 
-            if total_count == 0:
-                logger.warning(f"[Search][SID: {s_id}] SQL 查無資料，直接回傳")
-                search_status = check_search_status([], plan, total_count=0)
-                quality_label, is_fallback, ai_hint = evaluate_search_quality(
-                    [],
-                    {"status": "no_data", "message": ""},
-                    rdb_info=rdb_info,
-                    plan=plan
-                )
-                return {
+        log_detail(logger, "request_payload", "fetched batch: %s", intents)
+
+        try:
+            # 意圖解析失敗只影響該項；results 依輸入順序回傳
+            results: list = [None] * len(intents)
+            plans, positions = [], []
+            for idx, ai_to_api_data in enumerate(intents):
+                try:
+                    if not ai_to_api_data:
+                        raise ValueError("No data")
+                    plans.append(builder.analyze_intent(ai_to_api_data))
+                    positions.append(idx)
+                except Exception as e:
+                    s_id = ai_to_api_data.get("s_id") if isinstance(ai_to_api_data, dict) else None
+                    results[idx] = {"s_id": s_id, "status": "fail", "message": str(e)}
+
+            annotate_root(batch_size=len(intents))
+
+            with deadline_scope(_deadline_budget_ms(x_request_deadline_ms, t0)), \
+                    disconnect_guard(request) as client_guard:
+                if plans:
+                    if client_guard is not None:
+                        client_guard.checkpoint("pipeline")
+                        outcomes = await client_guard.watch(search_pipeline.run_batch(plans), "pipeline")
+                    else:
+                        outcomes = await search_pipeline.run_batch(plans)
+                else:
+                    outcomes = []
+
+                # 各意圖的 Session 建立互不相依，平行寫入 Redis
+                async def finalize(plan, outcome):
+                    if isinstance(outcome, BaseException):
+                        return _batch_item_error(plan, outcome)
+                    try:
+                        return await _finalize_search(None, plan, outcome, session_cache, t0, client_guard=client_guard)
+                    except ClientDisconnected:
+                        raise
+                    except Exception as e:
+                        return _batch_item_error(plan, e)
+
+                finalized = await asyncio.gather(*(finalize(p, o) for p, o in zip(plans, outcomes)))
+
+            field_set = parse_fields(fields)
+            for idx, item in zip(positions, finalized):
+                results[idx] = project_response(item, view, field_set)
+
+            # 單項的 status 是品質標籤 (success / partial_success / no_data)，只有下列狀態代表該項失敗
+            succeeded = sum(1 for item in results if item.get("status") not in _BATCH_ITEM_FAILURES)
+            return FastJSONResponse({
+                "status": "success" if succeeded == len(results) else ("partial" if succeeded else "fail"),
+                "count": len(results),
+                "results": results,
+            })
+
+        except ClientDisconnected as e:
+            logger.warning(f"[Search Batch] 用戶端已斷線，中止後續工作 (階段: {e.stage})")
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        except Exception as e:
+            logger.error(f"Search Batch API Error: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+_BATCH_ITEM_FAILURES = ("fail", "overloaded", "deadline_exceeded", "error")
+
+
+def _batch_item_error(plan: dict, error: BaseException) -> dict:
+    """批次中單一意圖的失敗項目；狀態字串與 POST /place_search 的 503 / 504 detail 一致。"""
+    s_id = plan.get("s_id")
+    if isinstance(error, AdmissionRejected):
+        return {"s_id": s_id, "status": "overloaded", "stage": error.stage, "reason": error.reason}
+    if isinstance(error, DeadlineExceeded):
+        return {"s_id": s_id, "status": "deadline_exceeded", "stage": error.stage, "message": "搜尋超過時間預算"}
+    logger.error(f"[Search Batch] 意圖執行失敗 (s_id={s_id}): {error!r}")
+    return {"s_id": s_id, "status": "error", "message": str(error)}
+
+
+@place_search.post("/place_search/stream")
+async def stream_search(
+    request: Request,
+    ai_to_api_data: dict = Body(...),
+    view: Optional[str] = Query(None, pattern="^(minimal|llm|full)$", description="回應檢視：minimal / llm / full (預設 Config.RESPONSE_DEFAULT_VIEW)"),
+    fields: Optional[str] = Query(None, description="逗號分隔的店家欄位 (例如 id,restaurant_name)，優先於 view"),
+    format: Optional[str] = Query(None, pattern="^(ndjson|sse)$", description="ndjson 或 sse；未指定時依 Accept 標頭 (text/event-stream → sse)"),
+    x_request_deadline_ms: Optional[float] = Header(default=None, gt=0)
+    ):
+        """
+        串流版搜尋端點：與 POST /place_search 相同的檢索流程，但分段送出結果。
+
+        為什麼需要：一般端點要等 SQL、COUNT、Embedding、Qdrant、排序、格式化與 Redis 寫入全部完成才有回應；
+        聊天介面在這段時間什麼都看不到，LLM 也無法提早開始生成。
+
+        事件依序為：
+            plan        意圖解析完成後立即送出 (是否走語意搜尋、關鍵字、排序條件、座標來源)
+            first_page  排序與品質分析完成後送出，格式與 POST /place_search 的回應相同，但尚無 search_ssid / pagination
+            pagination  Session 建立後送出 search_ssid 與分頁元數據，之後即可呼叫 GET /place_search/page
+            error       執行途中失敗 (deadline_exceeded / overloaded / error)；標頭已送出，無法再改狀態碼
+
+        格式：NDJSON (application/x-ndjson，每行 {"event": ..., "data": ...}) 或 SSE (text/event-stream)。
+        用戶端斷線時 StreamingResponse 會取消產生器，進行中的 MySQL 查詢一樣會被 KILL。
+        """
+        t0 = time.perf_counter()
+
+        builder = request.app.state.builder
+
+        if not ai_to_api_data:
+            raise HTTPException(status_code=400, detail={"status": "fail", "message": "No data"})
+
+        log_detail(logger, "request_payload", "fetched data: %s", ai_to_api_data)
+
+        if format is None:
+            format = "sse" if "text/event-stream" in request.headers.get("accept", "") else "ndjson"
+
+        # 意圖解析在送出標頭之前完成：格式錯誤仍是一般的錯誤狀態碼，而不是 200 + error 事件
+        try:
+            plan = builder.analyze_intent(ai_to_api_data)
+        except Exception as e:
+            logger.error(f"Search Stream API Error: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
+
+        annotate_root(s_id=plan.get("s_id"), stream=format)
+
+        return StreamingResponse(
+            _stream_search_events(
+                request, plan, _deadline_budget_ms(x_request_deadline_ms, t0), t0, format, view, parse_fields(fields)
+            ),
+            media_type=_STREAM_MEDIA_TYPES[format],
+            # 關閉反向代理 (nginx) 的回應緩衝，否則事件會被攢到最後一起送出
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+_STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def _encode_event(format: str, event: str, data: dict) -> bytes:
+    if format == "sse":
+        return b"event: " + event.encode("ascii") + b"\ndata: " + json_dumps(data) + b"\n\n"
+    return json_dumps({"event": event, "data": data}) + b"\n"
+
+
+async def _stream_search_events(
+    request: Request,
+    plan: dict,
+    budget_ms: Optional[float],
+    t0: float,
+    format: str,
+    view: Optional[str] = None,
+    fields=None
+):
+    session_cache = request.app.state.session_cache
+    search_pipeline = request.app.state.search_pipeline
+    s_id = plan.get("s_id")
+
+    yield _encode_event(format, "plan", {
+        "s_id": s_id,
+        "vector_needed": plan.get("vector_needed"),
+        "vector_keywords": plan.get("vector_keywords"),
+        "sort_conditions": plan.get("sort_conditions"),
+        "location_source": plan.get("location_source"),
+    })
+
+    try:
+        # 串流回應送出標頭後 Middleware 就會釋放 search 名額，檢索期間在此重新佔用，准入控制才不會被串流繞過
+        with deadline_scope(budget_ms):
+            async with admission.limit("search"):
+                outcome = await search_pipeline.run(plan)
+
+                analysis = _analyze_outcome(None, plan, outcome)
+                yield _encode_event(format, "first_page", project_response({
                     "s_id": s_id,
-                    "status": quality_label,
+                    "status": analysis["quality_label"],
                     "data": {
-                        "is_fallback": is_fallback,
-                        "ai_behavior_hint": ai_hint,
-                        "search_status": search_status,
-                        "vector_search_info": {},
-                        "pagination": {"current_page": 1, "total_pages": 0, "total_results": 0, "page_size": Config.PAGE_SIZE},
-                        "final_results": []
+                        "is_fallback": analysis["is_fallback"],
+                        "ai_behavior_hint": analysis["ai_hint"],
+                        "search_status": analysis["search_status"],
+                        "vector_search_info": analysis["vector_search_info"],
+                        # 與 SearchSessionCache._slice_page 的第 1 頁相同
+                        "final_results": outcome["results"][:Config.PAGE_SIZE],
                     }
-                }
-
-            rdb_info["total_count"] = total_count
-            rdb_info["status"] = "exact_one_match" if total_count == 1 else "success"
-            logger.info(f"[Search][SID: {s_id}] SQL 命中 {total_count} 筆")
+                }, view, fields))
+
+                response = await _finalize_search(None, plan, outcome, session_cache, t0, analysis=analysis)
+
+        yield _encode_event(format, "pagination", {
+            "s_id": s_id,
+            "search_ssid": response.get("search_ssid"),
+            "pagination": response["data"]["pagination"],
+        })
+
+    except AdmissionRejected as e:
+        logger.warning(f"[Search Stream] {e}")
+        yield _encode_event(format, "error", {"s_id": s_id, "status": "overloaded", "stage": e.stage, "reason": e.reason})
+    except DeadlineExceeded as e:
+        logger.warning(f"[Search Stream] 超過請求截止時間 (階段: {e.stage})")
+        yield _encode_event(format, "error", {"s_id": s_id, "status": "deadline_exceeded", "stage": e.stage, "message": "搜尋超過時間預算"})
+    except Exception as e:
+        logger.error(f"Search Stream API Error: {e}", exc_info=True)
+        yield _encode_event(format, "error", {"s_id": s_id, "status": "error", "message": str(e)})
 
 
-            # --- 執行搜尋與權重排序 ---
-            # 這裡直接取代掉原本從 vector_ids_for_sql 到 db_results = db_results[:3] 的所有內容
-            t_sql_done = time.perf_counter()
-            sql_service_duration = t_sql_done - t0
+def _analyze_outcome(request: Optional[Request], plan: dict, outcome: dict) -> dict:
+    """
+    檢索結果的品質分析 (純記憶體運算)：得出 quality_label / is_fallback / ai_hint 等給 LLM 的訊號。
+    與 Session 寫入分開，串流端點 (POST /place_search/stream) 才能在寫入 Redis 之前先送出第一頁。
+    """
+    if outcome["cache_hit"]:
+        pipeline_source = "intent_cache"
+    elif outcome["geo_rerank"]:
+        pipeline_source = "geo_cache"
+    elif outcome["coalesced"]:
+        pipeline_source = "coalesced"
+    else:
+        pipeline_source = "executed"
+
+    # 交給 Middleware 輸出 Server-Timing 標頭 (Config.SERVER_TIMING_ENABLED)，壓測工具據此統計各階段分位數
+    # 批次搜尋一個請求有多個意圖、串流回應的標頭早已送出，皆不輸出 (request 為 None)
+    if request is not None:
+        request.state.server_timing = outcome["timings"]
+        request.state.pipeline_source = pipeline_source
+
+    if outcome["total_count"] == 0:
+        search_status = check_search_status([], plan, total_count=0, degradation=outcome["degraded"])
+        quality_label, is_fallback, ai_hint = evaluate_search_quality(
+            [],
+            {"status": "no_data", "message": ""},
+            rdb_info=outcome["rdb_info"],
+            plan=plan
+        )
+        vector_search_info = {}
+    else:
+        vector_search_info = outcome["vector_search_info"]
+        # --- 執行分析門面 ---
+        # 必須先執行這一步，才會產生 quality_label, is_fallback, ai_hint
+        # 為什麼不放進快取：位置診斷等欄位與當次請求的 plan 有關，每次重新計算
+        search_status, quality_label, is_fallback, ai_hint = analyze_search_results(
+            outcome["results"],
+            plan,
+            outcome["total_count"],
+            vector_search_info,
+            outcome["rdb_info"],
+            degradation=outcome["degraded"]
+        )
 
-            all_ranked_results, vector_search_info = await vector_service.search_and_rank(
-                db_results=db_results,
-                plan=plan,
-                total_count=total_count
-            )
-            t_vector_done = time.perf_counter()
-
-            # 從 vector_search_info 取得 service 內部的細分秒數
-            qdrant_duration = vector_search_info.get("qdrant_time", 0)
-            ranking_duration = vector_search_info.get("ranking_time", 0)
-
-            # 過渡耗時 = (Vector 總耗時) - (Qdrant 淨耗時) - (指標排序淨耗時)
-            transition_duration = (t_vector_done - t_sql_done) - qdrant_duration - ranking_duration
-
-            # --- 1. 格式化結果 ---
-            all_ranked_results = format_response_data(all_ranked_results, plan)
-
-            # --- 2. 執行分析門面 (搬移到這裡！) ---
-            # 必須先執行這一步，才會產生 quality_label, is_fallback, ai_hint
-            search_status, quality_label, is_fallback, ai_hint = analyze_search_results(
-                all_ranked_results, 
-                plan, 
-                total_count, 
-                vector_search_info, 
-                rdb_info
+    return {
+        "pipeline_source": pipeline_source,
+        "search_status": search_status,
+        "quality_label": quality_label,
+        "is_fallback": is_fallback,
+        "ai_hint": ai_hint,
+        "vector_search_info": vector_search_info,
+    }
+
+
+async def _finalize_search(
+    request: Optional[Request],
+    plan: dict,
+    outcome: dict,
+    session_cache,
+    t0: float,
+    capture_snapshot=None,
+    client_guard=None,
+    analysis: Optional[dict] = None
+) -> dict:
+    """
+    檢索完成後的共用收尾：品質分析 → 建立 Session (search_ssid) 並切出第一頁 → 指標 / 擷取 → 組裝回應。
+    POST /place_search、/place_search/batch (每個意圖各呼叫一次) 與 /place_search/stream 共用，回應格式因此完全一致。
+    :param analysis: 已由 _analyze_outcome 算好的分析結果 (串流端點先送出第一頁時使用)，避免重算
+    """
+    s_id = plan.get("s_id")
+    if analysis is None:
+        analysis = _analyze_outcome(request, plan, outcome)
+    pipeline_source = analysis["pipeline_source"]
+    search_status = analysis["search_status"]
+    quality_label = analysis["quality_label"]
+    is_fallback = analysis["is_fallback"]
+    ai_hint = analysis["ai_hint"]
+
+    total_count = outcome["total_count"]
+
+    if total_count == 0:
+        logger.warning(f"[Search][SID: {s_id}] SQL 查無資料，直接回傳")
+        total_duration_route = time.perf_counter() - t0
+        # 查無資料也是一次完整的搜尋，同樣計入延遲分布；漏掉會讓分布偏向有結果的請求
+        observe_search(outcome["timings"], total_duration_route, pipeline_source)
+        record_search_result(quality_label, search_status)
+        if capture_snapshot is not None:
+            capture_search(
+                capture_snapshot,
+                fingerprint=plan.get("intent_fingerprint"),
+                source=pipeline_source,
+                timings=outcome["timings"],
+                total=total_duration_route,
+                status=quality_label,
+                total_count=0,
             )
+        response = {
+            "s_id": s_id,
+            "status": quality_label,
+            "data": {
+                "is_fallback": is_fallback,
+                "ai_behavior_hint": ai_hint,
+                "search_status": search_status,
+                "vector_search_info": {},
+                "pagination": {"current_page": 1, "total_pages": 0, "total_results": 0, "page_size": Config.PAGE_SIZE},
+                "final_results": []
+            }
+        }
+        return response
+
+    all_ranked_results = outcome["results"]
+    vector_search_info = outcome["vector_search_info"]
+
+    # 各階段的細分秒數 (命中快取時皆為 0)
+    sql_service_duration = outcome["timings"]["sql_service"]
+    transition_duration = outcome["timings"]["transition"]
+    qdrant_duration = outcome["timings"]["qdrant"]
+    ranking_duration = outcome["timings"]["ranking"]
+
+    # --- 存入 Redis 分頁快取 ---
+    # ── 【v3.0 進階版：獨立生成 6 碼隨機交易 SSID】 ──────────────────
+    # 改動動機：
+    #   1. 隱私防護：s_id 通常包含用戶識別或長字串，直接暴露在前端 URL 翻頁參數中有風險。
+    #   2. 資源優化：6 碼短 ID 顯著減少 Redis Key 的儲存空間，對於百萬級併發快取更節省記憶體。
+    #   3. URL 友善：翻頁 API (GET) 的參數更精簡 (例如: ?search_ssid=A7B2X9)，降低傳輸字元數。
+    #   4. 狀態隔離：讓「對話 ID (s_id)」與「搜尋結果快取 (ssid)」生命週期分開處理，增加快取管理彈性。
+
+    # 沒有人會翻頁的結果不必寫入 Redis
+    if client_guard is not None:
+        client_guard.checkpoint("session_save")
+
+    # --- 存入 Redis 並取得第一頁 (統一門面) ---
+    # 此方法內建了：生成 6 碼隨機 SSID -> 於記憶體切出第 1 頁結果 -> 背景序列化並儲存至 Redis
+    search_ssid, first_page_results, pagination_meta = await session_cache.create_session_and_get_first_page(
+        all_ranked_results,
+        page_size=Config.PAGE_SIZE
+    )
+
+
+    t_end = time.perf_counter()
+    total_duration_route = t_end - t0
+
+    performance_metrics = {
+        "intent_content": vector_search_info.get("query_content"),  # 從 info 拿字串
+        "hit_count": total_count,                                    # SQL 命中筆數
+        "sql_service": round(sql_service_duration, 4),
+        "transition": round(transition_duration, 4),
+        "qdrant": round(qdrant_duration, 4),
+        "ranking": round(ranking_duration, 4),
+        "total": round(total_duration_route, 4)
+    }
+
+    log_performance_to_csv(performance_metrics)
+
+    # Prometheus：各階段延遲與結果分類 (快取命中 / 合併的請求只記錄 total)
+    observe_search(outcome["timings"], total_duration_route, pipeline_source)
+    record_search_result(quality_label, search_status)
+
+    if capture_snapshot is not None:
+        capture_search(
+            capture_snapshot,
+            fingerprint=plan.get("intent_fingerprint"),
+            source=pipeline_source,
+            timings=outcome["timings"],
+            total=total_duration_route,
+            status=quality_label,
+            total_count=total_count,
+            search_ssid=search_ssid,
+        )
 
+    # 回傳精簡後的 Response 物件
+    response = {
+        "s_id": plan.get("s_id"),  # 原本的 s_id 照常回傳給 AI 識別
+        "search_ssid": search_ssid, # 新的 6 碼短 ID 給前端翻頁用
+        "status": quality_label,   # 狀態: success / partial_success / no_data
+        "data": {
+                # 保底旗標
+                # 意義：是否觸發了「退而求其次」的邏輯
+                # 描述：True 代表結果並非 100% 符合 AI 解析出的語意關鍵字，是給 AI 判斷語氣的最快開關
+                # 用途1：對 AI (LLM)：作為**「信心判斷」**的快速開關。AI 看到 True 就應自動切換為「謙虛模式」，避免對搜尋結果過度承諾
+                # 用途2：對前端 UI：用於決定是否顯示**「相似推薦」或「精選替代」**的警示 UI 標籤，讓用戶知道搜尋結果並非精確匹配
+                "is_fallback": is_fallback,
+
+                # AI 行為指南
+                # 意義：後端對生成式模型的「口頭交代」
+                # 描述：根據搜尋品質生成的文字指令。AI 應將此內容納入 Context，決定要「邀功」還是「致歉」
+                # 用途1: 對 AI (LLM)：直接作為 System Message 的補充內容。模型會根據此文字決定對話策略
+                # 用途2: 對除錯 (Debug)：讓開發者在不用進入向量庫查看分數的情況下，直接透過 API 回傳結果一眼看出「為什麼 AI 會用這種語氣說話」
+                "ai_behavior_hint": ai_hint,
+
+                # 搜尋狀態診斷
+                # 意義：描述底層 SQL 與向量庫的匹配狀況
+                # 描述：例如 "skipped" (跳過向量), "no_match" (搜尋無果), "success" (搜尋成功)
+                # 用途：主要給後端除錯或前端顯示診斷訊息使用
+                "search_status": search_status,
+
+                # 向量搜尋元數據
+                # 意義：記錄向量資料庫（Qdrant/Milvus）的執行細節
+                # 內容：包含搜尋到的原始分數 (Score)、匹配的店家 ID 清單等
+                # 用途：用於驗證 AI 推薦的相似度權重是否合理
+                "vector_search_info": vector_search_info,
+
+                # 分頁元數據
+                # 意義：告知前端目前是第幾頁、總共幾頁，讓前端決定是否顯示「下一頁」按鈕
+                # 內容：current_page / total_pages / total_results / page_size / session_ttl_seconds
+                "pagination": pagination_meta,
 
-            session_data = {
-                "results": all_ranked_results,
-                "meta_analysis": {
-                    "status": quality_label,
-                    "is_fallback": is_fallback,
-                    "ai_behavior_hint": ai_hint,
-                    "search_status": search_status,
-                    "vector_search_info": vector_search_info
-                }
-            }
+                # 第一頁推薦清單
+                # 意義：經過 Hybrid Ranking 後的第 1 頁店家（固定 3 筆）
+                # 描述：後續翻頁請呼叫 GET /place_search/page?search_ssid=xxx&page=N
+                "final_results": first_page_results
+        }
+    }
 
-            # --- 存入 Redis 分頁快取 ---
-            # ── 【v3.0 進階版：獨立生成 6 碼隨機交易 SSID】 ──────────────────
-            # 改動動機：
-            #   1. 隱私防護：s_id 通常包含用戶識別或長字串，直接暴露在前端 URL 翻頁參數中有風險。
-            #   2. 資源優化：6 碼短 ID 顯著減少 Redis Key 的儲存空間，對於百萬級併發快取更節省記憶體。
-            #   3. URL 友善：翻頁 API (GET) 的參數更精簡 (例如: ?search_ssid=A7B2X9)，降低傳輸字元數。
-            #   4. 狀態隔離：讓「對話 ID (s_id)」與「搜尋結果快取 (ssid)」生命週期分開處理，增加快取管理彈性。
-        
-            # --- 存入 Redis 並取得第一頁 (統一門面) ---
-            # 此方法內建了：生成 6 碼隨機 SSID -> 序列化並儲存至 Redis -> 切出第 1 頁結果
-            search_ssid, first_page_results, pagination_meta = await session_cache.create_session_and_get_first_page(
-                all_ranked_results,
-                page_size=Config.PAGE_SIZE
-            )
+    return response
 
 
-            t_end = time.perf_counter()
-            total_duration_route = t_end - t0
+def _deadline_budget_ms(header_ms: Optional[float], t0: float) -> Optional[float]:
+    """
+    決定本次請求剩餘的時間預算：標頭優先 (不超過 Config.REQUEST_DEADLINE_MAX_MS)，否則使用 Config.REQUEST_DEADLINE_MS。
+    預算從請求進入 Route 時起算，扣掉意圖解析已用掉的時間。
+    """
+    budget = min(header_ms, Config.REQUEST_DEADLINE_MAX_MS) if header_ms else Config.REQUEST_DEADLINE_MS
+    if not budget or budget <= 0:
+        return None
+    # 已經用完時給 1ms，讓第一個階段立即拋出 DeadlineExceeded，而不是被視為「不設限」
+    return max(budget - (time.perf_counter() - t0) * 1000, 1.0)
 
-            performance_metrics = {
-                "intent_content": vector_search_info.get("query_content"),  # 從 info 拿字串
-                "hit_count": total_count,                                    # SQL 命中筆數
-                "sql_service": round(sql_service_duration, 4),
-                "transition": round(transition_duration, 4),
-                "qdrant": round(qdrant_duration, 4),
-                "ranking": round(ranking_duration, 4),
-                "total": round(total_duration_route, 4)
-            }
 
-            log_performance_to_csv(performance_metrics)
-
-            # 回傳精簡後的 Response 物件
-            response = {
-                "s_id": plan.get("s_id"),  # 原本的 s_id 照常回傳給 AI 識別
-                "search_ssid": search_ssid, # 新的 6 碼短 ID 給前端翻頁用
-                "status": quality_label,   # 狀態: success / partial_success / no_data
-                "data": {
-                        # 保底旗標
-                        # 意義：是否觸發了「退而求其次」的邏輯
-                        # 描述：True 代表結果並非 100% 符合 AI 解析出的語意關鍵字，是給 AI 判斷語氣的最快開關
-                        # 用途1：對 AI (LLM)：作為**「信心判斷」**的快速開關。AI 看到 True 就應自動切換為「謙虛模式」，避免對搜尋結果過度承諾
-                        # 用途2：對前端 UI：用於決定是否顯示**「相似推薦」或「精選替代」**的警示 UI 標籤，讓用戶知道搜尋結果並非精確匹配
-                        "is_fallback": is_fallback,
-
-                        # AI 行為指南
-                        # 意義：後端對生成式模型的「口頭交代」
-                        # 描述：根據搜尋品質生成的文字指令。AI 應將此內容納入 Context，決定要「邀功」還是「致歉」
-                        # 用途1: 對 AI (LLM)：直接作為 System Message 的補充內容。模型會根據此文字決定對話策略
-                        # 用途2: 對除錯 (Debug)：讓開發者在不用進入向量庫查看分數的情況下，直接透過 API 回傳結果一眼看出「為什麼 AI 會用這種語氣說話」
-                        "ai_behavior_hint": ai_hint,
-
-                        # 搜尋狀態診斷
-                        # 意義：描述底層 SQL 與向量庫的匹配狀況
-                        # 描述：例如 "skipped" (跳過向量), "no_match" (搜尋無果), "success" (搜尋成功)
-                        # 用途：主要給後端除錯或前端顯示診斷訊息使用
-                        "search_status": search_status,
-
-                        # 向量搜尋元數據
-                        # 意義：記錄向量資料庫（Qdrant/Milvus）的執行細節
-                        # 內容：包含搜尋到的原始分數 (Score)、匹配的店家 ID 清單等
-                        # 用途：用於驗證 AI 推薦的相似度權重是否合理
-                        "vector_search_info": vector_search_info,
-
-                        # 分頁元數據
-                        # 意義：告知前端目前是第幾頁、總共幾頁，讓前端決定是否顯示「下一頁」按鈕
-                        # 內容：current_page / total_pages / total_results / page_size / session_ttl_seconds
-                        "pagination": pagination_meta,
-
-                        # 第一頁推薦清單
-                        # 意義：經過 Hybrid Ranking 後的第 1 頁店家（固定 3 筆）
-                        # 描述：後續翻頁請呼叫 GET /place_search/page?search_ssid=xxx&page=N
-                        "final_results": first_page_results
-                }
-            }
+def _finish_profile(request_profile, timings, total: float) -> dict:
+    """補上與 Server-Timing 相同口徑的各階段耗時 (毫秒)。"""
+    request_profile.record(
+        "stages_ms",
+        **{stage: round(seconds * 1000, 2) for stage, seconds in timings.items()},
+        total=round(total * 1000, 2),
+    )
+    return request_profile.to_dict()
 
-            return response
 
-        except Exception as e:
-            logger.error(f"Search API Error: {e}", exc_info=True)
-            raise HTTPException(status_code=500, detail=str(e))
+def _session_write_failed_error() -> HTTPException:
+    """
+    Session 的背景寫入 (write_behind) 最終失敗：search_ssid 已回傳給用戶端，Redis 卻從未保存這筆 Session。
+    為什麼不回 404 session_expired：Session 並非過期，而是本服務沒存成功；呼叫端應重新搜尋，而不是以為逾時。
+    """
+    return HTTPException(
+        status_code=503,
+        detail={"status": "session_write_failed", "message": "搜尋結果未能保存，請重新搜尋"}
+    )
 
 
 @place_search.get("/place_search/page")
 async def get_search_page(
     request: Request,
     search_ssid: str = Query(..., description="搜尋 Session 識別碼（來自 POST /place_search 回傳的 s_id）"),
-    page: int = Query(..., ge=1, description="欲取得的頁碼（從 1 開始）")
+    page: int = Query(..., ge=1, description="欲取得的頁碼（從 1 開始）"),
+    view: Optional[str] = Query(None, pattern="^(minimal|llm|full)$", description="回應檢視：minimal / llm / full (預設 Config.RESPONSE_DEFAULT_VIEW)"),
+    fields: Optional[str] = Query(None, description="逗號分隔的店家欄位 (例如 id,restaurant_name)，優先於 view")
 ):
     """
     翻頁端點：從 Redis 快取取得指定頁的搜尋結果。
@@ -282,32 +693,44 @@ async def get_search_page(
 
     :param search_ssid:  POST /place_search 回傳的 s_id 欄位
     :param page:         頁碼（最小為 1）
+    :param view:         回應檢視 minimal / llm / full；fields 可直接指定店家欄位 (見 app/utils/response_projection.py)
     :return:             指定頁的店家列表 + 分頁元數據
     """
+    t0 = time.perf_counter()
     try:
         # 從 app.state 取得快取實例
         session_cache = request.app.state.session_cache
         
-        # 先確認 Session 是否還活著
-        if not await session_cache.exists(search_ssid):
-            raise HTTPException(
-                status_code=404,
-                detail={"status": "session_expired", "message": "搜尋 Session 已過期"}
-            )
-
         # 從 Redis 取出指定頁資料
+        # 為什麼不再先呼叫 exists()：get_page 本身就會回報 Session 是否過期，
+        # 合併後每次翻頁只需一次 Redis 往返
         page_results, pagination_meta = await session_cache.get_page(
             search_ssid,
             page=page,
             page_size=Config.PAGE_SIZE
         )
 
+        if pagination_meta.get("error") == "session_write_failed":
+            PAGE_REQUESTS.labels(status="session_write_failed").inc()
+            capture_page(search_ssid, page, "session_write_failed", time.perf_counter() - t0)
+            raise _session_write_failed_error()
+
+        if pagination_meta.get("error") == "session_expired":
+            PAGE_REQUESTS.labels(status="session_expired").inc()
+            capture_page(search_ssid, page, "session_expired", time.perf_counter() - t0)
+            raise HTTPException(
+                status_code=404,
+                detail={"status": "session_expired", "message": "搜尋 Session 已過期"}
+            )
+
+        PAGE_REQUESTS.labels(status="success").inc()
+        capture_page(search_ssid, page, "success", time.perf_counter() - t0)
         logger.info(
             f"[Page API] search_ssid={search_ssid}, page={page}, "
             f"回傳 {len(page_results)} 筆"
         )
 
-        return {
+        return FastJSONResponse(project_response({
             "s_id": search_ssid,
             "status": "success",
             "data": {
@@ -318,7 +741,7 @@ async def get_search_page(
                 # 本頁店家推薦清單
                 "final_results": page_results
             }
-        }
+        }, view, parse_fields(fields)))
 
     except HTTPException:
         # 直接重新拋出，避免被下方的通用 Exception 捕獲而失去 status_code
@@ -328,4 +751,170 @@ async def get_search_page(
 
     except Exception as e:
         logger.error(f"[Page API] 翻頁失敗: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@place_search.post("/place_search/{search_ssid}/resort")
+async def resort_search_session(
+    request: Request,
+    search_ssid: str,
+    payload: dict = Body(...),
+    view: Optional[str] = Query(None, pattern="^(minimal|llm|full)$", description="回應檢視：minimal / llm / full (預設 Config.RESPONSE_DEFAULT_VIEW)"),
+    fields: Optional[str] = Query(None, description="逗號分隔的店家欄位 (例如 id,restaurant_name)，優先於 view")
+):
+    """
+    重新排序端點：以新的排序條件重排既有 Session，不重跑 SQL、Embedding 與 Qdrant。
+
+    為什麼需要：使用者常接著說「依距離排」「評價高的先」，原本只能重新呼叫 POST /place_search，
+    整條檢索流程再跑一次；但排序條件只影響權重，Session 中每筆店家已保存語意相似度、評分、人氣、距離四項指標，
+    以 RankSettings.DYNAMIC_BASE 與主 / 次激勵權重重算分數即可 (O(N))。
+
+    • 重排結果覆寫同一個 search_ssid (TTL 重新計算)，之後翻頁即為新順序；所有 Worker 的 L1 快取會一併失效
+    • 店家集合不變：語意門檻與排序條件無關；同名店家 (連鎖店) 保留的是原始排序下勝出的那一家，不會改換成其他分店
+    • sort_conditions 為空陣列時回到預設的語意優先權重
+    • 每個條件只讀取 field (distance / rating / popularity / similarity)，越前面的條件權重越高；
+      方向固定為「距離近、評分 / 人氣 / 相似度高者優先」，沒有 direction 可以反轉 (權重只能加重某項指標)
+
+    POST https://192.168.1.118:5004/place_search/A7B2X9/resort
+    {
+    "sort_conditions": [{"field": "distance"}, {"field": "rating"}]
+    }
+    """
+    sort_conditions = payload.get("sort_conditions") if isinstance(payload, dict) else None
+    if not isinstance(sort_conditions, list):
+        raise HTTPException(status_code=400, detail={"status": "fail", "message": "sort_conditions must be a list"})
+
+    try:
+        session_cache = request.app.state.session_cache
+        vector_service = request.app.state.vector_service
+
+        all_results = await session_cache.get_results(search_ssid)
+        if all_results is None and session_cache.write_failed(search_ssid):
+            SESSION_OPERATIONS.labels(operation="resort", status="session_write_failed").inc()
+            raise _session_write_failed_error()
+        if all_results is None:
+            SESSION_OPERATIONS.labels(operation="resort", status="session_expired").inc()
+            raise HTTPException(
+                status_code=404,
+                detail={"status": "session_expired", "message": "搜尋 Session 已過期"}
+            )
+
+        reranked, sort_strategy = vector_service.rerank(all_results, sort_conditions)
+        page_results, pagination_meta = await session_cache.replace_session_and_get_first_page(
+            search_ssid,
+            reranked,
+            page_size=Config.PAGE_SIZE
+        )
+
+        SESSION_OPERATIONS.labels(operation="resort", status="success").inc()
+        logger.info(f"[Resort API] search_ssid={search_ssid}, 策略: {sort_strategy}, 共 {len(reranked)} 筆")
+
+        return FastJSONResponse(project_response({
+            "s_id": search_ssid,
+            "status": "success",
+            "data": {
+                # 本次採用的排序策略 (與每筆店家的 applied_strategy 相同)
+                "applied_strategy": sort_strategy,
+                "pagination": pagination_meta,
+                # 重新排序後的第 1 頁
+                "final_results": page_results
+            }
+        }, view, parse_fields(fields)))
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error(f"[Resort API] 重新排序失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@place_search.post("/place_search/{search_ssid}/refine")
+async def refine_search_session(
+    request: Request,
+    search_ssid: str,
+    payload: dict = Body(...),
+    view: Optional[str] = Query(None, pattern="^(minimal|llm|full)$", description="回應檢視：minimal / llm / full (預設 Config.RESPONSE_DEFAULT_VIEW)"),
+    fields: Optional[str] = Query(None, description="逗號分隔的店家欄位 (例如 id,restaurant_name)，優先於 view")
+):
+    """
+    追加過濾端點：在既有 Session 的店家中套用額外的 logic_tree 條件，結果建立為新的 Session。
+
+    為什麼需要：「只要有冷氣的」「評分 4.5 以上」這類追問原本會觸發一次全新的搜尋；
+    但候選店家已經排好序存在 Session 中，直接在記憶體內過濾即可，不需 MySQL 與 Qdrant 往返。
+
+    • 條件格式與 POST /place_search 的 logic_tree 相同，欄位語意見 HybridSQLBuilder.build_row_filter
+    • 排序維持原 Session 的順序；原 Session 不受影響，仍可繼續翻頁或再次 refine
+    • 無法在記憶體判斷的條件 (語意欄位、營業時間、Session 中沒有的欄位) 列在 ignored_conditions，
+      呼叫端可據此決定是否改發一次完整搜尋
+
+    POST https://192.168.1.118:5004/place_search/A7B2X9/refine
+    {
+    "logic_tree": {"op": "and", "conditions": [
+        {"冷氣": {"cmp": "=", "value": true}},
+        {"rating": {"cmp": ">=", "value": 4.5}}
+        ]}
+    }
+    """
+    logic_tree = payload.get("logic_tree") if isinstance(payload, dict) else None
+    if not isinstance(logic_tree, dict) or not logic_tree:
+        raise HTTPException(status_code=400, detail={"status": "fail", "message": "logic_tree must be a non-empty object"})
+
+    try:
+        session_cache = request.app.state.session_cache
+        builder = request.app.state.builder
+
+        all_results = await session_cache.get_results(search_ssid)
+        if all_results is None and session_cache.write_failed(search_ssid):
+            SESSION_OPERATIONS.labels(operation="refine", status="session_write_failed").inc()
+            raise _session_write_failed_error()
+        if all_results is None:
+            SESSION_OPERATIONS.labels(operation="refine", status="session_expired").inc()
+            raise HTTPException(
+                status_code=404,
+                detail={"status": "session_expired", "message": "搜尋 Session 已過期"}
+            )
+
+        available_fields = all_results[0].keys() if all_results else ()
+        predicate, ignored = builder.build_row_filter(logic_tree, available_fields)
+        if predicate is None:
+            SESSION_OPERATIONS.labels(operation="refine", status="no_applicable_conditions").inc()
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "fail",
+                    "message": "logic_tree 中沒有可在既有結果上判斷的條件，請改用 POST /place_search",
+                    "ignored_conditions": ignored,
+                }
+            )
+
+        # Session 中的 dict 不做任何修改，新 Session 直接引用同一批物件
+        refined = [row for row in all_results if predicate(row)]
+        new_ssid, page_results, pagination_meta = await session_cache.create_session_and_get_first_page(
+            refined,
+            page_size=Config.PAGE_SIZE
+        )
+
+        SESSION_OPERATIONS.labels(operation="refine", status="success" if refined else "no_data").inc()
+        logger.info(f"[Refine API] {search_ssid} → {new_ssid}，{len(all_results)} 筆過濾為 {len(refined)} 筆，略過條件: {ignored}")
+
+        return FastJSONResponse(project_response({
+            "s_id": new_ssid,
+            "search_ssid": new_ssid,
+            "status": "success" if refined else "no_data",
+            "data": {
+                # 來源 Session 與過濾前的筆數，讓 LLM 能描述「從 N 家中篩出 M 家」
+                "parent_ssid": search_ssid,
+                "total_before_refine": len(all_results),
+                "ignored_conditions": ignored,
+                "pagination": pagination_meta,
+                "final_results": page_results
+            }
+        }, view, parse_fields(fields)))
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error(f"[Refine API] 追加過濾失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
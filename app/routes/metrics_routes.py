@@ -0,0 +1,27 @@
+# app/routes/metrics_routes.py
+from fastapi import APIRouter, Request, Response
+
+from app.utils.db import get_db_pool_stats
+from app.utils.metrics_registry import refresh_runtime_gauges, render_metrics
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """
+    Prometheus 抓取端點 (text exposition format)。
+
+    內容：
+    • place_search_stage_seconds：各階段 (sql_service / transition / qdrant / ranking / total) 延遲分布
+    • place_search_results_total：依 quality_label 與 search_status 分類的請求數
+    • mysql_pool_connections / embedding_inflight_requests：連線池與模型推論的即時狀態
+    • search_cache_stat：L1 / 意圖快取 / Single-Flight / Metrics Sink 的統計
+
+    為什麼 Gauge 在此更新：快取統計只有被抓取時才需要，不必在每個搜尋請求上計算。
+    多 Worker (PROMETHEUS_MULTIPROC_DIR) 時這裡只更新處理本次抓取的 Worker，其他 Worker 由各自的 run_gauge_refresher 定期更新。
+    """
+    refresh_runtime_gauges(request.app.state, get_db_pool_stats())
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
@@ -0,0 +1,256 @@
+# app/services/embedding_sidecar.py
+"""
+Embedding Sidecar：多 Worker 共用同一份 BGE-M3 模型
+
+為什麼需要：
+    run.py 原本只啟動單一 uvicorn 程序；若直接加開 Worker，每個 Worker 都會在 VectorService.__init__
+    各自載入約 2 GB 的 BGE-M3 (GPU 上則是各自一份 VRAM)，記憶體隨 Worker 數倍增。
+    為什麼不在 fork 前載入、以 Copy-on-Write 共用：模型放在 CUDA 上，CUDA Context 無法跨 fork 使用；
+    即使在 CPU 上，PyTorch 的參照計數與記憶體配置也會逐步觸發頁面複製，實際共用不了多久。
+
+做法：
+    • Sidecar (python -m app.services.embedding_sidecar) 是唯一載入模型的程序，監聽 Unix Socket
+    • 各 Worker 以 EmbeddingClient 送出查詢字串；Sidecar 把同一時間到達的請求合成一個批次 (微批次)，
+      一次 model.encode(list) 的成本遠低於逐筆推論，Worker 越多、批次越滿
+    • Worker 端只剩 HTTP / SQL / 排序等 CPU 工作，可隨核心數擴展
+
+通訊協定 (長度前綴的 Frame，一條連線上依序一問一答)：
+    請求：4 bytes 長度 (big-endian) + UTF-8 查詢字串
+    回應：1 byte 狀態 (0 成功 / 1 失敗) + 4 bytes 長度 + 內容 (成功為 float32 little-endian 向量，失敗為 UTF-8 錯誤訊息)
+"""
+import asyncio
+import os
+import signal
+import struct
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from app.config import Config
+from app.utils.app_logger import logger
+
+_REQ_HEADER = struct.Struct(">I")
+_RESP_HEADER = struct.Struct(">BI")
+_STATUS_OK = 0
+_STATUS_ERROR = 1
+# 查詢字串由 build_semantic_query 組成，正常不會超過數百字；上限用來擋掉損毀的 Frame
+_MAX_REQUEST_BYTES = 64 * 1024
+
+
+class EmbeddingUnavailable(Exception):
+    """Sidecar 無法連線、逾時或回傳錯誤。"""
+
+
+# ===================== Worker 端 =====================
+
+class EmbeddingClient:
+    """
+    連線至 Embedding Sidecar 的非同步 Client (每個 Worker 一份)。
+    閒置連線保留在池中重複使用；發生錯誤或被取消的連線一律關閉，避免讀到上一個請求殘留的回應。
+    """
+
+    def __init__(self, socket_path: str, timeout: float, pool_size: int):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def _acquire(self) -> Tuple[Tuple[asyncio.StreamReader, asyncio.StreamWriter], bool]:
+        """:return: (連線, 是否為池中重複使用的連線)"""
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return (reader, writer), True
+            writer.close()
+        return await asyncio.open_unix_connection(self.socket_path), False
+
+    def _release(self, conn: Tuple[asyncio.StreamReader, asyncio.StreamWriter]) -> None:
+        if len(self._idle) < self.pool_size:
+            self._idle.append(conn)
+        else:
+            conn[1].close()
+
+    async def _roundtrip(self, conn, payload: bytes) -> Tuple[int, bytes]:
+        reader, writer = conn
+        writer.write(_REQ_HEADER.pack(len(payload)) + payload)
+        await writer.drain()
+        status, length = _RESP_HEADER.unpack(await reader.readexactly(_RESP_HEADER.size))
+        return status, await reader.readexactly(length)
+
+    async def encode(self, text: str) -> List[float]:
+        """
+        取得單一查詢字串的正規化向量。
+        :raises EmbeddingUnavailable: Sidecar 未啟動、連線中斷、逾時或推論失敗
+        """
+        payload = text.encode("utf-8")
+        for attempt in range(2):
+            conn = None
+            reused = False
+            try:
+                conn, reused = await asyncio.wait_for(self._acquire(), self.timeout)
+                status, body = await asyncio.wait_for(self._roundtrip(conn, payload), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                if conn is not None:
+                    conn[1].close()
+                # Sidecar 重啟後，池中的舊連線會在第一次使用時才發現已斷開：改用新連線重試一次
+                if reused and attempt == 0 and not isinstance(e, asyncio.TimeoutError):
+                    continue
+                raise EmbeddingUnavailable(f"embedding sidecar unreachable ({type(e).__name__}: {e})") from None
+            except BaseException:
+                # 取消 (用戶端斷線 / 截止時間) 時回應可能還在路上，這條連線不能再給下一個請求用
+                if conn is not None:
+                    conn[1].close()
+                raise
+
+            self._release(conn)
+            if status != _STATUS_OK:
+                raise EmbeddingUnavailable(f"embedding sidecar error: {body.decode('utf-8', 'replace')}")
+            return np.frombuffer(body, dtype="<f4").tolist()
+
+    async def close(self) -> None:
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+# ===================== Sidecar 端 =====================
+
+class EmbeddingSidecar:
+    """
+    Unix Socket 推論服務。
+    每條連線一個 Handler 把請求放進佇列；單一 Batcher 依序取出、合成批次後在執行緒池推論，
+    推論期間新到的請求繼續累積成下一個批次。
+    """
+
+    def __init__(self, model, socket_path: str, batch_max: int, batch_wait_ms: float):
+        self.model = model
+        self.socket_path = socket_path
+        self.batch_max = max(batch_max, 1)
+        self.batch_wait = max(batch_wait_ms, 0.0) / 1000
+        self._queue: "asyncio.Queue[Tuple[str, asyncio.Future]]" = asyncio.Queue()
+        self._stats = {"requests": 0, "batches": 0, "errors": 0}
+        self._writers = set()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    (length,) = _REQ_HEADER.unpack(await reader.readexactly(_REQ_HEADER.size))
+                except asyncio.IncompleteReadError:
+                    return  # Worker 正常關閉連線
+                if length > _MAX_REQUEST_BYTES:
+                    self._write(writer, _STATUS_ERROR, b"request too large")
+                    return
+                text = (await reader.readexactly(length)).decode("utf-8", "replace")
+
+                future = loop.create_future()
+                await self._queue.put((text, future))
+                try:
+                    vector = await future
+                    self._write(writer, _STATUS_OK, np.asarray(vector, dtype="<f4").tobytes())
+                except Exception as e:
+                    self._write(writer, _STATUS_ERROR, str(e).encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            return
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, status: int, body: bytes) -> None:
+        writer.write(_RESP_HEADER.pack(status, len(body)) + body)
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        expires_at = time.perf_counter() + self.batch_wait
+        while len(batch) < self.batch_max:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = expires_at - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _batcher(self) -> None:
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                vectors = await asyncio.to_thread(
+                    self.model.encode, texts, batch_size=len(texts), normalize_embeddings=True
+                )
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"[Embedding Sidecar] 批次推論失敗 ({len(texts)} 筆): {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    async def serve(self) -> None:
+        # 上一次異常結束留下的 Socket 檔會讓 bind 失敗
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        batcher = asyncio.create_task(self._batcher())
+        logger.info(
+            f"[Embedding Sidecar] 監聽 {self.socket_path} "
+            f"(batch_max={self.batch_max}, batch_wait_ms={self.batch_wait * 1000:g})"
+        )
+        # SIGTERM (run.py 結束或容器停止) 時正常關閉，移除 Socket 檔
+        stop = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            batcher.cancel()
+            # 關閉 Worker 的連線：池中的連線下次使用時會立即發現並重連，而不是等到逾時
+            for writer in list(self._writers):
+                writer.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            logger.info(f"[Embedding Sidecar] 已停止: {self.stats()}")
+
+    def stats(self):
+        batches = self._stats["batches"]
+        return {**self._stats, "avg_batch": round(self._stats["requests"] / batches, 2) if batches else 0.0}
+
+
+def main(model=None) -> None:
+    """Sidecar 程序進入點；model 未指定時載入 BGE-M3 (與 local 模式的 VectorService 相同路徑與裝置)。"""
+    if model is None:
+        from app.services.vector_service import load_embedding_model
+        model = load_embedding_model()
+    sidecar = EmbeddingSidecar(
+        model,
+        Config.EMBEDDING_SOCKET_PATH,
+        Config.EMBEDDING_BATCH_MAX,
+        Config.EMBEDDING_BATCH_WAIT_MS,
+    )
+    try:
+        asyncio.run(sidecar.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,12 @@ import json
 import time
 from app.utils.distance_utils import get_haversine_distance_sql # 匯入距離計算的SQL生成器
 from app.utils.performance_tracker import log_function_timing    # 函式層級耗時記錄器
-from app.utils.app_logger import logger
+from app.utils.log_policy import get_logger, log_detail
+from app.utils.tracing import traced                              # 請求追蹤 Span
 import copy
 
+logger = get_logger("builder")
+
 class HybridSQLBuilder:
     def __init__(self):
         #  定義靜態的映射表 
@@ -70,10 +73,23 @@ class HybridSQLBuilder:
             "行動支付", "現金支付", "信用卡" 
         }
         self.json_field_source = "pa.facility_tags"
+        # query一般查詢模式固定回傳的欄位 (SELECT 別名 → DB 欄位)
+        # 注意評論數在這裡的別名是 reviews_count，與 field_mapping 的 user_ratings_total 不同
+        self.query_base_fields = {
+            "id": "p.id",
+            "restaurant_name": "p.name", # 強制回傳名稱
+            "address": "p.address",
+            "rating": "p.rating",
+            "reviews_count": "p.user_ratings_total",
+            "facility_tags": "pa.facility_tags",
+            "lat": "p.lat",  # 確保後端計算距離永遠有資料
+            "lng": "p.lng"   # 確保後端計算距離永遠有資料
+        }
 
     # 只負責看懂 JSON，告訴你需不需要跑向量搜尋
     # 解析意圖
     # 回傳一個字典,包含SQL所需的結構以及向量搜尋的需求
+    @traced("builder.analyze_intent")
     def analyze_intent(self, json_input):
         s_id = json_input.get("s_id")
         # 記錄函式起始時間，用於計算整體意圖解析耗時
@@ -146,18 +162,7 @@ class HybridSQLBuilder:
         
         else:
             # query一般查詢模式
-            base_fields = {
-                "id": "p.id",
-                "restaurant_name": "p.name", # 強制回傳名稱
-                "address": "p.address",
-                "rating": "p.rating",
-                "reviews_count": "p.user_ratings_total",
-                "facility_tags": "pa.facility_tags",
-                "lat": "p.lat",  # 確保後端計算距離永遠有資料
-                "lng": "p.lng"   # 確保後端計算距離永遠有資料
-            }
-            
-            for key, db_col in base_fields.items():
+            for key, db_col in self.query_base_fields.items():
                 plan["select_fields"].append(f"{db_col} AS {key}")
 
             # 加入使用者在 info_needed 指定的額外欄位
@@ -266,6 +271,7 @@ class HybridSQLBuilder:
     # 移除參數 vector_result_ids：
     # 此參數從未在函式體內被使用，原設計意圖是將向量搜尋結果的 ID 傳入以限制 SQL 範圍，
     # 但實際上 ID 過濾邏輯已移至 VectorService，此處不再需要
+    @traced("builder.build_sql")
     def build_sql(self, plan, is_fallback=False):
         s_id = plan.get("s_id")
         # 記錄 SQL 建構起始時間，涵蓋 _strip_strict_conditions 與 _recursive_parse 的整體耗時
@@ -432,7 +438,7 @@ class HybridSQLBuilder:
         val = node_data.get("value")
         cmp = node_data.get("cmp", "=").upper()
 
-        logger.info(f"[SQL Builder][SID: {s_id}] ===> [Recursive Parse] 處理欄位: '{key}' | 算符: {cmp}")
+        log_detail(logger, "parse_node", "[SQL Builder][SID: %s] ===> [Recursive Parse] 處理欄位: '%s' | 算符: %s", s_id, key, cmp)
 
         # 只要 val 是只有一個元素的 list，不管 cmp 是什麼，先把它轉成純字串/數值
         # 這樣後續不論走 IN 還是 LIKE 邏輯，item 都會是乾淨的
@@ -440,7 +446,7 @@ class HybridSQLBuilder:
             val = val[0]
         
         # 核心追蹤
-        logger.info(f"===> [Recursive Parse] 處理欄位: '{key}' | 算符: {cmp} | 原始值: {val}")
+        log_detail(logger, "parse_node", "===> [Recursive Parse] 處理欄位: '%s' | 算符: %s | 原始值: %s", key, cmp, val)
 
         # 優先檢查向量欄位
         if key in self.vector_fields:
@@ -530,9 +536,137 @@ class HybridSQLBuilder:
     
 
 
+    # 將巢狀JSON邏輯樹轉成「記憶體內」的過濾函式 (POST /place_search/{search_ssid}/refine)
+    # 為什麼不重跑 SQL：追問「只要有冷氣的」「評分 4.5 以上」時，候選店家早已在 Session 中，
+    # 對這幾十筆資料直接判斷即可，不需 MySQL 與 Qdrant 往返
+    # 欄位語意與 _recursive_parse 一致：
+    #   • 設施 (facility_keys)：value 為 true 時要求 facility_tags 含有該標籤，其餘值不過濾
+    #   • address / restaurant_name：SQL 為全文檢索，這裡以「包含關鍵字」近似
+    #   • restaurant_type / merchant_category 或 cmp 為 LIKE：前綴比對 (與 SQL 的 'val%' 相同)
+    #   • IN / NOT IN、一般比較運算子 (=, !=, <>, >, >=, <, <=)；欄位為 NULL 時與 SQL 相同視為不符合
+    # 無法在記憶體判斷的條件 (語意欄位、營業時間、Session 中沒有的欄位) 與 SQL 的「不生成片段」相同：該條件略過
+    def build_row_filter(self, logic_tree, available_fields):
+        """
+        :param logic_tree: 與 analyze_intent 相同格式的 logic_tree
+        :param available_fields: Session 中店家資料實際具有的欄位
+        :return: (過濾函式或 None (沒有任何可套用的條件), 被略過的欄位清單)
+        """
+        ignored = []
+        predicate = self._compile_row_node(logic_tree, set(available_fields), ignored)
+        return predicate, ignored
+
+    def _compile_row_node(self, node, available_fields, ignored):
+        if not node:
+            return None
+
+        # 處理邏輯運算子節點 (AND/OR)
+        if "op" in node and "conditions" in node:
+            operator = str(node["op"]).upper()
+            children = [self._compile_row_node(child, available_fields, ignored) for child in node["conditions"]]
+            children = [child for child in children if child is not None]
+            if not children:
+                return None
+            if len(children) == 1:
+                return children[0]
+            if operator == "OR":
+                return lambda row: any(child(row) for child in children)
+            return lambda row: all(child(row) for child in children)
+
+        key = list(node.keys())[0]
+        node_data = node[key] if isinstance(node[key], dict) else {"value": node[key]}
+        val = node_data.get("value")
+        cmp = str(node_data.get("cmp", "=")).upper()
+        if isinstance(val, list) and len(val) == 1:
+            val = val[0]
+
+        # 設施標籤：只有 true 代表「必須具備」
+        if key in self.facility_keys:
+            if val is not True:
+                return None
+            if "facility_tags" not in available_fields:
+                ignored.append(key)
+                return None
+            return lambda row: key in (row.get("facility_tags") or [])
+
+        # 找出 Session 中對應的欄位 (sql_where_mapping 的 DB 欄位 → SELECT 別名)
+        row_field = key if key in self.field_mapping else self._select_alias(self.sql_where_mapping.get(key))
+        if row_field is not None and row_field not in available_fields:
+            # 一般查詢模式的 Session 以 query_base_fields 的別名保存 (例如 user_ratings_total → reviews_count)
+            row_field = self._select_alias(self.field_mapping[row_field], self.query_base_fields) or row_field
+        if (
+            key in self.vector_fields
+            or row_field is None
+            or row_field == "opening_hours"
+            or row_field not in available_fields
+            or val is None
+        ):
+            ignored.append(key)
+            return None
+
+        if key in ("address", "restaurant_name"):
+            needle = str(val).lower()
+            return lambda row: row.get(row_field) is not None and needle in str(row.get(row_field)).lower()
+
+        if key in ("restaurant_type", "merchant_category") or cmp == "LIKE":
+            prefix = str(val)
+            return lambda row: row.get(row_field) is not None and str(row.get(row_field)).startswith(prefix)
+
+        if cmp in ("IN", "NOT IN"):
+            members = {self._comparable(item) for item in (val if isinstance(val, list) else [val])}
+            if cmp == "IN":
+                return lambda row: row.get(row_field) is not None and self._comparable(row.get(row_field)) in members
+            return lambda row: row.get(row_field) is not None and self._comparable(row.get(row_field)) not in members
+
+        compare = self._ROW_COMPARATORS.get(cmp)
+        if compare is None:
+            ignored.append(key)
+            return None
+        target = self._comparable(val)
+
+        def match(row):
+            current = row.get(row_field)
+            if current is None:
+                return False
+            try:
+                return compare(self._comparable(current), target)
+            except TypeError:
+                # 數值與字串互比 (例如評分欄位給了非數字的值)：與 SQL 轉型失敗相同，視為不符合
+                return False
+        return match
+
+    _ROW_COMPARATORS = {
+        "=": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<>": lambda a, b: a != b,
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+    }
+
+    def _select_alias(self, db_col, mapping=None):
+        if db_col is None:
+            return None
+        for alias, col in (mapping or self.field_mapping).items():
+            if col == db_col:
+                return alias
+        return None
+
+    @staticmethod
+    def _comparable(value):
+        # MySQL 會把 '4.5' 與 DECIMAL 欄位當數值比較；這裡同樣優先轉成 float
+        if isinstance(value, bool):
+            return value
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return str(value)
+
+
     # 移除參數 is_fallback：
     # 此參數從未在函式體內被使用，導致 Fallback 輪的 Count SQL 與主查詢條件不一致（Count 仍用嚴格條件）
     # 若未來需要修正此邏輯不一致，應在此處呼叫 _strip_strict_conditions 套用放寬條件後再計算總數
+    @traced("builder.build_count_sql")
     def build_count_sql(self, plan, vector_result_ids=None):
         """
         生成用於計算店家總筆數的 SQL
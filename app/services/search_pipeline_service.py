@@ -0,0 +1,503 @@
+# app/services/search_pipeline_service.py
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Union
+
+from app.config import Config
+from app.utils.admission import AdmissionRejected, admission
+from app.utils.app_logger import logger
+from app.utils.client_disconnect import checkpoint, detach_from_client
+from app.utils.deadline import DeadlineExceeded, budget_allows, degradations, mark_degraded, split_deadline, within_deadline
+from app.utils.data_formatter import format_response_data
+from app.utils.distance_utils import haversine_distances
+from app.utils.intent_result_cache import GeoCandidateCache, IntentResultCache, compute_geo_key, compute_intent_fingerprint
+from app.utils.request_profile import profile_record, profiling
+from app.utils.single_flight import SingleFlight
+from app.utils.tracing import annotate, traced
+from app.models.search_dto import VectorSearchResult
+from app.services.vector_service import BatchParticipant, BatchedVectorSearch
+
+
+class SearchPipelineService:
+    """
+    搜尋主流程 (SQL → COUNT → Vector Search → Hybrid Ranking → 格式化) 的服務層封裝。
+
+    為什麼從 Route 抽出：
+    Route 層只應負責請求調度與回應封裝 (見 app/routes/__init__.py)。
+    將整條檢索流程集中在此，快取、合併重複請求等橫切邏輯才有單一的掛載點。
+
+    run() 的產出 (outcome)：
+        {
+            "results":            已排序並格式化的全量店家,
+            "total_count":        SQL 命中總數,
+            "vector_search_info": VectorService 回傳的向量搜尋資訊,
+            "rdb_info":           SQL 階段狀態,
+            "timings":            各階段耗時 (秒),
+            "cache_hit":          是否命中意圖結果快取,
+            "geo_rerank":         是否由位置感知候選快取 (GeoCandidateCache) 依本次座標重算距離與排序,
+            "coalesced":          是否共用同一時間進行中的相同計算 (Single-Flight),
+            "degraded":           為了趕上請求截止時間而採取的降級步驟 (見 app/utils/deadline.py)
+        }
+    """
+
+    def __init__(
+        self,
+        builder,
+        rdbms_repo,
+        vector_service,
+        result_cache: Optional[IntentResultCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        geo_cache: Optional[GeoCandidateCache] = None
+    ):
+        self.builder = builder
+        self.rdbms_repo = rdbms_repo
+        self.vector_service = vector_service
+        self.result_cache = result_cache
+        self.single_flight = single_flight
+        self.geo_cache = geo_cache
+
+    @traced("pipeline.run")
+    async def run(
+        self,
+        plan: Dict[str, Any],
+        profile: bool = False,
+        vector_batch: Optional[BatchParticipant] = None
+    ) -> Dict[str, Any]:
+        """
+        :param profile: 剖析模式 (POST /place_search?profile=true)。
+                        為什麼要繞過快取與 Single-Flight：剖析的目的是看到 SQL / Qdrant / 排序「實際」的耗時，
+                        回傳快取結果或共用別人的計算都無法提供這些資訊；結果也不寫回快取，避免帶 EXPLAIN 開銷的耗時被誤讀。
+        :param vector_batch: 批次搜尋 (run_batch) 的向量階段席位；命中快取或合併至他人計算時不會使用
+        """
+        s_id = plan.get("s_id")
+
+        # 指紋必須在 build_sql 之前計算 (build_sql 會改寫 plan 的 select_fields)
+        fingerprint = compute_intent_fingerprint(plan)
+        plan["intent_fingerprint"] = fingerprint
+        geo_key = self._geo_key(plan)
+
+        if profile:
+            # 只回報快取狀態，不使用快取內容
+            cached = await self.result_cache.get(fingerprint) if self.result_cache is not None else None
+            profile_record(
+                "intent_cache",
+                enabled=self.result_cache is not None,
+                fingerprint=fingerprint,
+                would_hit=cached is not None,
+                bypassed=True,
+            )
+            return await self._execute(plan)
+
+        if self.result_cache is not None:
+            cached = await self.result_cache.get(fingerprint)
+            if cached is not None:
+                annotate(intent_cache_hit=True)
+                logger.info(f"[Search][SID: {s_id}] 命中意圖結果快取 ({fingerprint})，跳過 SQL / 向量檢索")
+                self._ensure_sql_diagnostics(plan, cached)
+                return {
+                    **cached,
+                    "vector_search_info": {**cached["vector_search_info"], "result_cache_hit": True},
+                    "timings": {"sql_service": 0.0, "transition": 0.0, "qdrant": 0.0, "ranking": 0.0},
+                    "cache_hit": True,
+                    "coalesced": False,
+                    "geo_rerank": False,
+                    "degraded": [],
+                }
+
+        if geo_key is not None:
+            candidates = await self.geo_cache.get(geo_key)
+            if candidates is not None:
+                annotate(geo_cache_hit=True)
+                logger.info(f"[Search][SID: {s_id}] 命中位置感知候選快取 ({geo_key})，只重算距離與排序")
+                return await self._rank_geo_candidates(plan, candidates)
+
+        if self.single_flight is None:
+            return await self._execute_and_store(plan, fingerprint, vector_batch, geo_key)
+
+        # 同一指紋若已有進行中的計算，直接等待其結果；每位呼叫者之後仍各自建立自己的 search_ssid
+        # 共用計算不套用發起者的斷線檢查：發起者離開時，SingleFlight 只會在沒有其他等待者時才取消計算
+        led = False
+
+        def lead():
+            nonlocal led
+            led = True
+            return detach_from_client(self._execute_and_store(plan, fingerprint, vector_batch, geo_key))
+
+        # 共用計算是在發起者的 context 內建立的 Task，沿用的是「發起者」的截止時間與降級；
+        # 加入者只以自己的剩餘預算等待，自己的預算用完時回傳 504 (DeadlineExceeded)
+        try:
+            outcome, shared = await self.single_flight.do(
+                fingerprint, lead, join=lambda waiting: within_deadline(waiting, "coalesced")
+            )
+        except DeadlineExceeded as e:
+            if led or e.stage == "coalesced":
+                raise
+            # 發起者的預算先用完：那是別人的截止時間，改以自己的預算重新執行
+            outcome, shared = None, True
+        if not shared:
+            return outcome
+
+        if outcome is None or outcome["degraded"]:
+            # 發起者為了趕上「它自己的」截止時間而降級的結果不能交給加入者 (與不寫入快取的理由相同)
+            logger.info(f"[Search][SID: {s_id}] 合併的相同搜尋逾時或已降級，改以本請求的截止時間重新執行 ({fingerprint})")
+            return await self._execute_and_store(plan, fingerprint, vector_batch, geo_key)
+
+        logger.info(f"[Search][SID: {s_id}] 已合併至進行中的相同搜尋 ({fingerprint})")
+        annotate(coalesced=True)
+        self._ensure_sql_diagnostics(plan, outcome)
+        return {**outcome, "coalesced": True}
+
+    @traced("pipeline.run_batch")
+    async def run_batch(self, plans: List[Dict[str, Any]]) -> List[Union[Dict[str, Any], BaseException]]:
+        """
+        批次搜尋 (POST /place_search/batch)：每個意圖各自經過快取 / Single-Flight / SQL (平行執行)，
+        需要語意搜尋的意圖在向量階段合併成一次 encode 與一次 Qdrant 批次查詢 (見 BatchedVectorSearch)。
+        同一批內指紋相同的意圖只計算一次 (若各自執行，其中一個會以 Single-Flight 等待另一個，而後者又在等批次到齊)。
+        :return: 與 plans 順序一致；單一意圖失敗時該位置為例外物件，不影響其他意圖
+        """
+        # 指紋必須在 build_sql 之前計算 (build_sql 會改寫 plan 的 select_fields)
+        leaders: Dict[str, Dict[str, Any]] = {}
+        for plan in plans:
+            plan["intent_fingerprint"] = compute_intent_fingerprint(plan)
+            leaders.setdefault(plan["intent_fingerprint"], plan)
+
+        batch = BatchedVectorSearch(self.vector_service, participants=len(leaders))
+
+        async def run_one(plan: Dict[str, Any]) -> Dict[str, Any]:
+            participant = batch.participant()
+            try:
+                # 共用批次的截止時間，降級紀錄則各意圖分開
+                with split_deadline():
+                    return await self.run(plan, vector_batch=participant)
+            finally:
+                participant.leave()
+
+        outcomes = await asyncio.gather(*(run_one(plan) for plan in leaders.values()), return_exceptions=True)
+        by_fingerprint = dict(zip(leaders.keys(), outcomes))
+
+        results = []
+        for plan in plans:
+            outcome = by_fingerprint[plan["intent_fingerprint"]]
+            if plan is leaders[plan["intent_fingerprint"]] or isinstance(outcome, BaseException):
+                results.append(outcome)
+            else:
+                # 同批重複的意圖：共用結果，但查無資料時的診斷資訊需要自己的 plan
+                self._ensure_sql_diagnostics(plan, outcome)
+                results.append({**outcome, "coalesced": True})
+        return results
+
+    async def _execute_and_store(
+        self,
+        plan: Dict[str, Any],
+        fingerprint: str,
+        vector_batch: Optional[BatchParticipant] = None,
+        geo_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        candidate_sink = {} if geo_key is not None else None
+        outcome = await self._execute(plan, vector_batch, candidate_sink)
+
+        # 降級結果 (略過 COUNT、語意分數) 只是趕時間的近似值，不能讓之後的相同意圖重用
+        if outcome["degraded"]:
+            return outcome
+
+        if self.result_cache is not None:
+            await self.result_cache.put(fingerprint, {
+                "results": outcome["results"],
+                "total_count": outcome["total_count"],
+                "vector_search_info": outcome["vector_search_info"],
+                "rdb_info": outcome["rdb_info"],
+            })
+
+        # 只有實際進入排序的搜尋才有候選可存 (查無資料、語意分數全數不及格時不寫入)
+        if candidate_sink and "vector_results" in candidate_sink:
+            entry = self._geo_entry(outcome, candidate_sink)
+            if entry is not None:
+                await self.geo_cache.put(geo_key, entry)
+        return outcome
+
+    def _geo_key(self, plan: Dict[str, Any]) -> Optional[str]:
+        """
+        位置感知候選快取的 key；不適用時為 None。必須在 build_sql 之前呼叫 (與意圖指紋相同)。
+
+        只有「取回哪些候選與位置無關」的意圖才能跨座標重用：
+        語意模式固定取評分前 150 筆 (ORDER BY p.rating)，一般模式由 SQL 直接分頁；
+        後者若依距離排序，LIMIT 取回的店家隨位置改變，不能重用。
+        """
+        if self.geo_cache is None or not plan.get("distance_needed"):
+            return None
+        if not plan.get("deferred_sorting") and any(
+            s.get("field") == "distance" for s in plan.get("sort_conditions", [])
+        ):
+            return None
+        return compute_geo_key(plan, Config.GEO_CACHE_PRECISION)
+
+    @staticmethod
+    def _geo_entry(outcome: Dict[str, Any], candidate_sink: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """將排序前的候選整理成可序列化的快取內容；有店家缺少經緯度時無法重算距離，不寫入。"""
+        rows = []
+        for row in candidate_sink["db_results"]:
+            if row.get("lat") is None or row.get("lng") is None:
+                return None
+            # 距離隨每個請求的座標重算，不保存
+            rows.append({key: value for key, value in row.items() if key != "distance"})
+
+        return {
+            "db_results": rows,
+            "vector_results": [
+                {"id": v.id, "score": float(v.score), "review_summary": v.review_summary}
+                for v in candidate_sink["vector_results"]
+            ],
+            "threshold": float(candidate_sink["threshold"]),
+            "total_count": outcome["total_count"],
+            "rdb_info": outcome["rdb_info"],
+            # 耗時屬於當初那次檢索，命中時不沿用
+            "vector_search_info": {
+                key: value for key, value in outcome["vector_search_info"].items()
+                if key not in ("qdrant_time", "ranking_time")
+            },
+        }
+
+    @traced("pipeline.geo_rerank")
+    async def _rank_geo_candidates(self, plan: Dict[str, Any], entry: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        位置感知候選快取命中：以本次 user_location 重算每家店的距離 (NumPy 向量化 haversine)，
+        再以快取的 Qdrant 相似度與語意門檻重跑 _apply_hybrid_ranking，跳過 SQL、COUNT、Embedding 與 Qdrant。
+        """
+        t_start = time.perf_counter()
+
+        location = plan["user_location"]
+        rows = entry["db_results"]
+        distances = haversine_distances(
+            location["lat"], location["lng"], [row["lat"] for row in rows], [row["lng"] for row in rows]
+        )
+        db_results = [{**row, "distance": float(dist)} for row, dist in zip(rows, distances)]
+        vector_results = [
+            VectorSearchResult(id=v["id"], score=v["score"], review_summary=v["review_summary"])
+            for v in entry["vector_results"]
+        ]
+
+        ranked = await self.vector_service._apply_hybrid_ranking(vector_results, db_results, plan, entry["threshold"])
+        ranking_duration = time.perf_counter() - t_start
+
+        outcome = {
+            "results": format_response_data(ranked, plan),
+            "total_count": entry["total_count"],
+            "vector_search_info": {**entry["vector_search_info"], "ranking_time": ranking_duration, "geo_cache_hit": True},
+            "rdb_info": entry["rdb_info"],
+            "timings": {"sql_service": 0.0, "transition": 0.0, "qdrant": 0.0, "ranking": ranking_duration},
+            "cache_hit": False,
+            "coalesced": False,
+            "geo_rerank": True,
+            "degraded": [],
+        }
+        self._ensure_sql_diagnostics(plan, outcome)
+        return outcome
+
+    def _ensure_sql_diagnostics(self, plan: Dict[str, Any], outcome: Dict[str, Any]) -> None:
+        """
+        沒有親自執行檢索的請求 (快取命中、合併計算) 不會經過 build_sql。
+        查無結果時 check_search_status 會讀取 plan 內的 WHERE 子句與參數作為診斷資訊，此時補建即可。
+        """
+        if not outcome["results"]:
+            self.builder.build_sql(plan)
+
+    @traced("pipeline.execute")
+    async def _execute(
+        self,
+        plan: Dict[str, Any],
+        vector_batch: Optional[BatchParticipant] = None,
+        candidate_sink: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        :param candidate_sink: 有值時寫入排序前的候選 (db_results / vector_results / threshold)，供 GeoCandidateCache 保存
+        """
+        s_id = plan.get("s_id")
+
+        # --- 階段一：SQL 查詢 ---
+        rdb_info = {"status": "sql_no_data", "total_count": 0, "is_fallback": False}
+
+        t_sql_start = time.perf_counter()
+
+        final_sql, query_params = self.builder.build_sql(plan)
+        logger.info(f"[Search][SID: {s_id}] 執行 SQL 查詢")
+
+        # 主查詢無法降級：超過截止時間 (DeadlineExceeded → 504) 或 MySQL 滿載 (AdmissionRejected → 503) 時直接往上拋
+        db_results, main_exec_time = await within_deadline(
+            admission.run("mysql", self.rdbms_repo.execute_dynamic_query(final_sql, query_params, s_id)), "sql"
+        )
+
+        # 用戶端已斷線時不再往下執行 (見 app/utils/client_disconnect.py)
+        await checkpoint("count")
+
+        count_sql, count_params = self.builder.build_count_sql(plan)
+        count_exact = budget_allows(Config.DEADLINE_COUNT_MIN_MS)
+        if count_exact:
+            try:
+                # 保留向量階段所需的最低預算，COUNT 不能把時間吃光
+                count_results, count_exec_time = await within_deadline(
+                    admission.run("mysql", self.rdbms_repo.execute_dynamic_query(count_sql, count_params, s_id)),
+                    "count",
+                    reserve_ms=Config.DEADLINE_VECTOR_MIN_MS,
+                )
+            except (DeadlineExceeded, AdmissionRejected):
+                count_exact = False
+
+        t_sql_done = time.perf_counter()
+        sql_service_duration = t_sql_done - t_sql_start
+
+        if count_exact:
+            total_count = count_results[0]['total'] if count_results else 0
+        else:
+            # 以主查詢實際取回的筆數作為總數下限 (主查詢本身有 LIMIT)
+            logger.warning(f"[Search][SID: {s_id}] 剩餘時間預算不足或 MySQL 滿載，略過 COUNT 查詢")
+            mark_degraded("count_skipped")
+            total_count = len(db_results)
+            count_exec_time = 0.0
+        rdb_info["count_exact"] = count_exact
+
+        if profiling():
+            await self._profile_sql(
+                s_id, final_sql, query_params, count_sql, count_params,
+                rows=len(db_results), total_count=total_count,
+                main_exec_time=main_exec_time, count_exec_time=count_exec_time,
+            )
+
+        if total_count == 0:
+            logger.warning(f"[Search][SID: {s_id}] SQL 查無資料")
+            return {
+                "results": [],
+                "total_count": 0,
+                "vector_search_info": {},
+                "rdb_info": rdb_info,
+                "timings": {"sql_service": sql_service_duration, "transition": 0.0, "qdrant": 0.0, "ranking": 0.0},
+                "cache_hit": False,
+                "coalesced": False,
+                "geo_rerank": False,
+                "degraded": degradations(),
+            }
+
+        rdb_info["total_count"] = total_count
+        rdb_info["status"] = "exact_one_match" if total_count == 1 else "success"
+        logger.info(f"[Search][SID: {s_id}] SQL 命中 {total_count} 筆")
+
+        # 剩餘預算偏緊時只把前段候選 (已依 SQL ORDER BY 排序) 送往向量階段，縮短 Qdrant 過濾範圍與排序矩陣
+        if len(db_results) > Config.DEADLINE_CANDIDATE_CAP and not budget_allows(Config.DEADLINE_CAP_BELOW_MS):
+            logger.warning(f"[Search][SID: {s_id}] 剩餘時間預算偏緊，候選由 {len(db_results)} 筆截為 {Config.DEADLINE_CANDIDATE_CAP} 筆")
+            mark_degraded("candidates_capped")
+            db_results = db_results[:Config.DEADLINE_CANDIDATE_CAP]
+
+        await checkpoint("vector")
+
+        # --- 階段二：向量搜尋與權重排序 ---
+        if candidate_sink is not None:
+            candidate_sink["db_results"] = db_results
+        all_ranked_results, vector_search_info = await self.vector_service.search_and_rank(
+            db_results=db_results,
+            plan=plan,
+            total_count=total_count,
+            vector_batch=vector_batch,
+            candidate_sink=candidate_sink
+        )
+        t_vector_done = time.perf_counter()
+
+        # 從 vector_search_info 取得 service 內部的細分秒數
+        qdrant_duration = vector_search_info.get("qdrant_time", 0)
+        ranking_duration = vector_search_info.get("ranking_time", 0)
+
+        # 過渡耗時 = (Vector 總耗時) - (Qdrant 淨耗時) - (指標排序淨耗時)
+        transition_duration = (t_vector_done - t_sql_done) - qdrant_duration - ranking_duration
+
+        await checkpoint("format")
+
+        # --- 階段三：格式化結果 ---
+        all_ranked_results = format_response_data(all_ranked_results, plan)
+
+        return {
+            "results": all_ranked_results,
+            "total_count": total_count,
+            "vector_search_info": vector_search_info,
+            "rdb_info": rdb_info,
+            "timings": {
+                "sql_service": sql_service_duration,
+                "transition": transition_duration,
+                "qdrant": qdrant_duration,
+                "ranking": ranking_duration,
+            },
+            "cache_hit": False,
+            "coalesced": False,
+            "geo_rerank": False,
+            "degraded": degradations(),
+        }
+
+    async def _profile_sql(
+        self,
+        s_id: Optional[str],
+        main_sql: str,
+        main_params: Dict[str, Any],
+        count_sql: str,
+        count_params: Dict[str, Any],
+        *,
+        rows: int,
+        total_count: int,
+        main_exec_time: float,
+        count_exec_time: float,
+    ) -> None:
+        """
+        記錄剖析模式的 SQL 區段；EXPLAIN ANALYZE 在計時結束 (t_sql_done) 之後才執行，不計入 sql_service 耗時。
+        """
+        profile_record(
+            "sql",
+            main_sql=main_sql,
+            main_params=main_params,
+            main_ms=round(main_exec_time * 1000, 2),
+            rows=rows,
+            count_sql=count_sql,
+            count_params=count_params,
+            count_ms=round(count_exec_time * 1000, 2),
+            total_count=total_count,
+        )
+        if not hasattr(self.rdbms_repo, "explain_query"):
+            return
+        profile_record(
+            "explain",
+            main=await self.rdbms_repo.explain_query(main_sql, main_params, analyze=True, s_id=s_id),
+            count=await self.rdbms_repo.explain_query(count_sql, count_params, analyze=True, s_id=s_id),
+        )
+
+    @traced("pipeline.dry_run")
+    async def dry_run(self, plan: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Dry Run 模式 (POST /place_search?dry_run=true)：只產生 SQL 與向量查詢計畫，不執行 SQL、不呼叫 Qdrant / Embedding。
+        EXPLAIN (不含 ANALYZE) 只由優化器估算，不會真正掃描資料表。
+        """
+        s_id = plan.get("s_id")
+        plan["intent_fingerprint"] = compute_intent_fingerprint(plan)
+
+        final_sql, query_params = self.builder.build_sql(plan)
+        count_sql, count_params = self.builder.build_count_sql(plan)
+
+        explain = None
+        if hasattr(self.rdbms_repo, "explain_query"):
+            explain = {
+                "main": await self.rdbms_repo.explain_query(final_sql, query_params, analyze=False, s_id=s_id),
+                "count": await self.rdbms_repo.explain_query(count_sql, count_params, analyze=False, s_id=s_id),
+            }
+
+        keywords = plan.get("vector_keywords")
+        query_str, semantic_parts, facility_tags, soft_preferences = self.vector_service.build_semantic_query(keywords)
+        if semantic_parts:
+            vector_plan = {
+                "mode": "semantic",
+                "query_content": query_str,
+                "facility_tags": facility_tags,
+                "threshold": round(self.vector_service._calculate_dynamic_threshold(keywords, soft_preferences), 4),
+            }
+        else:
+            vector_plan = {"mode": "pure_metric_ranking", "query_content": "", "facility_tags": facility_tags}
+
+        return {
+            "intent_fingerprint": plan["intent_fingerprint"],
+            "sql": {"main_sql": final_sql, "main_params": query_params, "count_sql": count_sql, "count_params": count_params},
+            "explain": explain,
+            "vector": vector_plan,
+        }
@@ -1,17 +1,33 @@
 # app/services/vector_service.py
 from typing import List, Dict, Any, Optional,Tuple
 from app.repository.vector_repository import VectorRepository
-from sentence_transformers import SentenceTransformer
 from app.models.search_dto import VectorSearchResult
-from huggingface_hub import snapshot_download
-import numpy as np
-import math
-from app.utils.app_logger import logger
 import numpy as np
 import math
+from app.utils.log_policy import get_logger, log_detail, lazy
+from app.utils.metrics_registry import EMBEDDING_INFLIGHT
+from app.utils.tracing import traced, span
+from app.utils.request_profile import profile_record
+from app.utils.deadline import DeadlineExceeded, budget_allows, mark_degraded, within_deadline
+from app.utils.admission import AdmissionRejected, admission
+from app.services.embedding_sidecar import EmbeddingClient, EmbeddingUnavailable
+from app.config import Config
 import time
 import json
 import os
+import asyncio
+
+logger = get_logger("vector")
+
+
+def _candidate_sample(db_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # 抽樣日誌內容 (包含店名、類別、標籤與距離)，只有真的輸出時才組裝
+    return [{
+        "name": r.get('restaurant_name'),
+        "cat": r.get('merchant_category'),
+        "dist": f"{r.get('distance', 0):.2f}km",
+        "tags": r.get('facility_tags')
+    } for r in db_results[:3]]
 
     # 本專案之向量搜尋的業務邏輯設計嚴格遵循"宣告式程式設計"
     # 為了提升維護效率與閱讀性所以將業務邏輯與資料庫搜尋之I/O運算分層設計
@@ -82,53 +98,85 @@ class RankSettings:
     SECONDARY_BONUS = 0.2
 
 
+def load_embedding_model():
+    """
+    載入 BGE-M3 嵌入模型 (模型檔不完整時先下載)。
+    local 模式由 VectorService 在每個 Worker 內呼叫；sidecar 模式只由 Embedding Sidecar 程序呼叫一次。
+    為什麼在函式內 import：sentence_transformers 會連帶載入 torch (數秒)，sidecar 模式的 Worker 根本用不到。
+    """
+    from huggingface_hub import snapshot_download
+    from sentence_transformers import SentenceTransformer
+
+    model_name = "BAAI/bge-m3"
+    # 定義路徑 (確保在 /code/models/bge_m3)
+    base_dir = os.getcwd()
+    model_path = os.path.abspath(os.path.join(base_dir, "models", "bge_m3"))
+
+    # 如果目錄下沒有關鍵檔案 (例如 config.json)，就執行下載
+    # 注意：只判斷資料夾存在有時候不保險(可能下載到一半中斷)，判斷 config.json 更嚴謹
+    if not os.path.exists(os.path.join(model_path, "config.json")):
+        logger.info(f"模型檔案不完整，準備下載至 {model_path}...")
+        os.makedirs(model_path, exist_ok=True)
+
+        snapshot_download(
+            repo_id=model_name,
+            local_dir=model_path,
+            local_dir_use_symlinks=False  # 務必保持 False，否則 Docker 內路徑會出錯
+        )
+
+    # 載入模型 (路徑完全一致)
+    logger.info(f"正在從 {model_path} 載入 BGE-M3 嵌入模型...")
+    model = SentenceTransformer(model_path)
+
+    model.to('cuda')
+    logger.info("模型載入完成")
+    return model
+
+
 class VectorService:
-    def __init__(self):
-        self.model_name = "BAAI/bge-m3"
-        # 定義路徑 (確保在 /code/models/bge_m3)
-        base_dir = os.getcwd() 
-        self.model_path = os.path.abspath(os.path.join(base_dir, "models", "bge_m3"))
-        
-        # 如果目錄下沒有關鍵檔案 (例如 config.json)，就執行下載
-        # 注意：只判斷資料夾存在有時候不保險(可能下載到一半中斷)，判斷 config.json 更嚴謹
-        if not os.path.exists(os.path.join(self.model_path, "config.json")):
-            logger.info(f"模型檔案不完整，準備下載至 {self.model_path}...")
-            os.makedirs(self.model_path, exist_ok=True) 
-            
-            snapshot_download(
-                repo_id=self.model_name,
-                local_dir=self.model_path,
-                local_dir_use_symlinks=False  # 務必保持 False，否則 Docker 內路徑會出錯
+    # 暖機用的查詢：與 build_semantic_query 的模板相同句型，讓 Tokenizer 與 CUDA Kernel 在第一個真實請求前完成初始化
+    WARMUP_QUERIES = (
+        "推薦日式風味的餐廳。",
+        "我想找關於拉麵的店家。 這家店的食物吃起來是清淡口味的。",
+        "希望能有這些特色：氣氛好 適合約會。",
+    )
+
+    def __init__(self, encoder=None, repo: Optional[VectorRepository] = None, load_model: bool = True):
+        """
+        :param encoder:    選用的嵌入模型 (需提供與 SentenceTransformer 相同的 encode 介面)
+        :param repo:       選用的 VectorRepository
+        :param load_model: False 時延後到 warmup() 才載入模型 (startup 在背景暖機，見 app/__init__.py)
+        為什麼允許注入：壓測 (benchmarks/loadtest.py) 需在沒有 GPU / 模型檔的機器上，
+        以替身 encoder 與本機 Qdrant 驅動同一套檢索與排序邏輯；正式環境兩者皆不傳。
+
+        Config.EMBEDDING_MODE = "sidecar" 時本程序不載入模型，改經 Unix Socket 向 Embedding Sidecar 取得向量，
+        多個 uvicorn Worker 共用同一份模型 (見 app/services/embedding_sidecar.py)。
+        """
+        self.embedding_client: Optional[EmbeddingClient] = None
+        if encoder is not None:
+            self.model = encoder
+        elif Config.EMBEDDING_MODE == "sidecar":
+            self.model = None
+            self.embedding_client = EmbeddingClient(
+                Config.EMBEDDING_SOCKET_PATH,
+                timeout=Config.EMBEDDING_CLIENT_TIMEOUT,
+                pool_size=Config.EMBEDDING_CLIENT_POOL_SIZE,
             )
-        
-        # 載入模型 (路徑完全一致)
-        logger.info(f"正在從 {self.model_path} 載入 BGE-M3 嵌入模型...")
-        self.model = SentenceTransformer(self.model_path) 
-        
-
-        self.model.to('cuda') 
-        logger.info("模型載入完成")
+            logger.info(f"[Vector Service] 使用 Embedding Sidecar: {Config.EMBEDDING_SOCKET_PATH}")
+        else:
+            self.model = load_embedding_model() if load_model else None
 
         # 初始化 Repo
-        self.repo = VectorRepository()
+        self.repo = repo if repo is not None else VectorRepository()
 
 
 
-    # 檢查向量需求 - 向量搜尋 - 權重計算與排序
-    async def search_and_rank(
-        self,
-        db_results: List[Dict[str, Any]],
-        plan: Dict[str, Any],
-        total_count: int = 0
-    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
-    
-        # 獲取當次查詢的s_id用於紀錄詳細日誌
-        # keywords: 紀錄當次查詢需要的所有語意搜尋關鍵字
-        s_id = plan.get("s_id", "unknown_sid")
-        keywords = plan.get("vector_keywords")
-
-        # 初始化結果容器與狀態指標
-        info = {"status": "init", "message": "", "is_fallback": False}
+    def build_semantic_query(self, keywords: Any) -> Tuple[str, List[str], List[str], List[str]]:
+        """
+        由 plan["vector_keywords"] 組出語意查詢字串與 Qdrant 硬性過濾標籤。
+        為什麼獨立成方法：/place_search 的 dry_run 模式需要在不呼叫模型與向量庫的情況下預覽這些內容。
+        :return: (query_str, semantic_parts, facility_tags, soft_preferences)；semantic_parts 為空代表走純指標排序
+        """
         soft_preferences = []       # 用於動態門檻計算的參考
         semantic_parts = []         # 構建向量搜尋用的字串
         facility_tags = []          # 準備送往 Qdrant Filtering 的硬性標籤
@@ -182,6 +230,31 @@ class VectorService:
         # 4. 組合最終查詢字串
         query_str = " ".join(semantic_parts) or "推薦優質的美食餐廳"
 
+        return query_str, semantic_parts, facility_tags, soft_preferences
+
+    # 檢查向量需求 - 向量搜尋 - 權重計算與排序
+    @traced("vector.search_and_rank")
+    async def search_and_rank(
+        self,
+        db_results: List[Dict[str, Any]],
+        plan: Dict[str, Any],
+        total_count: int = 0,
+        vector_batch: Optional["BatchParticipant"] = None,
+        candidate_sink: Optional[Dict[str, Any]] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        :param vector_batch: POST /place_search/batch 的批次席位；有值時 Embedding 與 Qdrant 查詢與同批其他意圖合併執行
+        :param candidate_sink: 有值時寫入排序前的 vector_results 與語意門檻，供位置感知候選快取 (GeoCandidateCache) 保存；
+                               未進入排序 (查無語意相符) 時不寫入
+        """
+    
+        # 獲取當次查詢的s_id用於紀錄詳細日誌
+        # keywords: 紀錄當次查詢需要的所有語意搜尋關鍵字
+        s_id = plan.get("s_id", "unknown_sid")
+        keywords = plan.get("vector_keywords")
+
+        query_str, semantic_parts, facility_tags, soft_preferences = self.build_semantic_query(keywords)
+
         # 將 query_str 塞進 info 回傳給 Route 層紀錄
         info = {
             "status": "init", 
@@ -197,28 +270,48 @@ class VectorService:
         logger.info(f"[Vector Service][SID: {s_id}] 候選店家筆數 (SQL Results): {len(db_results)}")
 
         # 只要執行到這，代表一定有資料 (Case 1 or N)
-        # 統一輸出抽樣日誌，幫助除錯 (包含店名、類別、標籤，建議加上距離)
-        sample_data = [{ 
-            "name": r.get('restaurant_name'), 
-            "cat": r.get('merchant_category'), 
-            "dist": f"{r.get('distance', 0):.2f}km", # 加上距離更專業
-            "tags": r.get('facility_tags') 
-        } for r in db_results[:3]]
-        
+        # 統一輸出抽樣日誌，幫助除錯；範例內容以 lazy 包裝，未被取樣時不會組裝
         logger.info(f"[Vector Service][SID: {s_id}] SQL 命中 {len(db_results)} 筆 (總數: {total_count})")
-        logger.info(f"[Vector Service][SID: {s_id}] 候選範例: {sample_data}")
+        log_detail(logger, "candidate_sample", "[Vector Service][SID: %s] 候選範例: %s", s_id, lazy(_candidate_sample, db_results))
         logger.info(f"[Vector Service][SID: {s_id}] 最終送往向量庫的字串: '{query_str}'")
 
         # 關聯式資料庫的店家搜尋結果列表,準備要丟入向量進行範圍搜尋
         rdbms_ids = [row.get("id") for row in db_results] 
 
+        # 請求截止時間 (app/utils/deadline.py)：剩餘預算不夠跑 Embedding + Qdrant 時，直接降級為純指標排序
+        budget_exhausted = bool(semantic_parts) and not budget_allows(Config.DEADLINE_VECTOR_MIN_MS)
+        if budget_exhausted:
+            logger.warning(f"[Vector Service][SID: {s_id}] 剩餘時間預算不足，略過語意搜尋，降級為 [純指標排序模式]")
+            mark_degraded("vector_skipped")
+
         # 如果沒語意需求，也不需要硬性過濾標籤，就走純排序
-        if not semantic_parts:
+        if not semantic_parts or budget_exhausted:
             logger.info(f"[Vector Service][SID: {s_id}] 無明確語意需求，進入 [純指標排序模式]")
             logger.info(f"[Vector Service][SID: {s_id}] 走純排序搜尋通道")
 
-            # 純 ID 提取，此時取得的 vector_results 內部的 score 已經是 1.0
-            vector_results = await self.repo.get_dtos_by_ids(rdbms_ids)
+            if budget_exhausted:
+                # 降級時連 Qdrant 取評論摘要都省略
+                vector_results = self._unscored_results(rdbms_ids)
+                profile_record("embedding", skipped=True, reason="deadline")
+            else:
+                # 純 ID 提取，此時取得的 vector_results 內部的 score 已經是 1.0
+                try:
+                    vector_results = await within_deadline(
+                        admission.run("qdrant", self.repo.get_dtos_by_ids(rdbms_ids)),
+                        "qdrant",
+                        reserve_ms=Config.DEADLINE_RANKING_RESERVE_MS,
+                    )
+                except DeadlineExceeded:
+                    # 與卸載相同，只是少了評論摘要，排序結果不變
+                    logger.warning(f"[Vector Service][SID: {s_id}] 剩餘時間預算不足，略過評論摘要")
+                    mark_degraded("vector_timeout")
+                    vector_results = self._unscored_results(rdbms_ids)
+                except AdmissionRejected as e:
+                    # 只是少了評論摘要，排序結果不變
+                    logger.warning(f"[Vector Service][SID: {s_id}] {e}，略過評論摘要")
+                    mark_degraded("vector_shed")
+                    vector_results = self._unscored_results(rdbms_ids)
+                profile_record("embedding", skipped=True, reason="pure_metric_ranking")
 
 
             # 以下採用防禦性編程 (Defensive Programming)
@@ -250,21 +343,52 @@ class VectorService:
             #    base_amenities=None
             #)
 
-            query_vector = self.model.encode(query_str, normalize_embeddings=True).tolist()
-            
-
             # 混和搜尋版本(Filtering + Similarity)的向量資料庫搜尋
-            vector_results = await self.repo.search_in_ids_hybrid(
-                query_vector, # 傳入算好的向量
-                rdbms_ids, 
-                facility_tags=facility_tags
-            )
+            # 超過剩餘預算 (保留排序所需時間) 或推論 / Qdrant 滿載被卸載時，放棄語意分數，與純指標排序相同的方式處理
+            try:
+                if vector_batch is not None:
+                    # 批次模式：等同批所有意圖到齊後，一次 encode 與一次 Qdrant 批次查詢 (見 BatchedVectorSearch)
+                    vector_results = await within_deadline(
+                        vector_batch.search(query_str, rdbms_ids, facility_tags),
+                        "qdrant",
+                        reserve_ms=Config.DEADLINE_RANKING_RESERVE_MS,
+                    )
+                else:
+                    # Embedding (含等待 inference 名額與執行緒推論) 與 Qdrant 共用同一段預算：
+                    # 只限制 Qdrant 時，請求可能在模型前排隊就把截止時間用完，排序保留時間也形同虛設
+                    async def _encode_and_search() -> List[VectorSearchResult]:
+                        query_vector = await self._encode_query(query_str)
+                        return await admission.run("qdrant", self.repo.search_in_ids_hybrid(
+                            query_vector, # 傳入算好的向量
+                            rdbms_ids, 
+                            facility_tags=facility_tags
+                        ))
+
+                    vector_results = await within_deadline(
+                        _encode_and_search(),
+                        "qdrant",
+                        reserve_ms=Config.DEADLINE_RANKING_RESERVE_MS,
+                    )
+                vector_degraded = None
+            except DeadlineExceeded:
+                vector_degraded = "vector_timeout"
+            except AdmissionRejected as e:
+                vector_degraded = "vector_shed"
+                logger.warning(f"[Vector Service][SID: {s_id}] {e}")
+            except EmbeddingUnavailable as e:
+                vector_degraded = "vector_unavailable"
+                logger.error(f"[Vector Service][SID: {s_id}] {e}")
+
+            if vector_degraded:
+                logger.warning(f"[Vector Service][SID: {s_id}] 語意搜尋降級 ({vector_degraded})，改走 [純指標排序模式]")
+                mark_degraded(vector_degraded)
+                vector_results = self._unscored_results(rdbms_ids)
 
             q_end = time.perf_counter()
             info["qdrant_time"] = q_end - q_start
     
-            # 動態調整門檻,根據用戶查詢複雜度
-            CURRENT_THRESHOLD = self._calculate_dynamic_threshold(keywords, soft_preferences)
+            # 動態調整門檻,根據用戶查詢複雜度 (降級時與純排序模式相同，關閉門檻)
+            CURRENT_THRESHOLD = 0.0 if vector_degraded else self._calculate_dynamic_threshold(keywords, soft_preferences)
             
             best_score = vector_results[0].score if vector_results else 0.0
             
@@ -286,16 +410,141 @@ class VectorService:
 
         # --- 4. 執行權重排序 (Hybrid Ranking) ---
         logger.info(f"[Vector Service][SID: {s_id}] 進入混合排序階段，候選數: {len(vector_results)}")
+        if candidate_sink is not None:
+            candidate_sink.update(vector_results=vector_results, threshold=CURRENT_THRESHOLD)
         r_start = time.perf_counter()
         final_results = await self._apply_hybrid_ranking(
             vector_results, db_results, plan, CURRENT_THRESHOLD
         )
         r_end = time.perf_counter()
         info["ranking_time"] = r_end - r_start
+        profile_record(
+            "ranking",
+            input_vector_results=len(vector_results),
+            input_db_rows=len(db_results),
+            threshold=round(CURRENT_THRESHOLD, 4),
+            best_score=round(float(best_score), 4),
+            output=len(final_results),
+            ms=round(info["ranking_time"] * 1000, 2),
+        )
         
         return final_results, info
     
 
+
+    async def warmup(self) -> Dict[str, Any]:
+        """
+        載入模型 (若尚未載入) 並執行幾次暖機推論；失敗時拋出例外，由 Readiness 重試。
+        sidecar 模式則是確認 Sidecar 可連線、推論正常。
+        """
+        t0 = time.perf_counter()
+        info: Dict[str, Any] = {"mode": "sidecar" if self.embedding_client is not None else "local"}
+        if self.embedding_client is not None:
+            for query in self.WARMUP_QUERIES:
+                await self.embedding_client.encode(query)
+        else:
+            if self.model is None:
+                self.model = await asyncio.to_thread(load_embedding_model)
+                info["load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            t_encode = time.perf_counter()
+            for query in self.WARMUP_QUERIES:
+                await asyncio.to_thread(self.model.encode, query, normalize_embeddings=True)
+            info["warmup_encode_ms"] = round((time.perf_counter() - t_encode) * 1000, 1)
+        logger.info(f"[Vector Service] Embedding 暖機完成: {info}")
+        return info
+
+    async def _encode_query(self, query_str: str) -> List[float]:
+        return (await self._encode_queries([query_str]))[0]
+
+    async def _encode_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        將語意查詢字串轉為向量 (多筆時一次送進模型，批次推論的成本遠低於逐筆)。
+        為什麼改在執行緒池推論：encode 是同步的 CPU / GPU 運算，原本直接在 Event Loop 上執行，
+        推論期間其他請求 (包含只讀 Redis 的翻頁) 全部停擺。移到執行緒後以 inference 名額限制同時推論數，
+        滿載時拋出 AdmissionRejected 而不是無止盡排隊。
+        """
+        query_chars = sum(len(q) for q in queries)
+        with span("embedding.encode", query_chars=query_chars, batch=len(queries)):
+            if self.embedding_client is not None:
+                # 記錄進行中 (含排隊) 的 encode 數量：推論變慢時可從 /metrics 看出請求是否在模型前排隊
+                EMBEDDING_INFLIGHT.inc()
+                try:
+                    async with admission.limit("inference"):
+                        t_encode = time.perf_counter()
+                        # sidecar 模式：推論在 Sidecar 程序內與其他 Worker 的請求合併成批次；
+                        # inference 名額此時限制的是本 Worker 同時送往 Sidecar 的請求數
+                        query_vectors = list(await asyncio.gather(*(self.embedding_client.encode(q) for q in queries)))
+                finally:
+                    EMBEDDING_INFLIGHT.dec()
+            else:
+                if self.model is None:
+                    # 背景暖機尚未載入完成 (Readiness 會先擋下請求，這裡只是保險)：降級為純指標排序
+                    raise EmbeddingUnavailable("embedding model is still loading")
+                embedding, t_encode = await self._encode_local(queries)
+                query_vectors = [embedding.tolist()] if len(queries) == 1 else embedding.tolist()
+            profile_record(
+                "embedding",
+                skipped=False,
+                source="sidecar" if self.embedding_client is not None else "local",
+                query=queries[0] if len(queries) == 1 else list(queries),
+                query_chars=query_chars,
+                batch=len(queries),
+                dim=len(query_vectors[0]),
+                ms=round((time.perf_counter() - t_encode) * 1000, 2),
+            )
+            return query_vectors
+
+    async def _encode_local(self, queries: List[str]) -> Tuple[Any, float]:
+        """
+        本機模型推論：等待 inference 名額與執行緒推論放在同一個背景 Task。
+        • 還在排隊時被取消 (截止時間 / 用戶端斷線)：連同 Task 一起取消，尚未佔用模型
+        • 已開始推論時被取消：執行緒無法中斷，Task 在背景跑完才釋放名額 (同時推論數不超過上限)，
+          呼叫端則立即返回，截止時間到了就能回應降級結果，不必陪著等推論結束
+        :return: (模型輸出, 開始推論的 perf_counter)
+        """
+        encode_input = queries[0] if len(queries) == 1 else list(queries)
+        state: Dict[str, float] = {}
+
+        async def run():
+            # 記錄進行中 (含排隊) 的 encode 數量：推論變慢時可從 /metrics 看出請求是否在模型前排隊
+            EMBEDDING_INFLIGHT.inc()
+            try:
+                async with admission.limit("inference"):
+                    state["t_encode"] = time.perf_counter()
+                    return await asyncio.to_thread(self.model.encode, encode_input, normalize_embeddings=True)
+            finally:
+                EMBEDDING_INFLIGHT.dec()
+
+        task = asyncio.ensure_future(run())
+        try:
+            embedding = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if "t_encode" not in state:
+                task.cancel()
+            # 回收背景 Task 的結果，避免 "exception was never retrieved" 警告
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            raise
+        return embedding, state["t_encode"]
+
+    async def search_batch(
+        self,
+        requests: List[Tuple[str, List[Any], List[str]]]
+    ) -> List[List[VectorSearchResult]]:
+        """
+        批次語意搜尋：requests 為 (query_str, rdbms_ids, facility_tags)；相同的查詢字串只 encode 一次，
+        所有意圖共用一次 Qdrant 批次查詢。例外 (AdmissionRejected / EmbeddingUnavailable) 由呼叫端依單筆流程降級。
+        """
+        unique_queries = list(dict.fromkeys(query_str for query_str, _, _ in requests))
+        vectors = dict(zip(unique_queries, await self._encode_queries(unique_queries)))
+        return await admission.run("qdrant", self.repo.search_in_ids_hybrid_batch([
+            (vectors[query_str], rdbms_ids, facility_tags) for query_str, rdbms_ids, facility_tags in requests
+        ]))
+
+    @staticmethod
+    def _unscored_results(rdbms_ids: List[Any]) -> List[VectorSearchResult]:
+        """降級用：不經 Qdrant，直接以 SQL 候選建立滿分 DTO (與 get_dtos_by_ids 相同的 score=1.0 語意，但沒有評論摘要)。"""
+        return [VectorSearchResult(id=i, score=1.0) for i in rdbms_ids if i is not None]
+
     
     def _calculate_dynamic_threshold(
         self, 
@@ -354,6 +603,7 @@ class VectorService:
     # 根據向量查詢結果進行權重運算與排序
     # 為什麼移除 top_k 截斷：現在由 Route 層搭配 Redis 分頁快取處理截斷，
     # 此方法負責回傳所有通過語意門檻的店家，確保分頁能存取完整排序結果
+    @traced("vector.apply_hybrid_ranking")
     async def _apply_hybrid_ranking(
         self,
         vector_results: List[VectorSearchResult],
@@ -369,37 +619,7 @@ class VectorService:
     
         vector_map = {str(v.id): v for v in vector_results}
 
-        # LLM 有時候會給一些垃圾標籤，這邊先擋掉以免後面崩潰
-        sort_conditions = plan.get("sort_conditions", [])
-
-        # Filter out trash tags
-        valid_conditions = [
-            cond.get("field") for cond in sort_conditions 
-            if isinstance(cond, dict) and cond.get("field") in RankSettings.ALLOWED_FIELDS
-        ]
-
-
-        if not valid_conditions:
-            weights = RankSettings.DEFAULT_WEIGHTS.copy()
-            sort_strategy = "預設語意優先"
-        else:
-            weights = RankSettings.DYNAMIC_BASE.copy()
-            sort_strategy = f"條件排序 ({', '.join(valid_conditions)})"
-            
-            # 動態分配累加
-            # the competition
-            for idx, field in enumerate(valid_conditions):
-                bonus = RankSettings.PRIMARY_BONUS if idx == 0 else RankSettings.SECONDARY_BONUS
-                weights[field] = weights.get(field, 0.0) + bonus
-
-        # 總和必須是 1，不然 NumPy 的 exp 會算到起飛
-        total_w = sum(weights.values())
-        if total_w > 0:
-            # 因為 round(..., 2) 有時候會讓總和變成 0.99 或 1.01。雖然對 np.exp 影響不大，
-            # 為了數據純淨把round(...,2)拿掉
-            weights = {k: v / total_w for k, v in weights.items()}
-        else:
-            weights = RankSettings.DEFAULT_WEIGHTS.copy()
+        weights, sort_strategy = self._resolve_weights(plan.get("sort_conditions", []))
 
         logger.info(f"[Hybrid Rank][SID: {s_id}] 採用策略: {sort_strategy}, 最終權重分配: {weights}")
 
@@ -474,7 +694,7 @@ class VectorService:
 
             raw_tags = store_entry.get("facility_tags")
 
-            logger.info(f"[DEBUG] ID:{v_id} 原始 raw_tags 型態: {type(raw_tags)} 內容: {raw_tags}")
+            log_detail(logger, "rank_row", "[Hybrid Rank] ID:%s 原始 raw_tags 型態: %s 內容: %s", v_id, type(raw_tags), raw_tags)
 
             if raw_tags:
                 if isinstance(raw_tags, str):
@@ -498,39 +718,7 @@ class VectorService:
             if name in seen_names:
                 continue
                 
-            # 找出這家店得分最高的維度索引
-            
-            # 把權重為 0.0 的維度，分數設為極小的負數 (-999.0)，讓它絕對不可能成為最大值
-            #for i, w in enumerate(weights_vec):
-            #    if w == 0.0:
-            #        masked_contribution[i] = -999.0 
-            # 1. 取得語意匹配等級
-            sim_val = matrix[idx][0]
-            if sim_val >= 0.60:
-                sim_text = "高度符合需求"
-            elif sim_val >= 0.45:
-                sim_text = "語意大致符合"
-            else:
-                sim_text = "部分特徵相關"
-
-            # 2. 找出除了「語意相似度(Index 0)」外，貢獻度最高的指標
-            # Index 0:語意, 1:評價, 2:人氣, 3:距離
-            other_reason_tags = ["", "高分評價推薦", "人氣名店", "距離最近"]
-            
-            mask = (weights_vec == 0.0)
-            row_contribution = contribution_matrix[idx].copy()
-            row_contribution[0] = -999.0  # 強制排除相似度維度，因為它已經由 sim_text 代表
-            row_contribution[mask] = -999.0 
-            
-            best_other_dim = np.argmax(row_contribution)
-            
-            # 3. 組合最終理由
-            if row_contribution[best_other_dim] > -100:
-                final_reason = f"{sim_text}，且{other_reason_tags[best_other_dim]}"
-            else:
-                final_reason = sim_text
-
-            store_entry["ranking_reason"] = final_reason
+            store_entry["ranking_reason"] = self._ranking_reason(matrix[idx][0], contribution_matrix[idx], weights_vec)
 
             store_entry["applied_strategy"] = sort_strategy
             store_entry["hybrid_score"] = round(float(final_scores[idx]), 4)
@@ -542,6 +730,9 @@ class VectorService:
                 "popularity": round(matrix[idx][2], 2),
                 "distance": round(matrix[idx][3], 2)
             }
+            # 未四捨五入的四項指標 (不輸出給呼叫端，見 app/utils/response_projection.py)：
+            # 重新排序 (POST /place_search/{search_ssid}/resort) 只靠這組數值即可重算分數，不必重跑 SQL 與 Qdrant
+            store_entry["_rank_features"] = [float(v) for v in matrix[idx]]
             
             final_results.append(store_entry)
             seen_names.add(name)  # 標記此店名已處理
@@ -553,6 +744,179 @@ class VectorService:
         logger.info(f"[Hybrid Rank][SID: {s_id}] 排序完成，已生成可解釋性理由。")
         return final_results
 
+    @staticmethod
+    def _resolve_weights(sort_conditions: Any) -> Tuple[Dict[str, float], str]:
+        """依排序條件決定四項指標的權重 (總和為 1) 與策略說明。"""
+        # LLM 有時候會給一些垃圾標籤，這邊先擋掉以免後面崩潰
+        # Filter out trash tags
+        valid_conditions = [
+            cond.get("field") for cond in (sort_conditions or [])
+            if isinstance(cond, dict) and cond.get("field") in RankSettings.ALLOWED_FIELDS
+        ]
+
+        if not valid_conditions:
+            weights = RankSettings.DEFAULT_WEIGHTS.copy()
+            sort_strategy = "預設語意優先"
+        else:
+            weights = RankSettings.DYNAMIC_BASE.copy()
+            sort_strategy = f"條件排序 ({', '.join(valid_conditions)})"
+            
+            # 動態分配累加
+            # the competition
+            for idx, field in enumerate(valid_conditions):
+                bonus = RankSettings.PRIMARY_BONUS if idx == 0 else RankSettings.SECONDARY_BONUS
+                weights[field] = weights.get(field, 0.0) + bonus
+
+        # 總和必須是 1，不然 NumPy 的 exp 會算到起飛
+        total_w = sum(weights.values())
+        if total_w > 0:
+            # 因為 round(..., 2) 有時候會讓總和變成 0.99 或 1.01。雖然對 np.exp 影響不大，
+            # 為了數據純淨把round(...,2)拿掉
+            weights = {k: v / total_w for k, v in weights.items()}
+        else:
+            weights = RankSettings.DEFAULT_WEIGHTS.copy()
+        return weights, sort_strategy
+
+    @staticmethod
+    def _ranking_reason(sim_val: float, contribution_row: np.ndarray, weights_vec: np.ndarray) -> str:
+        """由語意匹配等級與貢獻度最高的其他指標組出推薦理由。"""
+        # 1. 取得語意匹配等級
+        if sim_val >= 0.60:
+            sim_text = "高度符合需求"
+        elif sim_val >= 0.45:
+            sim_text = "語意大致符合"
+        else:
+            sim_text = "部分特徵相關"
+
+        # 2. 找出除了「語意相似度(Index 0)」外，貢獻度最高的指標
+        # Index 0:語意, 1:評價, 2:人氣, 3:距離
+        other_reason_tags = ["", "高分評價推薦", "人氣名店", "距離最近"]
+
+        # 把權重為 0.0 的維度，分數設為極小的負數 (-999.0)，讓它絕對不可能成為最大值
+        mask = (weights_vec == 0.0)
+        row_contribution = contribution_row.copy()
+        row_contribution[0] = -999.0  # 強制排除相似度維度，因為它已經由 sim_text 代表
+        row_contribution[mask] = -999.0
+
+        best_other_dim = np.argmax(row_contribution)
+
+        # 3. 組合最終理由
+        if row_contribution[best_other_dim] > -100:
+            return f"{sim_text}，且{other_reason_tags[best_other_dim]}"
+        return sim_text
+
+    @staticmethod
+    def _row_features(row: Dict[str, Any]) -> List[float]:
+        features = row.get("_rank_features")
+        if features is not None:
+            return features
+        # 舊版 Session (尚未帶 _rank_features) 退回兩位小數的 score_analysis，排序結果為近似值
+        analysis = row.get("score_analysis") or {}
+        return [float(analysis.get(key, 0.0)) for key in ("similarity", "rating", "popularity", "distance")]
+
+    @traced("vector.rerank")
+    def rerank(self, rows: List[Dict[str, Any]], sort_conditions: Any) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        以新的排序條件重新排序已排好的結果 (POST /place_search/{search_ssid}/resort)。
+        為什麼可以不重跑檢索：語意門檻只看相似度，與排序條件無關；排序條件只影響權重，
+        對 Session 中每筆店家保存的四項指標重算對數空間加權分數即可，O(N) 且不需 MySQL / Embedding / Qdrant。
+        注意同名店家去重 (連鎖店只保留一家) 不會重做：Session 只保存原始權重下勝出的那一家，其他分店已不在 Session 中，
+        因此保留哪一家反映的是「原本」的排序；改以新條件重新搜尋時，可能會保留另一家分店 (例如依距離排時較近的分店)。
+        Session 的資料同時被 L1 快取與背景寫入引用，這裡一律產生新的 dict。
+        :return: (重新排序後的結果, 策略說明)
+        """
+        weights, sort_strategy = self._resolve_weights(sort_conditions)
+        if not rows:
+            return [], sort_strategy
+
+        matrix = np.array([self._row_features(row) for row in rows], dtype=float)
+        weights_vec = np.array([
+            weights["similarity"],
+            weights["rating"],
+            weights["popularity"],
+            weights["distance"]
+        ])
+        contribution_matrix = np.log(matrix + 1e-6) * weights_vec
+        final_scores = np.exp(np.sum(contribution_matrix, axis=1))
+
+        reranked = []
+        # 同分時維持原本的相對順序
+        for idx in np.argsort(-final_scores, kind="stable"):
+            entry = dict(rows[idx])
+            entry["ranking_reason"] = self._ranking_reason(matrix[idx][0], contribution_matrix[idx], weights_vec)
+            entry["applied_strategy"] = sort_strategy
+            entry["hybrid_score"] = round(float(final_scores[idx]), 4)
+            reranked.append(entry)
+        return reranked, sort_strategy
+
+
+class BatchedVectorSearch:
+    """
+    POST /place_search/batch 的向量階段合併器。
+    每個意圖各自跑 SQL (平行)，抵達語意搜尋時以 BatchParticipant.search() 登記並等待；
+    當所有意圖都「已登記」或「已結束 (查無資料、純指標排序、命中快取等不需要語意搜尋的情況)」時，
+    一次 encode 所有查詢字串並送出一次 Qdrant 批次查詢，再把結果分送回各意圖繼續排序。
+    """
+
+    def __init__(self, vector_service: "VectorService", participants: int):
+        self.vector_service = vector_service
+        self._outstanding = participants
+        self._pending: List[Tuple[Tuple[str, List[Any], List[str]], asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def participant(self) -> "BatchParticipant":
+        return BatchParticipant(self)
+
+    def _register(self, request: Tuple[str, List[Any], List[str]]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # 等待者被取消後仍可能收到批次例外：先掛上讀取，避免 "exception was never retrieved" 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._pending.append((request, future))
+        self._arrive()
+        return future
+
+    def _arrive(self) -> None:
+        self._outstanding -= 1
+        if self._outstanding == 0 and self._pending and self._flush_task is None:
+            # 在獨立 Task 執行：某個意圖被取消 (逾時 / 斷線) 時不會連帶中斷其他意圖共用的批次
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+    async def _flush(self) -> None:
+        pending = self._pending
+        try:
+            batches = await self.vector_service.search_batch([request for request, _ in pending])
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), results in zip(pending, batches):
+            if not future.done():
+                future.set_result(results)
+
+
+class BatchParticipant:
+    """BatchedVectorSearch 中單一意圖的席位；每個席位只會登記一次或離開一次。"""
+
+    __slots__ = ("_batch", "_done")
+
+    def __init__(self, batch: BatchedVectorSearch):
+        self._batch = batch
+        self._done = False
+
+    async def search(self, query_str: str, rdbms_ids: List[Any], facility_tags: List[str]) -> List[VectorSearchResult]:
+        if self._done:
+            raise RuntimeError("batch participant already used")
+        self._done = True
+        future = self._batch._register((query_str, rdbms_ids, facility_tags))
+        # shield：被取消的只是這個意圖的等待，批次本身照常完成並分送給其他意圖
+        return await asyncio.shield(future)
+
+    def leave(self) -> None:
+        """意圖結束時呼叫 (不論是否登記過)；未登記就結束的意圖不再讓批次等待。"""
+        if not self._done:
+            self._done = True
+            self._batch._arrive()
 
 if __name__ == "__main__":
     import asyncio
@@ -606,4 +970,4 @@ if __name__ == "__main__":
             print("提示：如果報錯是在 repo.search_in_ids，代表你可能沒開 Qdrant 或連不到 DB。")
 
     # 啟動非同步測試迴圈
-    asyncio.run(test_run())
\ No newline at end of file
+    asyncio.run(test_run())
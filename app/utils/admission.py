@@ -0,0 +1,173 @@
+# app/utils/admission.py
+"""
+准入控制與負載卸載 (Admission Control & Load Shedding)
+
+為什麼需要：
+    VectorRepository 原本的 gpu_limit = asyncio.Semaphore(10) 從未包住真正的 encode 呼叫，
+    除此之外沒有任何地方限制同時進行的工作量。流量超過處理能力時，請求只會在 Event Loop、
+    連線池與執行緒池前無止盡地排隊：每個請求都變慢，最後一起逾時，吞吐量反而下降。
+
+做法：每個階段一個 StageLimiter (並行上限 + 佇列上限 + 最長等待)，超過就立即拒絕，不再排隊
+    search    ：POST /place_search 的入口 (Middleware)，擋在所有工作之前，卸載成本最低
+    page      ：GET /place_search/page 的入口；與 search 分屬不同通道，搜尋塞車時翻頁仍可通過
+    inference ：Embedding 推論 (在執行緒池執行)，上限即同時推論的執行緒數
+    mysql     ：主查詢與 COUNT 查詢；上限應與連線池 maxsize 一致，排隊移到這裡才看得到、卸載得掉
+    qdrant    ：向量過濾搜尋與純排序模式的 DTO 讀取
+
+    入口與 mysql 被拒絕時回傳 503 + Retry-After；inference / qdrant 被拒絕時改走純指標排序 (見 deadline.py 的降級)，
+    已經完成的 SQL 不會白做。
+
+設定：Config.ADMISSION_LIMITS，格式 "階段=並行上限/佇列上限/最長等待毫秒"，例如 "mysql=20/64/500"
+    佇列上限 0 代表滿了就直接拒絕；最長等待 0 代表不限等待時間 (只依佇列深度卸載)
+"""
+import asyncio
+import math
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Dict, Tuple
+
+from app.config import Config
+from app.utils.app_logger import logger
+from app.utils.metrics_registry import ADMISSION_DECISIONS
+from app.utils.tracing import annotate
+
+
+class AdmissionRejected(Exception):
+    """階段已滿載，請求被卸載。"""
+
+    def __init__(self, stage: str, reason: str, retry_after: int):
+        super().__init__(f"{stage} overloaded ({reason})")
+        self.stage = stage
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    def __init__(self, stage: str, concurrency: int, max_queue: int, max_wait_ms: float):
+        self.stage = stage
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait_ms / 1000 if max_wait_ms > 0 else None
+        self._sem = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self._stats = {"admitted": 0, "shed_queue_full": 0, "shed_wait_timeout": 0}
+
+    def _shed(self, reason: str) -> None:
+        self._stats[f"shed_{reason}"] += 1
+        ADMISSION_DECISIONS.labels(stage=self.stage, outcome=f"shed_{reason}").inc()
+        annotate(shed=f"{self.stage}:{reason}")
+        raise AdmissionRejected(self.stage, reason, Config.ADMISSION_RETRY_AFTER_S)
+
+    async def acquire(self) -> None:
+        if self._sem.locked():
+            if self.waiting >= self.max_queue:
+                self._shed("queue_full")
+            self.waiting += 1
+            try:
+                if self.max_wait is None:
+                    await self._sem.acquire()
+                else:
+                    await self._acquire_within(self.max_wait)
+            finally:
+                self.waiting -= 1
+        else:
+            await self._sem.acquire()
+        self.in_flight += 1
+        self._stats["admitted"] += 1
+        ADMISSION_DECISIONS.labels(stage=self.stage, outcome="admitted").inc()
+
+    async def _acquire_within(self, timeout: float) -> None:
+        """
+        最多等待 timeout 秒取得名額，逾時則卸載。
+
+        為什麼不用 asyncio.wait_for(self._sem.acquire(), timeout)：
+        逾時與取得名額發生在同一輪 Event Loop 時，wait_for 仍會拋出 TimeoutError，但名額已被扣掉；
+        請求被卸載、release() 永遠不會執行，這個階段就永久少了一個名額。
+        改為把 acquire 放進獨立 Task 並以 asyncio.wait 等待 (逾時不會取消它)，放棄時再交給 _abandon 處理。
+        """
+        acquire = asyncio.ensure_future(self._sem.acquire())
+        try:
+            await asyncio.wait((acquire,), timeout=timeout)
+        except BaseException:
+            # 等待本身被取消 (例如用戶端斷線)：同樣不能留下已取得的名額
+            self._abandon(acquire)
+            raise
+        if not acquire.done():
+            self._abandon(acquire)
+            self._shed("wait_timeout")
+
+    def _abandon(self, acquire: asyncio.Future) -> None:
+        # 取消前名額可能已經取得：不論 acquire 何時結束，只要最後取得了名額就立即歸還
+        acquire.cancel()
+        acquire.add_done_callback(lambda t: t.cancelled() or self._sem.release())
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._sem.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+        }
+
+
+def _parse_limits(raw: str) -> Dict[str, Tuple[int, int, float]]:
+    """解析 "stage=concurrency/queue/wait_ms,..."；格式錯誤的項目略過並記錄警告。"""
+    limits = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        stage, spec = (part.strip() for part in item.split("=", 1))
+        try:
+            concurrency, queue, wait_ms = spec.split("/")
+            limits[stage] = (max(int(concurrency), 1), max(int(queue), 0), float(wait_ms))
+        except ValueError:
+            logger.warning(f"[Admission] 無效的限制設定: {item.strip()}")
+    return limits
+
+
+class AdmissionController:
+    def __init__(self, enabled: bool, limits: Dict[str, Tuple[int, int, float]]):
+        self.enabled = enabled
+        self.limiters = {stage: StageLimiter(stage, *spec) for stage, spec in limits.items()}
+
+    @asynccontextmanager
+    async def limit(self, stage: str):
+        """
+        取得 stage 的執行名額；停用或未設定該階段時不設限。
+        :raises AdmissionRejected: 佇列已滿或等待超過上限
+        """
+        limiter = self.limiters.get(stage) if self.enabled else None
+        if limiter is None:
+            yield
+            return
+        await limiter.acquire()
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    async def run(self, stage: str, aw: Awaitable[Any]) -> Any:
+        """在 stage 的名額內等待 aw；被拒絕時關閉尚未開始的 coroutine，避免 "never awaited" 警告。"""
+        try:
+            async with self.limit(stage):
+                return await aw
+        except AdmissionRejected:
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            raise
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {stage: limiter.stats() for stage, limiter in self.limiters.items()}
+
+
+def retry_after_header(exc: AdmissionRejected) -> Dict[str, str]:
+    return {"Retry-After": str(max(int(math.ceil(exc.retry_after)), 1))}
+
+
+# 單例：每個 Worker 一份 (限制的是本 Worker 的並行量)
+admission = AdmissionController(Config.ADMISSION_ENABLED, _parse_limits(Config.ADMISSION_LIMITS))
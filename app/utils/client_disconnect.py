@@ -0,0 +1,138 @@
+# app/utils/client_disconnect.py
+"""
+用戶端斷線偵測 (Client Disconnect Cancellation)
+
+為什麼需要：
+    LLM 調度端逾時後會直接斷開連線，但 generate_query_and_search 仍會把 SQL、COUNT、Embedding、Qdrant、
+    排序與 Redis 寫入全部跑完；這些結果沒有人會讀，卻持續佔用連線池、推論名額與 MySQL 執行資源。
+
+偵測方式：
+    在背景 Task 中等待 ASGI receive()；請求本文已讀完，下一個訊息只會是 http.disconnect。
+    為什麼不輪詢 Request.is_disconnected()：經過 @app.middleware("http") (BaseHTTPMiddleware) 包裝後，
+    is_disconnected() 以「已取消的 CancelScope」讀取訊息，中介層內部的 Task Group 會連同訊息一起丟棄，永遠回傳 False。
+
+    • checkpoint(stage)：階段之間檢查斷線旗標 (不需等待)
+    • watch(aw)      ：把檢索主流程包成 Task，與斷線事件競速；斷線時取消 Task，
+                        進行中的 aiomysql 查詢會關閉連線並送出 KILL QUERY (見 rdbms_repository.py)，
+                        Qdrant 的 HTTP 請求隨 Task 取消而中止
+
+Single-Flight 的共用計算不套用斷線檢查 (detach_from_client)：發起者斷線不代表其他等待者不需要結果；
+共用計算只有在「所有」等待者都離開時才由 SingleFlight 取消。
+"""
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Awaitable, Optional
+
+from app.config import Config
+from app.utils.metrics_registry import CLIENT_DISCONNECTS
+from app.utils.tracing import annotate
+
+_current_guard: ContextVar[Optional["DisconnectGuard"]] = ContextVar("current_disconnect_guard", default=None)
+
+# nginx 慣例：用戶端在回應前關閉連線。只會出現在存取日誌與指標中，用戶端收不到
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnected(Exception):
+    """用戶端已斷線，後續工作已中止。"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"client disconnected before {stage}")
+        self.stage = stage
+
+
+class DisconnectGuard:
+    __slots__ = ("request", "disconnected", "_event", "_listener")
+
+    def __init__(self, request):
+        self.request = request
+        self.disconnected = False
+        self._event = asyncio.Event()
+        self._listener: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._listener = asyncio.ensure_future(self._listen())
+
+    def stop(self) -> None:
+        if self._listener is not None and not self._listener.done():
+            self._listener.cancel()
+
+    async def _listen(self) -> None:
+        try:
+            while True:
+                message = await self.request.receive()
+                if message.get("type") == "http.disconnect":
+                    self.disconnected = True
+                    self._event.set()
+                    return
+        except Exception:
+            # 讀取失敗時視為無法偵測，不影響請求本身
+            return
+
+    def _abort(self, stage: str) -> None:
+        CLIENT_DISCONNECTS.labels(stage=stage).inc()
+        annotate(client_disconnected=stage)
+        raise ClientDisconnected(stage)
+
+    def checkpoint(self, stage: str) -> None:
+        if self.disconnected:
+            self._abort(stage)
+
+    async def watch(self, aw: Awaitable[Any], stage: str) -> Any:
+        """等待 aw 完成；期間用戶端斷線則取消 aw 並拋出 ClientDisconnected。"""
+        self.checkpoint(stage)
+        task = asyncio.ensure_future(aw)
+        waiter = asyncio.ensure_future(self._event.wait())
+        try:
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if task.done():
+                return task.result()
+            task.cancel()
+            # 等待取消完成 (連線關閉、KILL QUERY 排程)，再回收例外避免 "never retrieved" 警告
+            await asyncio.wait({task})
+            if not task.cancelled():
+                task.exception()
+            self._abort(stage)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            waiter.cancel()
+
+
+class disconnect_guard:
+    """在 with 區塊內啟用斷線偵測；Config.DISCONNECT_CHECK_ENABLED 為 false 時不建立 Guard。"""
+
+    __slots__ = ("guard", "_token")
+
+    def __init__(self, request):
+        self.guard = DisconnectGuard(request) if Config.DISCONNECT_CHECK_ENABLED else None
+        self._token = None
+
+    def __enter__(self) -> Optional[DisconnectGuard]:
+        if self.guard is not None:
+            self.guard.start()
+        self._token = _current_guard.set(self.guard)
+        return self.guard
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_guard.reset(self._token)
+        if self.guard is not None:
+            self.guard.stop()
+        return False
+
+
+async def checkpoint(stage: str) -> None:
+    """
+    階段之間的斷線檢查；沒有 Guard 時不做任何事。
+    :raises ClientDisconnected: 用戶端已斷線
+    """
+    guard = _current_guard.get()
+    if guard is not None:
+        guard.checkpoint(stage)
+
+
+async def detach_from_client(aw: Awaitable[Any]) -> Any:
+    """在獨立 Task (例如 Single-Flight 的共用計算) 內執行 aw，且不套用發起者的斷線檢查。"""
+    _current_guard.set(None)
+    return await aw
@@ -2,6 +2,7 @@
 import json
 from app.config import Config 
 from typing import Optional
+from app.utils.tracing import traced
 
 
 def format_facility_tags(results):
@@ -75,6 +76,7 @@ def parse_json_fields(results, fields_to_parse=None):
     return results
 
 # 依照plan裡面去處理距離顯示與補上照片與格式化設施標籤 (只有 SQL 有選該欄位時才執行)
+@traced("formatter.format_response_data")
 def format_response_data(results, plan):
     """
     根據 HybridSQLBuilder 產出的 plan，動態決定要執行的後處理步驟。
@@ -44,6 +44,42 @@ async def get_async_db_pool():
     return _db_pool
 
 
+# 背景 KILL QUERY 任務；保留參照，避免任務在完成前被垃圾回收
+_kill_tasks = set()
+
+
+async def kill_query(thread_id: int) -> None:
+    """
+    在獨立的短連線上對 thread_id 執行 KILL QUERY。
+    為什麼不用連線池：需要中止查詢時，連線池往往正被這些查詢佔滿；而且 KILL 必須由「另一條」連線送出。
+    """
+    try:
+        conn = await aiomysql.connect(
+            host=Config.DB_HOST,
+            port=Config.DB_PORT,
+            user=Config.DB_USER,
+            password=Config.DB_PASSWORD,
+            db=Config.DB_NAME,
+            connect_timeout=Config.MYSQL_KILL_CONNECT_TIMEOUT,
+        )
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("KILL QUERY %s", (thread_id,))
+        finally:
+            conn.close()
+        logging.info(f"[DB Utils] 已中止 MySQL 查詢 (thread_id={thread_id})")
+    except Exception as e:
+        # 查詢可能已經自行結束 (Unknown thread id)；中止失敗不影響任何請求
+        logging.warning(f"[DB Utils] KILL QUERY {thread_id} 失敗: {e}")
+
+
+def schedule_kill_query(thread_id: int) -> None:
+    """於背景送出 KILL QUERY；由被取消的查詢呼叫，不能等待 (呼叫端正在處理 CancelledError)。"""
+    task = asyncio.get_running_loop().create_task(kill_query(thread_id))
+    _kill_tasks.add(task)
+    task.add_done_callback(_kill_tasks.discard)
+
+
 async def get_qdrant_client():
     """獲取 Qdrant 非同步客戶端單例"""
     global _qdrant_client
@@ -65,6 +101,21 @@ async def get_qdrant_client():
     return _qdrant_client
 
 
+def get_db_pool_stats():
+    """
+    回傳 MySQL 連線池目前狀態 (供 /metrics 使用)；尚未初始化時回傳 None。
+    size：已建立的連線數 / free：閒置可用數 / in_use：使用中 / max：上限
+    """
+    if _db_pool is None:
+        return None
+    return {
+        "size": _db_pool.size,
+        "free": _db_pool.freesize,
+        "in_use": _db_pool.size - _db_pool.freesize,
+        "max": _db_pool.maxsize,
+    }
+
+
 async def close_all_connections():
     """在 shutdown 時呼叫，一次關閉 MySQL 與 Qdrant"""
     global _db_pool, _qdrant_client
@@ -0,0 +1,139 @@
+# app/utils/deadline.py
+"""
+請求截止時間與降級 (Request Deadline & Graceful Degradation)
+
+為什麼需要：
+    /place_search 沒有整體時間預算，Qdrant 或 MySQL 一變慢，請求就跟著被拖住，p99 沒有上限。
+    呼叫端 (LLM Agent) 本身也有逾時，超過後的結果根本不會被使用。
+    這裡為每個請求設定截止時間，各階段以「剩餘預算」作為 timeout，預算不足時依序降級：
+
+        count_skipped    ：略過 COUNT 查詢，total_count 以實際取回的筆數代替 (下限值)
+        candidates_capped：只把前 Config.DEADLINE_CANDIDATE_CAP 筆候選送往向量階段
+        vector_skipped   ：剩餘預算不足以跑 Embedding + Qdrant，直接走純指標排序
+        vector_timeout   ：Qdrant 超過剩餘預算，放棄語意分數，改走純指標排序
+
+    主 SQL 是唯一無法降級的階段；它超過預算時拋出 DeadlineExceeded，由 Route 回傳 504。
+
+設計 (與 tracing.py / request_profile.py 相同思路)：
+    • 以 ContextVar 保存目前請求的 Deadline，Repository / Service 不需要多一個參數
+    • 沒有設定截止時間的請求仍有一個不設限的 Deadline (記錄其他原因的降級，例如 admission.py 的卸載)，
+      所有等待與預算判斷都等同原本的行為
+"""
+import asyncio
+import math
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, List, Optional
+
+from app.utils.metrics_registry import SEARCH_DEGRADATIONS
+from app.utils.tracing import annotate
+
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("current_request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """某個不可降級的階段超過了請求截止時間。"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    __slots__ = ("budget_ms", "expires_at", "degradations")
+
+    def __init__(self, budget_ms: Optional[float]):
+        self.budget_ms = budget_ms
+        self.expires_at = time.perf_counter() + budget_ms / 1000 if budget_ms else math.inf
+        self.degradations: List[str] = []
+
+    @property
+    def bounded(self) -> bool:
+        return self.expires_at != math.inf
+
+    def remaining_ms(self) -> float:
+        return (self.expires_at - time.perf_counter()) * 1000
+
+    def degrade(self, step: str) -> None:
+        if step not in self.degradations:
+            self.degradations.append(step)
+            SEARCH_DEGRADATIONS.labels(step=step).inc()
+            annotate(degraded=",".join(self.degradations))
+
+
+class deadline_scope:
+    """
+    在 with 區塊內套用截止時間；budget_ms 為 None 或 <= 0 時不設限 (仍會記錄降級步驟)。
+    區塊內建立的 asyncio Task (例如 Single-Flight 的計算) 會繼承同一個 Deadline；
+    因此共用計算的降級只屬於發起者，加入者會重新執行 (見 SearchPipelineService.run)。
+    """
+
+    __slots__ = ("deadline", "_token")
+
+    def __init__(self, budget_ms: Optional[float]):
+        self.deadline = Deadline(budget_ms if budget_ms and budget_ms > 0 else None)
+        self._token = None
+
+    def __enter__(self) -> Deadline:
+        self._token = _current_deadline.set(self.deadline)
+        return self.deadline
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_deadline.reset(self._token)
+        return False
+
+
+def split_deadline() -> deadline_scope:
+    """
+    建立與目前請求「同一個截止時間」、但降級紀錄各自獨立的範圍。
+    為什麼需要：批次搜尋 (POST /place_search/batch) 的多個意圖共用一個時間預算，
+    但某個意圖略過 COUNT 不代表其他意圖也被降級。
+    """
+    parent = _current_deadline.get()
+    scope = deadline_scope(None)
+    if parent is not None:
+        scope.deadline.budget_ms = parent.budget_ms
+        scope.deadline.expires_at = parent.expires_at
+    return scope
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def budget_allows(min_remaining_ms: float) -> bool:
+    """剩餘預算是否還有 min_remaining_ms；沒有截止時間時永遠為 True。"""
+    deadline = _current_deadline.get()
+    return deadline is None or deadline.remaining_ms() >= min_remaining_ms
+
+
+def mark_degraded(step: str) -> None:
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.degrade(step)
+
+
+def degradations() -> List[str]:
+    deadline = _current_deadline.get()
+    return list(deadline.degradations) if deadline is not None else []
+
+
+async def within_deadline(aw: Awaitable[Any], stage: str, reserve_ms: float = 0.0) -> Any:
+    """
+    以「剩餘預算 - reserve_ms」作為 timeout 等待 aw；沒有截止時間時直接等待。
+    reserve_ms 為後續階段保留的時間，例如 COUNT 查詢要留時間給向量階段。
+    :raises DeadlineExceeded: 預算已用完或等待逾時
+    """
+    deadline = _current_deadline.get()
+    if deadline is None or not deadline.bounded:
+        return await aw
+
+    timeout = (deadline.remaining_ms() - reserve_ms) / 1000
+    if timeout <= 0:
+        if asyncio.iscoroutine(aw):
+            aw.close()
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(aw, timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(stage) from None
@@ -1,6 +1,11 @@
 # app/utils/distance_utils.py
 import logging
 
+import numpy as np
+
+R_EARTH_METERS = 6371000 # 地球的半徑(單位:公尺)
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
 def get_haversine_distance_sql(user_lat,user_lng, lat_col="p.lat", lng_col="p.lng"):
     # 生成distance的函式
     # param user_lat: 使用者的緯度(Latitude)
@@ -8,7 +13,7 @@ def get_haversine_distance_sql(user_lat,user_lng, lat_col="p.lat", lng_col="p.ln
     # param lat_col:店家的緯度
     # param lng_col:店家的經度
     # return: SQL字串 (單位:公里)
-    R_METERS = 6371000 # 地球的半徑(單位:公尺)
+    R_METERS = R_EARTH_METERS
     try:
         # 嘗試轉成浮點數
         lat = float(user_lat)
@@ -32,4 +37,46 @@ def get_haversine_distance_sql(user_lat,user_lng, lat_col="p.lat", lng_col="p.ln
         ))
     )
     """
-    return sql.strip()
\ No newline at end of file
+    return sql.strip()
+
+
+def haversine_distances(user_lat, user_lng, lats, lngs):
+    # 以 NumPy 一次算出使用者到多家店的距離 (單位:公尺)
+    # 為什麼需要：位置感知候選快取命中時不再跑 SQL，距離改在記憶體內重算；結果與上面的 SQL 公式相同 (差異在公分以下)
+    # param lats / lngs: 店家經緯度的序列 (長度相同)
+    # return: np.ndarray (float64)
+    lat1 = np.radians(float(user_lat))
+    lng1 = np.radians(float(user_lng))
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lng2 = np.radians(np.asarray(lngs, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * R_EARTH_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def geohash_encode(lat, lng, precision=6):
+    # 將座標編碼為 Geohash 字串，作為位置感知快取的網格 key
+    # 精度 6 約 1.2 km x 0.6 km；前綴相同代表落在同一個較大的網格
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    lat = float(lat)
+    lng = float(lng)
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True # Geohash 從經度開始，經緯度位元交錯
+    while len(chars) < precision:
+        rng, val = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
@@ -0,0 +1,170 @@
+# app/utils/intent_result_cache.py
+"""
+搜尋意圖結果快取 (Whole-Pipeline Memoization)
+
+為什麼需要：
+    大量使用者會送出「相同」的搜尋意圖 (同樣的 logic_tree、sort_conditions、info_needed，
+    位置也只差幾十公尺)。每一次都重新跑 SQL → COUNT → Embedding → Qdrant → 排序 → 格式化，
+    但結果其實相同。以 analyze_intent 產出的 plan 計算「標準化指紋」，命中時直接進入建立 Session 的步驟。
+
+快取層級：
+    • L1：Worker 內記憶體 (ByteLRUCache，以 bytes 計量)
+    • L2：Redis (選用，Config.INTENT_CACHE_REDIS_ENABLED)，讓多個 Worker 共享計算成果
+
+位置感知候選快取 (GeoCandidateCache)：
+    使用者只移動了幾十公尺、或每次都注入崑山科大預設座標時，跨出上述網格的請求仍要整條重跑。
+    候選快取改存「排序前」的 SQL 候選 (含店家經緯度) 與 Qdrant 相似度，key 為不含位置的指紋 + Geohash 網格；
+    命中時只在記憶體內重算距離並重新排序 (見 SearchPipelineService._rank_geo_candidates)。
+
+注意：
+    指紋中的 user_location 會依 Config.INTENT_CACHE_GRID_DECIMALS 四捨五入到網格，
+    因此命中時回傳的距離是以「同一網格內第一位使用者」的位置計算 (預設 3 位小數 ≈ 110 公尺)。
+"""
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from app.config import Config
+from app.utils.app_logger import logger
+from app.utils.distance_utils import geohash_encode
+from app.utils.local_session_cache import ByteLRUCache
+from app.utils.session_codec import get_session_codec
+
+
+def _round_location(location: Optional[Dict[str, Any]], decimals: int) -> Optional[Dict[str, float]]:
+    if not location:
+        return None
+    try:
+        return {
+            "lat": round(float(location["lat"]), decimals),
+            "lng": round(float(location["lng"]), decimals),
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def compute_intent_fingerprint(plan: Dict[str, Any], include_location: bool = True) -> str:
+    """
+    由 analyze_intent 的 plan 計算標準化指紋。
+
+    只納入「會影響搜尋結果」的欄位，並排除 s_id 等每個請求都不同的識別資料。
+    必須在 build_sql 之前呼叫：build_sql 會把距離欄位附加到 select_fields，改變指紋內容。
+
+    :param include_location: False 時不納入位置 (供位置感知的候選集合快取使用)
+    """
+    canonical = {
+        "logic_tree": plan.get("raw_logic_tree", {}),
+        "sort_conditions": plan.get("sort_conditions", []),
+        # select_fields 順序不影響結果內容，排序後再比對
+        "select_fields": sorted(plan.get("select_fields", [])),
+        "photos_needed": plan.get("photos_needed", False),
+        "distance_needed": plan.get("distance_needed", False),
+        "page": plan.get("page", 1),
+        "page_size": plan.get("page_size", 3),
+    }
+    if include_location:
+        canonical["location_source"] = plan.get("location_source")
+        canonical["user_location"] = _round_location(plan.get("user_location"), Config.INTENT_CACHE_GRID_DECIMALS)
+
+    # sort_keys + 緊湊分隔符號：同樣的內容不論 dict 插入順序都會得到同樣的字串
+    raw = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class IntentResultCache:
+    """
+    以意圖指紋為 key 的搜尋結果快取。
+
+    快取內容為一次完整搜尋的產出：排序後的店家 (含 id 與各項分數)、SQL 總筆數、
+    vector_search_info 與 rdb_info；品質分析 (analyze_search_results) 仍以當次請求的 plan 重新計算，
+    確保位置診斷等請求相關欄位正確。
+
+    :param redis_client: 選用的 redis.asyncio 客戶端 (需為 decode_responses=False)
+    :param ttl / max_bytes: 未指定時使用 INTENT_CACHE_* 設定 (供 GeoCandidateCache 覆寫)
+    """
+
+    KEY_PREFIX = "intent_result"
+    LOG_TAG = "IntentCache"
+
+    def __init__(self, redis_client=None, ttl: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.ttl = Config.INTENT_CACHE_TTL if ttl is None else ttl
+        self._l1 = ByteLRUCache(
+            max_bytes=Config.INTENT_CACHE_MAX_BYTES if max_bytes is None else max_bytes, ttl=self.ttl
+        )
+        self._redis = redis_client if Config.INTENT_CACHE_REDIS_ENABLED else None
+        self._codec = get_session_codec()
+        self._stats = {"l1_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0, "redis_errors": 0}
+
+    def _build_key(self, fingerprint: str) -> str:
+        return f"{self.KEY_PREFIX}:{fingerprint}"
+
+    async def get(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        outcome = self._l1.get(fingerprint)
+        if outcome is not None:
+            self._stats["l1_hits"] += 1
+            return outcome
+
+        if self._redis is not None:
+            try:
+                raw = await self._redis.get(self._build_key(fingerprint))
+            except Exception as e:
+                # Redis 只是加速層，失敗時視為未命中，不影響搜尋本身
+                self._stats["redis_errors"] += 1
+                logger.warning(f"[{self.LOG_TAG}] 讀取 Redis 失敗，視為未命中: {e}")
+                raw = None
+            if raw is not None:
+                outcome = self._codec.decode(raw)
+                self._l1.put(fingerprint, outcome)
+                self._stats["redis_hits"] += 1
+                return outcome
+
+        self._stats["misses"] += 1
+        return None
+
+    async def put(self, fingerprint: str, outcome: Dict[str, Any]) -> None:
+        self._l1.put(fingerprint, outcome)
+        self._stats["stores"] += 1
+
+        if self._redis is not None:
+            try:
+                await self._redis.set(self._build_key(fingerprint), self._codec.encode(outcome), ex=self.ttl)
+            except Exception as e:
+                self._stats["redis_errors"] += 1
+                logger.warning(f"[{self.LOG_TAG}] 寫入 Redis 失敗 (僅保留 L1): {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["l1_hits"] + self._stats["redis_hits"] + self._stats["misses"]
+        hits = self._stats["l1_hits"] + self._stats["redis_hits"]
+        return {
+            **self._stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "l1": self._l1.stats(),
+            "redis_enabled": self._redis is not None,
+        }
+
+
+def compute_geo_key(plan: Dict[str, Any], precision: int) -> Optional[str]:
+    """
+    位置感知候選快取的 key：不含位置的意圖指紋 + user_location 所在的 Geohash 網格。
+    :return: 無有效座標時為 None
+    """
+    location = plan.get("user_location") or {}
+    try:
+        cell = geohash_encode(location["lat"], location["lng"], precision)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return f"{compute_intent_fingerprint(plan, include_location=False)}:{cell}"
+
+
+class GeoCandidateCache(IntentResultCache):
+    """
+    以 compute_geo_key 為 key 的候選集合快取；快取內容為排序前的 db_results (含 lat / lng)、
+    Qdrant 相似度 (id / score / review_summary) 與當次的語意門檻，以及 total_count / rdb_info / vector_search_info。
+    L1 / Redis 兩層的行為與 IntentResultCache 相同，僅 TTL 與容量各自設定。
+    """
+
+    KEY_PREFIX = "geo_candidates"
+    LOG_TAG = "GeoCache"
+
+    def __init__(self, redis_client=None):
+        super().__init__(redis_client, ttl=Config.GEO_CACHE_TTL, max_bytes=Config.GEO_CACHE_MAX_BYTES)
@@ -0,0 +1,47 @@
+# app/utils/json_response.py
+"""
+搜尋端點的 JSON 回應 (FastJSONResponse)
+
+為什麼需要：
+    Route 直接回傳 dict 時，FastAPI 會先以 jsonable_encoder 逐一走訪整包結果 (每筆店家含巢狀 score_analysis、
+    10 張照片 URL、營業時間)，複製成「可序列化」的新 dict，再交給標準庫 json.dumps；兩次完整走訪都是純 Python。
+    改為直接回傳 FastJSONResponse：跳過 jsonable_encoder，由 orjson (C 實作) 一次完成序列化。
+
+    • Decimal (MySQL DECIMAL 欄位) 與 NumPy 純量 (排序分數) 沿用 session_codec.default_serializer 的轉換規則
+    • orjson 為選用依賴：未安裝時退回標準庫 json (ensure_ascii=False，輸出與原本相同)
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from app.utils.session_codec import default_serializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class _DefaultEncoder(json.JSONEncoder):
+    def default(self, obj):
+        try:
+            return default_serializer(obj)
+        except TypeError:
+            return super().default(obj)
+
+
+def dumps(content: Any) -> bytes:
+    """序列化為 UTF-8 JSON bytes (串流端點的事件也使用同一個編碼器)。"""
+    if orjson is not None:
+        return orjson.dumps(content, default=default_serializer, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), cls=_DefaultEncoder
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
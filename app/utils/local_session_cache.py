@@ -0,0 +1,139 @@
+# app/utils/local_session_cache.py
+"""
+Worker 內的 L1 Session 快取 (位於 Redis 之前)
+
+為什麼需要 L1：
+    使用者翻頁時，同一個 search_ssid 會在數秒內連續呼叫 GET /place_search/page 數次，
+    每次都要 Redis 往返並完整解碼整包結果。Session 建立後內容不會改變 (寫入一次、讀取多次)，
+    因此非常適合在 Worker 記憶體中保留「已解碼」的結果。
+    例外是重新排序 (POST /place_search/{search_ssid}/resort) 會覆寫同一個 Session，
+    此時由 SearchSessionCache 以 Redis Pub/Sub 通知所有 Worker 讓該筆 L1 失效。
+
+設計重點：
+    • 以 bytes 而非筆數計算容量：150 筆含照片的 Session 與 3 筆的 Session 記憶體相差兩個數量級，
+      用筆數設上限無法真正保護 Worker 記憶體。
+    • TTL 不會超過 Config.SEARCH_SESSION_TTL：L1 絕不比 Redis 活得更久，過期語意與 Redis 一致。
+    • LRU 淘汰：超過容量時先淘汰最久未被讀取的 Session。
+"""
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import Config
+
+
+def estimate_size(obj: Any) -> int:
+    """
+    估算已解碼物件的記憶體占用 (bytes)。
+    以 sys.getsizeof 遞迴加總容器與元素；同一物件只計算一次，避免共用字串被重複計入。
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        current = stack.pop()
+        obj_id = id(current)
+        if obj_id in seen:
+            continue
+        seen.add(obj_id)
+        total += sys.getsizeof(current)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set)):
+            stack.extend(current)
+    return total
+
+
+class ByteLRUCache:
+    """
+    以 bytes 計量的 LRU + TTL 快取，存放已解碼的物件。
+
+    :param max_bytes: 快取總容量上限 (bytes)
+    :param ttl:       單筆資料的最長存活秒數
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (到期時間, 估算大小, 值)
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "expirations": 0, "evictions": 0, "rejected": 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return value
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        放入一筆資料。
+        :param ttl: 此筆的剩餘秒數 (例如 Redis PTTL)；實際採用 min(ttl, self.ttl)
+        """
+        effective_ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if effective_ttl <= 0:
+            return
+
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            # 單筆就超過總容量：放入只會把其他資料全部擠掉，直接拒收
+            self._stats["rejected"] += 1
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        while self._entries and self._bytes + size > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self._stats["evictions"] += 1
+
+        self._entries[key] = (time.monotonic() + effective_ttl, size, value)
+        self._bytes += size
+
+    def invalidate(self, key: str) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+        }
+
+
+class LocalSessionCache(ByteLRUCache):
+    """
+    存放已解碼 Session 結果的 L1 快取。
+    TTL 一律截斷至 Config.SEARCH_SESSION_TTL，確保 L1 不會比 Redis 中的 Session 活得更久。
+    """
+
+    def __init__(self, max_bytes: int, ttl: int):
+        super().__init__(max_bytes=max_bytes, ttl=min(ttl, Config.SEARCH_SESSION_TTL))
@@ -0,0 +1,167 @@
+# app/utils/log_policy.py
+"""
+熱路徑日誌策略 (Level-gated, Sampled Hot-path Logging)
+
+為什麼需要：
+    每個搜尋請求都會在 INFO 層級輸出完整 SQL 與綁定參數、records[0]、邏輯樹每個節點、
+    每一筆排序結果的 [DEBUG] 行，以及整包 ai_to_api_data；而且全部是「先組好字串」的 f-string。
+    高 QPS 下光是字串格式化與日誌 I/O 就吃掉可觀的 CPU，真正需要這些細節的卻只有少數慢請求。
+
+策略：
+    1. 逐模組層級：各模組使用 get_logger("<name>") 取得子 Logger (FastAPIApp.<name>)，
+       層級由 Config.LOG_MODULE_LEVELS 個別設定 (例如 FastAPIApp.rdbms=WARNING)。
+    2. 延遲格式化：log_detail 一律使用 %-style 參數；較貴的描述 (例如參數型別清單) 以 lazy(...) 包裝，
+       只有真的要輸出時才會計算。
+    3. 依訊息類別取樣：Config.LOG_SAMPLE_RATES 設定每類細節的輸出比例，例如 sql_body=0.01 代表 1% 的 SQL 本文。
+    4. 慢請求升級 (Slow-request Escalation)：未被取樣的細節不格式化、只暫存參數；
+       請求結束時若超過 Config.LOG_SLOW_REQUEST_MS，才把該請求的所有細節補印出來，其餘直接丟棄。
+
+    模組層級開到 DEBUG 時視為開發模式：細節日誌不取樣、全部直接輸出。
+"""
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import Config
+
+BASE_LOGGER_NAME = "FastAPIApp"
+
+
+def get_logger(name: str) -> logging.Logger:
+    """取得模組專屬的子 Logger；仍會 propagate 至 Root 的 QueueHandler，輸出路徑不變。"""
+    return logging.getLogger(f"{BASE_LOGGER_NAME}.{name}")
+
+
+def _parse_mapping(raw: str) -> Dict[str, str]:
+    """解析 "a=1,b=2" 格式的設定字串；格式錯誤的項目直接略過。"""
+    mapping = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        key, value = item.split("=", 1)
+        if key.strip():
+            mapping[key.strip()] = value.strip()
+    return mapping
+
+
+def _parse_sample_rates(raw: str) -> Dict[str, float]:
+    rates = {}
+    for key, value in _parse_mapping(raw).items():
+        try:
+            rates[key] = min(max(float(value), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+
+_SAMPLE_RATES = _parse_sample_rates(Config.LOG_SAMPLE_RATES)
+
+
+def configure_log_levels() -> None:
+    """
+    套用 Config.LOG_LEVEL (Root) 與 Config.LOG_MODULE_LEVELS (逐模組)。
+    必須在 app_log_manager.setup_logging() 之後呼叫，否則會被其預設的 INFO 覆蓋。
+    """
+    logging.getLogger().setLevel(Config.LOG_LEVEL)
+    for name, level in _parse_mapping(Config.LOG_MODULE_LEVELS).items():
+        try:
+            logging.getLogger(name).setLevel(level.upper())
+        except ValueError:
+            logging.warning(f"[LogPolicy] 無效的日誌層級設定: {name}={level}")
+
+
+class lazy:
+    """
+    延遲計算的日誌參數：只有在日誌真正被格式化時才呼叫 fn。
+    用法：log_detail(logger, "sql_params", "綁定參數: %s", lazy(describe_params, params))
+    """
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn: Callable[..., Any], *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.fn(*self.args))
+
+    __repr__ = __str__
+
+
+class _RequestLogBuffer:
+    """單一請求被取樣略過的細節日誌 (只存參數，不格式化)。"""
+
+    __slots__ = ("records", "overflow")
+
+    def __init__(self):
+        self.records: List[Tuple[logging.Logger, int, str, tuple, float]] = []
+        self.overflow = 0
+
+
+_request_buffer: ContextVar[Optional[_RequestLogBuffer]] = ContextVar("request_log_buffer", default=None)
+
+
+def log_detail(log: logging.Logger, message_class: str, msg: str, *args, level: int = logging.INFO) -> None:
+    """
+    輸出熱路徑上的細節日誌。
+    :param message_class: 訊息類別 (對應 Config.LOG_SAMPLE_RATES 的 key，例如 sql_body / rank_row)
+    :param msg:           %-style 格式字串；不要傳入 f-string，否則延遲格式化就失去意義
+    """
+    if log.isEnabledFor(logging.DEBUG):
+        log.log(level, msg, *args)
+        return
+
+    rate = _SAMPLE_RATES.get(message_class, Config.LOG_SAMPLE_DEFAULT)
+    if rate > 0.0 and random.random() < rate and log.isEnabledFor(level):
+        log.log(level, msg, *args)
+        return
+
+    buffer = _request_buffer.get()
+    if buffer is None:
+        return
+    if len(buffer.records) >= Config.LOG_ESCALATION_MAX_RECORDS:
+        buffer.overflow += 1
+        return
+    buffer.records.append((log, level, msg, args, time.time()))
+
+
+class request_log_scope:
+    """
+    請求層級的日誌範圍 (由 HTTP Middleware 包住整個請求)。
+    結束時若耗時超過 Config.LOG_SLOW_REQUEST_MS，補印該請求暫存的細節日誌；否則直接丟棄。
+    """
+
+    __slots__ = ("label", "_buffer", "_token", "_start")
+
+    def __init__(self, label: str):
+        self.label = label
+        self._buffer = _RequestLogBuffer()
+        self._token = None
+        self._start = 0.0
+
+    def __enter__(self) -> "request_log_scope":
+        self._token = _request_buffer.set(self._buffer)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _request_buffer.reset(self._token)
+        elapsed_ms = (time.perf_counter() - self._start) * 1000
+        if elapsed_ms >= Config.LOG_SLOW_REQUEST_MS:
+            _escalate(self.label, elapsed_ms, self._buffer)
+        return False
+
+
+def _escalate(label: str, elapsed_ms: float, buffer: _RequestLogBuffer) -> None:
+    get_logger("slow_request").warning(
+        "[SlowRequest] %s 耗時 %.0f ms (門檻 %.0f ms)，補印 %d 筆細節日誌 (超出上限未保留 %d 筆)",
+        label, elapsed_ms, Config.LOG_SLOW_REQUEST_MS, len(buffer.records), buffer.overflow,
+    )
+    # 為什麼用 handle 而非 log.log：模組層級可能設為 WARNING，升級的細節必須繞過層級門檻才看得到
+    for log, level, msg, args, created in buffer.records:
+        record = log.makeRecord(log.name, level, "(escalated)", 0, "[escalated] " + msg, args, None)
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        log.handle(record)
@@ -0,0 +1,218 @@
+# app/utils/metrics_registry.py
+"""
+Prometheus 指標登錄中心 (In-Process Metrics Registry)
+
+為什麼需要：
+    generate_query_and_search 計算的各階段耗時 (sql_service / transition / qdrant / ranking / total)
+    原本只寫進 CSV，無法對 p99 告警，也無法跨 Worker 彙總。
+    這裡以 Histogram / Counter / Gauge 描述同一份資料，並由 GET /metrics 以 Prometheus 文字格式輸出。
+
+多 Worker (multiprocess) 支援：
+    設定環境變數 PROMETHEUS_MULTIPROC_DIR (指向一個每次部署前清空的資料夾) 後，
+    prometheus_client 會把各 Worker 的指標寫入該資料夾的 mmap 檔，/metrics 抓取時再彙總所有 Worker。
+    Gauge 一律使用 livesum 模式：只加總仍存活的 Worker，避免已結束的 Worker 殘留數值。
+    快取 / 連線池 Gauge 只有「處理該次抓取的 Worker」會在 /metrics 內更新，其他 Worker 的數值會停在上一次被抓取時；
+    因此多 Worker 時每個 Worker 另以背景任務 (run_gauge_refresher) 定期更新自己的 Gauge，加總結果才會反映現況。
+"""
+import asyncio
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from app.utils.app_logger import logger
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        CollectorRegistry,
+        Counter,
+        Gauge,
+        Histogram,
+        generate_latest,
+        multiprocess,
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _NoopMetric:
+    """未安裝 prometheus_client 時的替身：所有操作皆為 no-op，呼叫端不需額外判斷。"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def dec(self, *args, **kwargs):
+        pass
+
+    def set(self, *args, **kwargs):
+        pass
+
+
+# 延遲分桶：涵蓋 5ms (快取命中) 到 10s (冷啟動 / 逾時) 的範圍
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0)
+
+if PROMETHEUS_AVAILABLE:
+    STAGE_LATENCY = Histogram(
+        "place_search_stage_seconds",
+        "Latency of each /place_search pipeline stage",
+        ["stage"],
+        buckets=_LATENCY_BUCKETS,
+    )
+    SEARCH_RESULTS = Counter(
+        "place_search_results_total",
+        "Completed /place_search requests by quality label and search status",
+        ["quality_label", "search_status"],
+    )
+    PIPELINE_SOURCE = Counter(
+        "place_search_pipeline_source_total",
+        "Where the ranked results came from (executed / intent_cache / geo_cache / coalesced)",
+        ["source"],
+    )
+    PAGE_REQUESTS = Counter(
+        "place_search_page_requests_total",
+        "GET /place_search/page requests by outcome",
+        ["status"],
+    )
+    SESSION_OPERATIONS = Counter(
+        "place_search_session_operations_total",
+        "In-memory operations on an existing search session (resort / refine) by outcome",
+        ["operation", "status"],
+    )
+    SEARCH_DEGRADATIONS = Counter(
+        "place_search_degradations_total",
+        "Degradation steps taken to stay within the request deadline",
+        ["step"],
+    )
+    ADMISSION_DECISIONS = Counter(
+        "admission_decisions_total",
+        "Admission control decisions per stage (admitted / shed_queue_full / shed_wait_timeout)",
+        ["stage", "outcome"],
+    )
+    CLIENT_DISCONNECTS = Counter(
+        "place_search_client_disconnects_total",
+        "Requests abandoned by the client, by the stage at which work was cancelled",
+        ["stage"],
+    )
+    DB_POOL = Gauge(
+        "mysql_pool_connections",
+        "aiomysql pool connections by state",
+        ["state"],
+        multiprocess_mode="livesum",
+    )
+    EMBEDDING_INFLIGHT = Gauge(
+        "embedding_inflight_requests",
+        "Embedding encode calls currently queued or running",
+        multiprocess_mode="livesum",
+    )
+    CACHE_STATS = Gauge(
+        "search_cache_stat",
+        "Runtime statistics of in-process caches and background writers",
+        ["component", "stat"],
+        multiprocess_mode="livesum",
+    )
+else:
+    STAGE_LATENCY = SEARCH_RESULTS = PIPELINE_SOURCE = PAGE_REQUESTS = SESSION_OPERATIONS = _NoopMetric()
+    SEARCH_DEGRADATIONS = ADMISSION_DECISIONS = CLIENT_DISCONNECTS = _NoopMetric()
+    DB_POOL = EMBEDDING_INFLIGHT = CACHE_STATS = _NoopMetric()
+
+
+def observe_search(timings: Dict[str, float], total: float, source: str) -> None:
+    """
+    記錄一次搜尋的各階段耗時。
+    為什麼快取命中時不記錄細分階段：命中時各階段皆為 0，會把 SQL / Qdrant 的分布拉向 0，掩蓋真實延遲。
+    """
+    PIPELINE_SOURCE.labels(source=source).inc()
+    STAGE_LATENCY.labels(stage="total").observe(total)
+    if source != "executed":
+        return
+    for stage, seconds in timings.items():
+        STAGE_LATENCY.labels(stage=stage).observe(max(seconds, 0.0))
+
+
+def record_search_result(quality_label: str, search_status: Any) -> None:
+    status = search_status.get("status", "unknown") if isinstance(search_status, dict) else str(search_status)
+    SEARCH_RESULTS.labels(quality_label=quality_label, search_status=status).inc()
+
+
+def _set_component_stats(component: str, stats: Optional[Dict[str, Any]]) -> None:
+    if not stats:
+        return
+    for stat, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        CACHE_STATS.labels(component=component, stat=stat).set(value)
+
+
+def refresh_runtime_gauges(app_state: Any, db_pool_stats: Optional[Dict[str, int]] = None) -> None:
+    """於 /metrics 抓取時更新 Gauge (快取統計、連線池狀態)，避免在請求熱路徑上額外計算。"""
+    if db_pool_stats:
+        for state, value in db_pool_stats.items():
+            DB_POOL.labels(state=state).set(value)
+
+    session_cache = getattr(app_state, "session_cache", None)
+    if session_cache is not None:
+        session_stats = session_cache.stats()
+        _set_component_stats("session_write_behind", session_stats.get("write_behind"))
+        _set_component_stats("session_l1", session_stats.get("l1"))
+
+    intent_cache = getattr(app_state, "intent_cache", None)
+    if intent_cache is not None:
+        intent_stats = intent_cache.stats()
+        _set_component_stats("intent_cache", intent_stats)
+        _set_component_stats("intent_cache_l1", intent_stats.get("l1"))
+
+    geo_cache = getattr(app_state, "geo_cache", None)
+    if geo_cache is not None:
+        geo_stats = geo_cache.stats()
+        _set_component_stats("geo_cache", geo_stats)
+        _set_component_stats("geo_cache_l1", geo_stats.get("l1"))
+
+    search_pipeline = getattr(app_state, "search_pipeline", None)
+    if search_pipeline is not None and search_pipeline.single_flight is not None:
+        _set_component_stats("single_flight", search_pipeline.single_flight.stats())
+
+    from app.utils.metrics_sink import metrics_sink
+    _set_component_stats("metrics_sink", metrics_sink.stats())
+
+    # 各階段目前的並行數與排隊數 (卸載比例請以 admission_decisions_total 計算)
+    from app.utils.admission import admission
+    for stage, stats in admission.stats().items():
+        _set_component_stats(f"admission_{stage}", stats)
+
+
+async def run_gauge_refresher(app_state: Any, interval: float) -> None:
+    """
+    每 interval 秒更新本 Worker 的 Gauge (多 Worker 時由每個 Worker 的 startup 啟動)。
+    單一 Worker 不需要：/metrics 抓取時一定由同一個 Worker 更新。
+    """
+    from app.utils.db import get_db_pool_stats
+    while True:
+        try:
+            refresh_runtime_gauges(app_state, get_db_pool_stats())
+        except Exception as e:
+            # 統計失敗不應讓任務結束，下一輪再試
+            logger.warning(f"[Metrics] 更新 Gauge 失敗: {e}")
+        await asyncio.sleep(interval)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """輸出 Prometheus 文字格式 (text exposition format)。"""
+    if not PROMETHEUS_AVAILABLE:
+        logger.warning("[Metrics] 未安裝 prometheus_client，/metrics 無法輸出")
+        return b"# prometheus_client is not installed\n", CONTENT_TYPE_LATEST
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # 多 Worker：每次抓取時建立獨立 Registry，彙總所有 Worker 寫入的 mmap 檔
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    from prometheus_client import REGISTRY
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
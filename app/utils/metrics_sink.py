@@ -0,0 +1,278 @@
+# app/utils/metrics_sink.py
+"""
+非同步緩衝式效能指標寫入器 (Metrics Sink)
+
+為什麼需要：
+    舊版 log_performance_to_csv / log_function_timing 每次呼叫都在 Event Loop 上同步執行
+    os.path.isfile → open(..., 'a') → csv 寫入；一個請求就會觸發 analyze_intent、build_sql、build_count_sql
+    與 Route 層共 4 次以上的檔案 I/O，直接卡住所有併發中的請求。
+
+設計 (與 app_logger.py 的 QueueHandler / QueueListener 相同思路)：
+    • 請求處理端只呼叫 emit()：把一筆 dict 放進記憶體環形緩衝區 (O(1)、不碰檔案系統)
+    • 背景執行緒依「累積筆數」或「時間間隔」批次寫入，並在檔案過大時輪替 (Rotation)
+    • 緩衝區滿時直接丟棄新資料並累加 drop 計數，寧可少記幾筆指標也不拖慢請求
+    • 輸出格式：csv / jsonl / jsonl.zst / parquet (parquet 需安裝 pyarrow，jsonl.zst 需安裝 zstandard)
+"""
+import atexit
+import csv
+import glob
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.config import Config
+from app.utils.app_logger import logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+_EXTENSIONS = {"csv": ".csv", "jsonl": ".jsonl", "jsonl.zst": ".jsonl.zst", "parquet": ".parquet"}
+
+
+class _Stream:
+    """單一指標串流的輸出設定 (例如 performance / function_timing)。"""
+
+    def __init__(self, name: str, path: str, fieldnames: Optional[List[str]], output_format: str):
+        self.name = name
+        self.path = path
+        self.fieldnames = fieldnames
+        self.output_format = output_format
+        self.written = 0
+        self.dropped = 0
+        self.part_seq = 0
+
+
+class MetricsSink:
+    def __init__(
+        self,
+        buffer_size: int,
+        flush_batch: int,
+        flush_interval: float,
+        output_format: str,
+        rotate_bytes: int,
+        backup_count: int
+    ):
+        if output_format == "parquet" and pa is None:
+            logger.warning("[MetricsSink] 未安裝 pyarrow，輸出格式由 parquet 退回 jsonl")
+            output_format = "jsonl"
+        if output_format == "jsonl.zst" and zstandard is None:
+            logger.warning("[MetricsSink] 未安裝 zstandard，輸出格式由 jsonl.zst 退回 jsonl")
+            output_format = "jsonl"
+        if output_format not in _EXTENSIONS:
+            logger.warning(f"[MetricsSink] 不支援的輸出格式 '{output_format}'，退回 csv")
+            output_format = "csv"
+
+        self.buffer_size = buffer_size
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self.output_format = output_format
+        self.rotate_bytes = rotate_bytes
+        self.backup_count = backup_count
+
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._streams: Dict[str, _Stream] = {}
+        self._stats = {"emitted": 0, "dropped": 0, "flushes": 0, "write_errors": 0, "rotations": 0}
+
+    # ── 設定 ─────────────────────────────────────────────────────────
+
+    def register_stream(
+        self,
+        name: str,
+        path: str,
+        fieldnames: Optional[List[str]] = None,
+        output_format: Optional[str] = None
+    ) -> None:
+        """
+        註冊指標串流。
+        :param path:          輸出路徑；副檔名會依輸出格式自動替換 (例如 .csv → .jsonl)
+        :param fieldnames:    CSV 欄位順序；其他格式僅作為參考
+        :param output_format: 覆寫此串流的輸出格式 (例如巢狀結構的 Trace 固定使用 jsonl)
+        """
+        stream_format = output_format if output_format in _EXTENSIONS else self.output_format
+        if (stream_format == "parquet" and pa is None) or (stream_format == "jsonl.zst" and zstandard is None):
+            stream_format = "jsonl"
+        root, _ = os.path.splitext(path)
+        self._streams[name] = _Stream(name, root + _EXTENSIONS[stream_format], fieldnames, stream_format)
+
+    # ── 請求端 API (不得觸及檔案系統) ──────────────────────────────────
+
+    def emit(self, stream: str, row: Dict[str, Any]) -> bool:
+        """
+        放入一筆指標。
+        :return: False 代表緩衝區已滿而被丟棄
+        """
+        if self._thread is None:
+            self.start()
+
+        with self._lock:
+            if len(self._buffer) >= self.buffer_size:
+                self._stats["dropped"] += 1
+                target = self._streams.get(stream)
+                if target is not None:
+                    target.dropped += 1
+                return False
+            self._buffer.append((stream, row))
+            self._stats["emitted"] += 1
+            pending = len(self._buffer)
+
+        if pending >= self.flush_batch:
+            self._wakeup.set()
+        return True
+
+    # ── 生命週期 ─────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics-sink", daemon=True)
+            self._thread.start()
+        # 直譯器結束前把緩衝區剩餘資料寫出 (例如離線腳本未呼叫 stop)
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """停止背景執行緒，並寫出緩衝區內所有剩餘資料。"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        thread.join(timeout=timeout)
+        self._thread = None
+
+    def flush(self) -> None:
+        """立即把目前緩衝區內容寫入檔案 (由背景執行緒或 stop 呼叫)。"""
+        with self._lock:
+            if not self._buffer:
+                return
+            batch = list(self._buffer)
+            self._buffer.clear()
+
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for stream, row in batch:
+            grouped.setdefault(stream, []).append(row)
+
+        for name, rows in grouped.items():
+            target = self._streams.get(name)
+            if target is None:
+                logger.warning(f"[MetricsSink] 未註冊的指標串流 '{name}'，丟棄 {len(rows)} 筆")
+                continue
+            try:
+                self._write(target, rows)
+                target.written += len(rows)
+            except Exception as e:
+                self._stats["write_errors"] += 1
+                logger.error(f"[MetricsSink] 寫入 '{target.path}' 失敗: {e}")
+        self._stats["flushes"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "buffered": len(self._buffer),
+            "buffer_size": self.buffer_size,
+            "format": self.output_format,
+            "streams": {
+                name: {"path": s.path, "written": s.written, "dropped": s.dropped}
+                for name, s in self._streams.items()
+            },
+        }
+
+    # ── 背景執行緒 ───────────────────────────────────────────────────
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(timeout=self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        # 收到停止訊號後做最後一次 flush，確保關閉前的指標不遺失
+        self.flush()
+
+    def _write(self, target: _Stream, rows: List[Dict[str, Any]]) -> None:
+        directory = os.path.dirname(target.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if target.output_format == "parquet":
+            # Parquet 不支援附加寫入：每批寫成一個分段檔 (part)，由分析端以資料夾方式讀取
+            # 分段檔本身就是輪替單位，保存期限交由分析端管理，此處不自動刪除以免遺失資料
+            root, ext = os.path.splitext(target.path)
+            target.part_seq += 1
+            part_path = f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{target.part_seq:05d}{ext}"
+            pq.write_table(pa.Table.from_pylist(rows), part_path)
+            return
+
+        self._rotate_if_needed(target)
+        file_exists = os.path.isfile(target.path)
+
+        if target.output_format == "csv":
+            fieldnames = target.fieldnames or list(rows[0].keys())
+            with open(target.path, mode="a", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+                if not file_exists:
+                    writer.writeheader()
+                writer.writerows(rows)
+        elif target.output_format == "jsonl.zst":
+            # 每批壓成一個獨立的 zstd frame 附加在檔尾；多個 frame 串接仍是合法的 zstd 檔，
+            # 讀取端以 stream_reader(read_across_frames=True) 或 `zstd -dc` 即可還原成完整 JSONL
+            payload = "".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows)
+            with open(target.path, mode="ab") as f:
+                f.write(zstandard.ZstdCompressor(level=3).compress(payload.encode("utf-8")))
+        else:
+            with open(target.path, mode="a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False, default=str))
+                    f.write("\n")
+
+    def _rotate_if_needed(self, target: _Stream) -> None:
+        if self.rotate_bytes <= 0 or not os.path.isfile(target.path):
+            return
+        if os.path.getsize(target.path) < self.rotate_bytes:
+            return
+        # 微秒時間戳：同一秒內輪替兩次 (METRICS_ROTATE_BYTES 很小或寫入量很大) 時，os.replace 會默默覆蓋前一份備份
+        base = f"{target.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        rotated, seq = base, 0
+        while os.path.exists(rotated):
+            seq += 1
+            rotated = f"{base}-{seq}"
+        os.replace(target.path, rotated)
+        self._stats["rotations"] += 1
+        self._prune_backups(f"{target.path}.*")
+
+    def _prune_backups(self, pattern: str) -> None:
+        if self.backup_count <= 0:
+            return
+        backups = sorted(glob.glob(pattern), key=os.path.getmtime)
+        for old in backups[:-self.backup_count]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+# 建立單例供外部使用 (與 app_log_manager 相同的使用方式)
+metrics_sink = MetricsSink(
+    buffer_size=Config.METRICS_BUFFER_SIZE,
+    flush_batch=Config.METRICS_FLUSH_BATCH,
+    flush_interval=Config.METRICS_FLUSH_INTERVAL,
+    output_format=Config.METRICS_FORMAT,
+    rotate_bytes=Config.METRICS_ROTATE_BYTES,
+    backup_count=Config.METRICS_BACKUP_COUNT
+)
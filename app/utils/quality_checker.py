@@ -1,14 +1,15 @@
 # app/utils/quality_checker.py
 
-def analyze_search_results(all_results, plan, total_count, vector_search_info, rdb_info):
+def analyze_search_results(all_results, plan, total_count, vector_search_info, rdb_info, degradation=None):
     """
     [綜合分析門面]
     合併狀態診斷與品質評價。
     注意：這裡傳入 all_results 以獲得最準確的全域診斷。
+    degradation: 為趕上請求截止時間而採取的降級步驟 (見 app/utils/deadline.py)
     """
     # 1. 取得搜尋狀態診斷 (移除重複的分頁資訊)
     # 這裡假設 check_search_status 內部僅回傳狀態字串 (如 "success", "no_match")
-    search_status = check_search_status(all_results, plan, total_count=total_count)
+    search_status = check_search_status(all_results, plan, total_count=total_count, degradation=degradation)
 
     # 2. 取得品質標籤、降階旗標與 AI 指南
     quality_label, is_fallback, ai_hint = evaluate_search_quality(
@@ -45,10 +46,11 @@ def evaluate_search_quality(db_results, vector_search_info, rdb_info, plan):
     return quality_label, is_fallback, ai_hint
 
 
-def check_search_status(all_results, plan, total_count=0):
+def check_search_status(all_results, plan, total_count=0, degradation=None):
     """
     技術診斷門面：檢查搜尋過程狀態、位置來源及 SQL 命中統計。
     已移除分頁資訊 (current_page, has_next 等)，改由 pagination 欄位統一處理。
+    degradation 非空時標記 is_incomplete_search，讓 AI 知道結果是趕時間的近似值 (例如 total_count 只是下限)。
     """
     has_results = len(all_results) > 0
     
@@ -116,5 +118,11 @@ def check_search_status(all_results, plan, total_count=0):
                 status_info["suggestion"] = "目前關鍵字搜尋不到店家，請更換關鍵字。"
         else:
             status_info["suggestion"] = "SQL 基礎過濾查無資料，建議擴大搜尋範圍。"
+
+    # --- 3. 降級標記 (請求截止時間) ---
+    if degradation:
+        status_info["is_incomplete_search"] = True
+        status_info["degraded"] = True
+        status_info["degradation"] = list(degradation)
             
     return status_info
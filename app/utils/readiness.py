@@ -0,0 +1,98 @@
+# app/utils/readiness.py
+"""
+服務就緒狀態 (Readiness)
+
+為什麼需要：
+    原本 startup_event 依序建立 MySQL 連線池、Redis、載入 BGE-M3 (可能還要先 snapshot_download)，全部完成才開始服務；
+    任何一步失敗只記一行錯誤，之後的請求才以 AttributeError 回傳 500。滾動部署時負載平衡器無從得知 Worker 是否已暖機，
+    冷的 Worker 一上線就接到流量，第一批請求全部付出模型載入與建立連線的延遲。
+
+做法：
+    • startup 只登記要等待的依賴 (expect)，實際的連線與模型載入在背景 Task 平行進行 (見 app/__init__.py)
+    • 每個依賴各自重試直到成功，記錄耗時、嘗試次數與最後一次錯誤
+    • GET /readyz 依此回報 200 / 503；Middleware 在依賴尚未就緒時直接回 503 + Retry-After，不讓請求撞上半初始化的 Service
+    • 沒有登記任何依賴 (例如 benchmarks/loadtest.py 直接組裝單例) 時視為就緒
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from app.utils.app_logger import logger
+
+
+class Readiness:
+    def __init__(self):
+        self._components: Dict[str, Dict[str, Any]] = {}
+        self._started_at: Optional[float] = None
+        self._ready_at: Optional[float] = None
+
+    def expect(self, *names: str) -> None:
+        """登記需等待的依賴；必須在開始服務前 (startup 事件內) 呼叫。"""
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+        for name in names:
+            self._components.setdefault(name, {"ready": False, "ms": None, "attempts": 0, "error": None})
+
+    def missing(self, names: Optional[Iterable[str]] = None) -> List[str]:
+        """尚未就緒的依賴；names 為 None 時檢查全部。"""
+        targets = self._components if names is None else names
+        return [name for name in targets if name in self._components and not self._components[name]["ready"]]
+
+    @property
+    def ready(self) -> bool:
+        return not self.missing()
+
+    def _mark_ready(self, name: str, ms: float) -> None:
+        self._components[name].update(ready=True, ms=round(ms, 1), error=None)
+        if self.ready and self._ready_at is None:
+            self._ready_at = time.perf_counter()
+            logger.info(f"[Readiness] 所有依賴已就緒 ({(self._ready_at - self._started_at) * 1000:.0f} ms)")
+
+    async def warm(
+        self,
+        name: str,
+        factory: Callable[[], Awaitable[Any]],
+        retry_interval: float,
+        max_interval: float = 60.0,
+    ) -> Any:
+        """
+        執行 factory() 直到成功，並標記 name 為就緒。
+        為什麼重試而不是直接失敗：MySQL / Qdrant 常與本服務同時重啟，晚幾秒就緒不該讓 Worker 永遠不可用；
+        重試間隔以指數退避，上限 max_interval 秒。
+        """
+        self.expect(name)
+        state = self._components[name]
+        interval = retry_interval
+        while True:
+            state["attempts"] += 1
+            t0 = time.perf_counter()
+            try:
+                result = await factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state["error"] = f"{type(e).__name__}: {e}"
+                logger.warning(f"[Readiness] {name} 尚未就緒 (第 {state['attempts']} 次): {state['error']}，{interval:g} 秒後重試")
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, max_interval)
+                continue
+            if isinstance(result, dict):
+                # 例如 Embedding 的模型載入 / 暖機推論耗時，一併顯示在 /readyz
+                state["detail"] = result
+            self._mark_ready(name, (time.perf_counter() - t0) * 1000)
+            logger.info(f"[Readiness] {name} 已就緒 ({state['ms']} ms)")
+            return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = None
+        if self._started_at is not None:
+            elapsed = ((self._ready_at or time.perf_counter()) - self._started_at) * 1000
+        return {
+            "ready": self.ready,
+            "warmup_ms": round(elapsed, 1) if elapsed is not None else None,
+            "components": {name: dict(state) for name, state in self._components.items()},
+        }
+
+
+# 單例：每個 Worker 一份 (各 Worker 各自暖機)
+readiness = Readiness()
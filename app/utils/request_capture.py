@@ -0,0 +1,128 @@
+# app/utils/request_capture.py
+"""
+正式流量擷取 (Sampled Request Capture)
+
+為什麼需要：
+    loadtest 的意圖組合是人工定義的；真正打進 /place_search 的 LLM 意圖分布 (條件數、排序欄位、
+    熱門查詢的重複率、翻頁比例) 只有正式流量才有。這裡抽樣記錄原始 ai_to_api_data 與處理結果，
+    交給 benchmarks/replay.py 在不同版本間以「同一份工作負載」重播比較延遲。
+
+記錄內容 (每行一筆 JSON，經 MetricsSink 背景寫入並輪替，預設 zstd 壓縮)：
+    • kind=search：payload (去識別化後)、intent_fingerprint、結果來源、各階段耗時、總耗時、品質標籤、search_ssid
+    • kind=page  ：被抽中的搜尋之後的翻頁請求 (search_ssid、頁碼、狀態、耗時)
+
+去識別化：
+    • s_id 改為雜湊值 (仍保留「同一對話」的關聯性)
+    • user_location 依 Config.CAPTURE_LOCATION_MODE 隨機偏移 / 保留 / 移除
+
+限制：翻頁請求只有落在「同一個 Worker」時才能對應到被抽中的搜尋；多 Worker 部署下翻頁紀錄會少於實際比例。
+"""
+import copy
+import hashlib
+import math
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.config import Config
+from app.utils.metrics_sink import metrics_sink
+
+CAPTURE_SCHEMA_VERSION = 1
+_METERS_PER_DEGREE = 111_320.0
+
+metrics_sink.register_stream("capture", Config.CAPTURE_PATH, output_format=Config.CAPTURE_FORMAT)
+
+# 最近被抽中的 search_ssid；翻頁請求只有命中此表才記錄
+_captured_sessions: "OrderedDict[str, None]" = OrderedDict()
+
+
+def _hash_identifier(value: Any) -> str:
+    return "cap-" + hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:12]
+
+
+def _jitter_location(location: Dict[str, Any], radius_m: float) -> Dict[str, float]:
+    """在半徑 radius_m 的圓內均勻取一點 (sqrt 讓點不會集中在圓心)。"""
+    lat, lng = float(location["lat"]), float(location["lng"])
+    distance = radius_m * math.sqrt(random.random())
+    bearing = random.uniform(0, 2 * math.pi)
+    d_lat = distance * math.cos(bearing) / _METERS_PER_DEGREE
+    d_lng = distance * math.sin(bearing) / (_METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+    return {"lat": round(lat + d_lat, 6), "lng": round(lng + d_lng, 6)}
+
+
+def _sanitize(payload: Dict[str, Any]) -> Dict[str, Any]:
+    snapshot = copy.deepcopy(payload)
+    if "s_id" in snapshot:
+        snapshot["s_id"] = _hash_identifier(snapshot["s_id"])
+
+    location = snapshot.get("user_location")
+    if isinstance(location, dict) and "lat" in location and "lng" in location:
+        mode = Config.CAPTURE_LOCATION_MODE
+        if mode == "drop":
+            snapshot.pop("user_location")
+        elif mode != "keep":
+            try:
+                snapshot["user_location"] = _jitter_location(location, Config.CAPTURE_JITTER_METERS)
+            except (TypeError, ValueError):
+                snapshot.pop("user_location")
+    return snapshot
+
+
+def capture_payload(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    決定這個搜尋請求是否被抽中；抽中時回傳去識別化後的複本，否則回傳 None。
+    必須在 analyze_intent 之前呼叫，確保記錄的是 LLM 送來的原始內容。
+    """
+    if not Config.CAPTURE_ENABLED or random.random() >= Config.CAPTURE_SAMPLE_RATE:
+        return None
+    try:
+        return _sanitize(payload)
+    except Exception:
+        # 擷取失敗不能影響搜尋本身
+        return None
+
+
+def capture_search(
+    snapshot: Dict[str, Any],
+    *,
+    fingerprint: Optional[str],
+    source: str,
+    timings: Dict[str, float],
+    total: float,
+    status: str,
+    total_count: int,
+    search_ssid: Optional[str] = None,
+) -> None:
+    if search_ssid:
+        _captured_sessions[search_ssid] = None
+        while len(_captured_sessions) > Config.CAPTURE_TRACKED_SESSIONS:
+            _captured_sessions.popitem(last=False)
+
+    metrics_sink.emit("capture", {
+        "v": CAPTURE_SCHEMA_VERSION,
+        "kind": "search",
+        "ts": round(time.time(), 3),
+        "payload": snapshot,
+        "fingerprint": fingerprint,
+        "source": source,
+        "timings_ms": {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()},
+        "total_ms": round(total * 1000, 2),
+        "status": status,
+        "total_count": total_count,
+        "search_ssid": search_ssid,
+    })
+
+
+def capture_page(search_ssid: str, page: int, status: str, total: float) -> None:
+    if not Config.CAPTURE_ENABLED or search_ssid not in _captured_sessions:
+        return
+    metrics_sink.emit("capture", {
+        "v": CAPTURE_SCHEMA_VERSION,
+        "kind": "page",
+        "ts": round(time.time(), 3),
+        "search_ssid": search_ssid,
+        "page": page,
+        "status": status,
+        "total_ms": round(total * 1000, 2),
+    })
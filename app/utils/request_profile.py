@@ -0,0 +1,59 @@
+# app/utils/request_profile.py
+"""
+單一請求的效能剖析資料 (Inline Request Profile)
+
+為什麼需要：
+    排查單一慢查詢時，原本得到日誌裡拼湊 SQL、參數、Qdrant 過濾範圍與各階段耗時；
+    POST /place_search?profile=true 改為把這些資訊直接附在回應的 "profile" 欄位。
+
+設計 (與 tracing.py 相同思路)：
+    • 以 ContextVar 保存目前請求的 RequestProfile；Repository / Service 只需呼叫 profile_record(...)
+    • 沒有開啟 profile 的請求，profile_record 只做一次 ContextVar 讀取就返回
+    • 各區段 (section) 為一層 dict：sql / explain / intent_cache / embedding / qdrant / ranking / stages_ms
+"""
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_request_profile", default=None)
+
+
+class RequestProfile:
+    __slots__ = ("sections",)
+
+    def __init__(self):
+        self.sections: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, section: str, **data) -> None:
+        self.sections.setdefault(section, {}).update(data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.sections
+
+
+class profile_scope:
+    """在 with 區塊內啟用剖析；區塊內建立的 asyncio Task 會繼承同一份 RequestProfile。"""
+
+    __slots__ = ("profile", "_token")
+
+    def __init__(self):
+        self.profile = RequestProfile()
+        self._token = None
+
+    def __enter__(self) -> RequestProfile:
+        self._token = _current_profile.set(self.profile)
+        return self.profile
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_profile.reset(self._token)
+        return False
+
+
+def profiling() -> bool:
+    return _current_profile.get() is not None
+
+
+def profile_record(section: str, **data) -> None:
+    """記錄剖析資料；沒有進行中的剖析時不做任何事。"""
+    current = _current_profile.get()
+    if current is not None:
+        current.record(section, **data)
@@ -0,0 +1,90 @@
+# app/utils/response_projection.py
+"""
+回應投影 (Response Projection)：依呼叫端需求裁切搜尋回應
+
+為什麼需要：
+    每筆店家都帶著 score_analysis、applied_strategy、ranking_reason、review_summary、10 張照片 URL，
+    回應本身還有完整的 vector_search_info；POST /place_search 與每次翻頁都序列化整包內容，
+    即使呼叫端 (例如只需要店名與 ID 的 LLM 調度端) 根本不會讀。
+
+檢視 (view)：
+    full     原本的完整回應 (預設，Config.RESPONSE_DEFAULT_VIEW)
+    llm      LLM 生成回覆所需的欄位：店家基本資料、設施、評論摘要與推薦理由；不含照片、分數明細與向量診斷
+    minimal  只保留 ID、店名、評分與距離，適合只做後續動作 (翻頁、重新排序) 的呼叫端
+fields (逗號分隔) 可直接指定每筆店家要保留的欄位，優先於 view 的欄位清單。
+
+投影在序列化之前、對新建的 dict 進行：Session 中的店家資料同時被 L1 快取與背景寫入引用，不能就地修改。
+底線開頭的內部欄位 (例如重新排序用的 _rank_features) 在任何檢視下都不輸出。
+"""
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+from app.config import Config
+
+VIEWS = ("minimal", "llm", "full")
+
+# 只供服務內部使用、任何檢視都不輸出的店家欄位前綴 (例如重新排序用的 _rank_features)
+INTERNAL_PREFIX = "_"
+
+# 每個檢視保留的店家欄位 (None 代表全部)
+_ROW_FIELDS: Dict[str, Optional[FrozenSet[str]]] = {
+    "minimal": frozenset({"id", "restaurant_name", "rating", "distance"}),
+    # 評論數在推薦模式為 user_ratings_total、一般查詢模式為 reviews_count (SELECT 別名不同)，兩者都保留
+    "llm": frozenset({
+        "id", "restaurant_name", "address", "rating", "user_ratings_total", "reviews_count", "distance",
+        "cuisine_type", "merchant_category", "facility_tags", "opening_hours",
+        "review_summary", "ranking_reason",
+    }),
+    "full": None,
+}
+
+# search_status 中給 LLM 判斷語氣的欄位；debug_details 等除錯資訊只在 full 保留
+_LLM_STATUS_FIELDS = ("status", "location_info", "total_count", "is_incomplete_search", "no_results_found", "suggestion", "degraded", "degradation")
+
+
+def parse_fields(fields: Optional[str]) -> Optional[FrozenSet[str]]:
+    """解析 ?fields=id,restaurant_name；空字串視為未指定。"""
+    if not fields:
+        return None
+    names = frozenset(name.strip() for name in fields.split(",") if name.strip())
+    return names or None
+
+
+def resolve_view(view: Optional[str]) -> str:
+    return view if view in VIEWS else Config.RESPONSE_DEFAULT_VIEW
+
+
+def _is_internal(key: str) -> bool:
+    return key.startswith(INTERNAL_PREFIX)
+
+
+def project_rows(rows: Iterable[Dict[str, Any]], view: str, fields: Optional[FrozenSet[str]] = None) -> List[Dict[str, Any]]:
+    keep = fields if fields is not None else _ROW_FIELDS.get(view)
+    if keep is None:
+        return [{key: value for key, value in row.items() if not _is_internal(key)} for row in rows]
+    return [{key: value for key, value in row.items() if key in keep and not _is_internal(key)} for row in rows]
+
+
+def project_response(response: Dict[str, Any], view: Optional[str], fields: Optional[FrozenSet[str]] = None) -> Dict[str, Any]:
+    """
+    依 view / fields 裁切搜尋回應 (POST /place_search、翻頁、批次的每個項目)；full 檢視只去除內部欄位。
+    只處理帶有 data.final_results 的成功回應，錯誤項目原樣回傳。
+    """
+    view = resolve_view(view)
+    data = response.get("data")
+    if not isinstance(data, dict) or "final_results" not in data:
+        return response
+
+    projected = dict(data)
+    projected["final_results"] = project_rows(data["final_results"], view, fields)
+
+    if view != "full":
+        # 向量診斷 (查詢字串、Qdrant 耗時) 只對除錯有用
+        projected.pop("vector_search_info", None)
+        status = data.get("search_status")
+        if isinstance(status, dict):
+            if view == "minimal":
+                projected["search_status"] = {"status": status.get("status")}
+            else:
+                projected["search_status"] = {key: status[key] for key in _LLM_STATUS_FIELDS if key in status}
+
+    return {**response, "data": projected}
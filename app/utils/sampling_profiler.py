@@ -0,0 +1,262 @@
+# app/utils/sampling_profiler.py
+"""
+程序內取樣分析器 (In-process Sampling Profiler)
+
+為什麼需要：
+    p99 在正式環境變差時，無法對 uvicorn Worker 掛除錯器，也不能為了重現問題重啟服務加上 cProfile。
+    這裡在「被觸發時」才啟動一條取樣執行緒，每隔 interval 以 sys._current_frames() 讀取所有執行緒的堆疊
+    (Event Loop、asyncio.to_thread 的推論 / 查詢執行緒、背景寫入器)，累計成火焰圖所需的資料。
+
+設計：
+    • 閒置時零成本：沒有常駐執行緒、不掛 sys.setprofile / settrace；唯一的常駐成本是 @traced 註冊 code object
+    • 取樣只讀堆疊，不中斷目標執行緒；取樣期間的額外負擔約等於每 interval 一次 GIL 搶佔
+    • 以堆疊上的 @traced 包裝函式標記所在 Span (例如 [span:vector.search_and_rank])，可直接看出哪個階段吃 CPU
+    • 預設略過閒置樣本 (selector 等待 I/O、執行緒池等待工作)，讓火焰圖只呈現真正在執行的程式碼
+    • 同一時間只允許一個取樣工作
+
+觸發方式：
+    • GET /admin/profile (需 X-Admin-Token，見 app/routes/admin_routes.py)
+    • kill -USR2 <worker pid>：背景取樣 Config.PROFILER_SIGNAL_SECONDS 秒，寫入 Config.PROFILER_OUTPUT_DIR
+
+輸出格式：
+    • collapsed ：Brendan Gregg 的 folded stacks (每行 "thread;frame;frame 次數")，可交給 flamegraph.pl / inferno
+    • speedscope：https://www.speedscope.app 可直接開啟的 JSON，每個執行緒一個 Profile
+"""
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+from app.config import Config
+from app.utils.app_logger import logger
+from app.utils.tracing import traced_span_name
+
+_MAX_DEPTH = 128
+
+# (檔名結尾, 函式名稱)：堆疊最內層落在這些位置時視為閒置
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("concurrent/futures/thread.py", "_worker"),
+}
+
+
+class ProfilerBusyError(RuntimeError):
+    """已有取樣工作進行中。"""
+
+
+class ProfileResult:
+    """取樣結果：以 (執行緒名稱, 堆疊) 為 key 的次數統計。"""
+
+    def __init__(self, stacks: Counter, interval: float, duration: float, samples: int, idle_skipped: int):
+        self.stacks = stacks
+        self.interval = interval
+        self.duration = duration
+        self.samples = samples
+        self.idle_skipped = idle_skipped
+
+    def to_collapsed(self) -> str:
+        lines = [
+            ";".join((thread_name,) + frames) + f" {count}"
+            for (thread_name, frames), count in self.stacks.most_common()
+        ]
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self, name: str = "place-search") -> Dict[str, Any]:
+        frame_index: Dict[str, int] = {}
+        frames: List[Dict[str, Any]] = []
+        per_thread: Dict[str, Tuple[List[List[int]], List[float]]] = {}
+
+        for (thread_name, stack), count in self.stacks.items():
+            indices = []
+            for label in stack:
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    func, _, location = label.partition(" (")
+                    file, _, line = location.rstrip(")").rpartition(":")
+                    entry = {"name": func}
+                    if file:
+                        entry["file"] = file
+                        entry["line"] = int(line) if line.isdigit() else None
+                    frames.append(entry)
+                indices.append(frame_index[label])
+            samples, weights = per_thread.setdefault(thread_name, ([], []))
+            samples.append(indices)
+            weights.append(round(count * self.interval, 6))
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "app.utils.sampling_profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": thread_name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": round(sum(weights), 6),
+                    "samples": samples,
+                    "weights": weights,
+                }
+                for thread_name, (samples, weights) in sorted(per_thread.items())
+            ],
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "duration_s": round(self.duration, 3),
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "idle_skipped": self.idle_skipped,
+            "unique_stacks": len(self.stacks),
+        }
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    filename = code.co_filename.replace("\\", "/")
+    return any(filename.endswith(suffix) and code.co_name == func for suffix, func in _IDLE_LEAVES)
+
+
+def _walk(frame, tag_spans: bool) -> Tuple[str, ...]:
+    """由內而外走訪堆疊，回傳由外而內 (Root → Leaf) 的標籤序列。"""
+    labels = []
+    span_name = None
+    depth = 0
+    while frame is not None and depth < _MAX_DEPTH:
+        if tag_spans and span_name is None:
+            span_name = traced_span_name(frame)
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+        depth += 1
+    labels.reverse()
+    if span_name is not None:
+        # 放在執行緒名稱之後：火焰圖第一層即依 Span 分組
+        labels.insert(0, f"[span:{span_name}]")
+    return tuple(labels)
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def profile(
+        self,
+        seconds: float,
+        interval: float = 0.005,
+        tag_spans: bool = True,
+        include_idle: bool = False,
+    ) -> ProfileResult:
+        """
+        在呼叫端執行緒上取樣 seconds 秒 (阻塞)；由 asyncio.to_thread 或背景執行緒呼叫，不可在 Event Loop 上直接呼叫。
+        :raises ProfilerBusyError: 已有取樣工作進行中
+        """
+        with self._lock:
+            if self._running:
+                raise ProfilerBusyError("profiler is already running")
+            self._running = True
+
+        try:
+            return self._sample(seconds, interval, tag_spans, include_idle)
+        finally:
+            self._running = False
+
+    def _sample(self, seconds: float, interval: float, tag_spans: bool, include_idle: bool) -> ProfileResult:
+        own_ident = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = idle_skipped = 0
+        names: Dict[int, str] = {}
+
+        t_start = time.perf_counter()
+        deadline = t_start + seconds
+        next_tick = t_start
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+                if not include_idle and _is_idle(frame):
+                    idle_skipped += 1
+                    continue
+                stacks[(names.get(ident, f"thread-{ident}"), _walk(frame, tag_spans))] += 1
+                samples += 1
+            del frames
+
+            # 以固定節拍取樣；落後時直接跳到下一個節拍，不補取樣
+            next_tick += interval
+            sleep_for = next_tick - time.perf_counter()
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+            else:
+                next_tick = time.perf_counter()
+
+        return ProfileResult(stacks, interval, time.perf_counter() - t_start, samples, idle_skipped)
+
+
+# 單例：每個 Worker 一份
+sampling_profiler = SamplingProfiler()
+
+
+def write_profile(result: ProfileResult, directory: str, fmt: str = "speedscope") -> str:
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if fmt == "collapsed":
+        path = os.path.join(directory, f"profile-{os.getpid()}-{stamp}.collapsed.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(result.to_collapsed())
+    else:
+        path = os.path.join(directory, f"profile-{os.getpid()}-{stamp}.speedscope.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result.to_speedscope(), f)
+    return path
+
+
+def _profile_to_file() -> None:
+    try:
+        result = sampling_profiler.profile(Config.PROFILER_SIGNAL_SECONDS, Config.PROFILER_INTERVAL_MS / 1000)
+    except ProfilerBusyError:
+        logger.warning("[Profiler] 已有取樣工作進行中，忽略此次 SIGUSR2")
+        return
+    path = write_profile(result, Config.PROFILER_OUTPUT_DIR)
+    logger.info(f"[Profiler] 取樣完成 {result.summary()}，已寫入 {path}")
+
+
+def _handle_signal(signum, frame) -> None:
+    # Signal Handler 內只啟動執行緒，取樣本身不在主執行緒 (Event Loop) 上進行
+    threading.Thread(target=_profile_to_file, name="sampling-profiler", daemon=True).start()
+
+
+def install_signal_handler() -> bool:
+    """註冊 SIGUSR2；必須在主執行緒呼叫 (FastAPI startup 事件即在主執行緒)。Windows 沒有 SIGUSR2，直接略過。"""
+    if not Config.PROFILER_SIGNAL_ENABLED or not hasattr(signal, "SIGUSR2"):
+        return False
+    try:
+        signal.signal(signal.SIGUSR2, _handle_signal)
+    except ValueError:
+        # 非主執行緒 (例如部分測試或嵌入式執行環境)
+        return False
+    logger.info(f"[Profiler] 已註冊 SIGUSR2：kill -USR2 {os.getpid()} 取樣 {Config.PROFILER_SIGNAL_SECONDS:g} 秒")
+    return True
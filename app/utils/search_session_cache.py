@@ -1,35 +1,19 @@
 # app/utils/search_session_cache.py
-import json
+import asyncio
 import math
 import logging
-from decimal import Decimal  # 1. 引入 Decimal
+import secrets
+import string
+import time
+from collections import OrderedDict
 from typing import Any, Dict, List, Optional, Tuple
 
 import redis.asyncio as aioredis
 
 from app.config import Config
-
-
-import secrets
-import string
-
-def generate_short_ssid(length=6):
-    # 生成包含大寫字母與數字的隨機碼 (例如: A7B2X9)
-    alphabet = string.ascii_uppercase + string.digits
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
-
-
-# 2. 定義自定義 Encoder 處理 Decimal
-class DecimalEncoder(json.JSONEncoder):
-    """
-    處理 Python json 庫預設不支援 Decimal 的問題。
-    將 Decimal 轉為 float (適合座標/距離) 或 str (適合高精度金額)。
-    """
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            # 這裡建議轉為 float，因為搜尋結果多為座標或評分
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
+from app.utils.session_codec import get_session_codec
+from app.utils.local_session_cache import LocalSessionCache
+from app.utils.tracing import traced
 
 
 class SearchSessionCache:
@@ -38,17 +22,52 @@ class SearchSessionCache:
     """
 
     KEY_PREFIX = "search_session"
+    # 覆寫 Session (重新排序) 時通知其他 Worker 讓 L1 失效的頻道；訊息內容為 "<發送端 ID>:<search_ssid>"
+    INVALIDATION_CHANNEL = "search_session:invalidate"
+    # 背景寫入最終失敗的 search_ssid 最多記錄幾筆 (只需保留到 Session 本應過期為止)
+    FAILED_WRITES_MAX = 1024
 
-    def __init__(self):
-        self._pool = aioredis.ConnectionPool(
+    def __init__(self, redis_client: Optional[aioredis.Redis] = None):
+        """
+        :param redis_client: 選用的既有客戶端 (需為 decode_responses=False)；
+                             壓測時可傳入 fakeredis 等記憶體替身，正式環境不傳，依 Config 建立連線池
+        """
+        self._pool = None if redis_client is not None else aioredis.ConnectionPool(
             host=Config.REDIS_HOST,
             port=Config.REDIS_PORT,
             db=Config.REDIS_DB,
             password=Config.REDIS_PASSWORD,
-            decode_responses=True,
+            # 為什麼關閉 decode_responses：Session 改以二進位 Codec 儲存 (見 session_codec.py)，
+            # 讀回必須保留原始 bytes；舊版 JSON 字串 Session 也由 Codec 自行辨識解碼
+            decode_responses=False,
             max_connections=20
         )
-        self._redis = aioredis.Redis(connection_pool=self._pool)
+        self._redis = redis_client if redis_client is not None else aioredis.Redis(connection_pool=self._pool)
+        self._codec = get_session_codec()
+        # search_ssid -> (寫入任務, 全量結果)；寫入完成後自動移除
+        self._pending_writes: Dict[str, Tuple[asyncio.Task, List[Dict[str, Any]]]] = {}
+        self._write_stats = {"scheduled": 0, "succeeded": 0, "failed": 0, "retried": 0}
+        # search_ssid -> 記錄到期時間 (monotonic)；回應早已送出、Redis 卻沒有這筆 Session 時，讓翻頁回報真正原因而不是「已過期」
+        self._failed_writes: "OrderedDict[str, float]" = OrderedDict()
+        self._write_mode = Config.SESSION_WRITE_MODE
+        if self._write_mode == "write_behind" and Config.UVICORN_WORKERS > 1:
+            # 背景寫入的暫存只有本 Worker 看得到，其他 Worker 的翻頁會在寫入完成前回報 Session 不存在
+            logging.warning("[SessionCache] 多 Worker 部署不支援 write_behind，Session 改為同步寫入")
+            self._write_mode = "sync"
+        # Worker 內的 L1 快取 (選用)：存放已解碼的 Session，翻頁命中時不需 Redis 往返
+        self._l1: Optional[LocalSessionCache] = (
+            LocalSessionCache(max_bytes=Config.SESSION_L1_MAX_BYTES, ttl=Config.SESSION_L1_TTL)
+            if Config.SESSION_L1_ENABLED else None
+        )
+        # 辨識 L1 失效通知是否由自己發出 (自己的 L1 已直接更新，不需失效)
+        self._instance_id = secrets.token_hex(8)
+        self._invalidation_task: Optional[asyncio.Task] = None
+        logging.info(f"[SessionCache] Session 編碼格式: {self._codec.describe()}")
+
+    @property
+    def redis(self) -> aioredis.Redis:
+        """共用的 Redis 客戶端 (bytes 模式)，供其他快取層重用同一個連線池。"""
+        return self._redis
 
     def _build_key(self, search_ssid: str) -> str:
         return f"{self.KEY_PREFIX}:{search_ssid}"
@@ -61,6 +80,7 @@ class SearchSessionCache:
     # ── 公開 API ──────────────────────────────────────────────────
 
     
+    @traced("session_cache.create_session")
     async def create_session_and_get_first_page(
         self, 
         all_results: List[Dict[str, Any]], 
@@ -69,38 +89,112 @@ class SearchSessionCache:
         """
         [統一封裝門面] 
         1. 生成 6 碼隨機 SSID
-        2. 將全量資料存入 Redis (處理過 Decimal)
-        3. 立即切出第 1 頁並回傳
+        2. 直接從記憶體中的全量資料切出第 1 頁與分頁元數據
+        3. 將全量資料寫入 Redis (write_behind 模式下移出回應的關鍵路徑)
         
+        為什麼不再 save() 後 get_page()：
+        舊流程在 SET 完整包資料後，立刻又 GET + 反序列化同一包資料，只為了取回手上早就有的第 1 頁，
+        等於每次搜尋多付一次 Redis 往返與一次完整解碼。
+
         回傳: (search_ssid, first_page_results, pagination_meta)
         """
         # 1. 生成 SSID
         search_ssid = self._generate_short_ssid(6)
         
-        # 2. 存入 Redis (利用類別內已有的 save 邏輯)
-        await self.save(search_ssid, all_results)
-        
-        # 3. 取得第 1 頁 (利用類別內已有的 get_page 邏輯)
-        page_results, pagination_meta = await self.get_page(
-            search_ssid, page=1, page_size=page_size
-        )
+        # 2. 本地切頁 (與 get_page 共用同一套分頁邏輯，保證格式一致)
+        page_results, pagination_meta = self._slice_page(search_ssid, all_results, page=1, page_size=page_size)
+
+        # 3. 寫入 Redis
+        if self._write_mode == "write_behind":
+            self._schedule_write_behind(search_ssid, all_results)
+        else:
+            await self.save(search_ssid, all_results)
+            self._put_l1(search_ssid, all_results)
         
         return search_ssid, page_results, pagination_meta
 
-    # ── 以下原始方法保持不變，但可被內部調用 ──────────────────────────────
+    # ── Write-Behind 寫入管理 ─────────────────────────────────────────
 
-    async def save(self, search_ssid: str, all_results: List[Dict[str, Any]], ttl: int = None) -> None:
-        effective_ttl = ttl if ttl is not None else Config.SEARCH_SESSION_TTL
-        key = self._build_key(search_ssid)
+    def _schedule_write_behind(self, search_ssid: str, all_results: List[Dict[str, Any]]) -> None:
+        """
+        建立背景寫入任務，並把資料暫存在 _pending_writes。
+        在寫入完成前，同一個 Worker 的翻頁請求會直接從暫存讀取，避免「剛建立的 Session 查不到」的競態。
+        """
+        task = asyncio.create_task(self._write_behind(search_ssid, all_results))
+        self._pending_writes[search_ssid] = (task, all_results)
+        self._write_stats["scheduled"] += 1
+
+    async def _write_behind(self, search_ssid: str, all_results: List[Dict[str, Any]]) -> None:
+        """
+        受監督的背景寫入：失敗時重試一次，最終失敗則記入錯誤計數。
+        為什麼不把例外往上拋：此時回應早已送出，拋出只會變成無人處理的 Task exception。
+        """
         try:
-            serialized = json.dumps(all_results, ensure_ascii=False, cls=DecimalEncoder)
-            await self._redis.set(key, serialized, ex=effective_ttl)
-            logging.info(f"[SessionCache] 已儲存 Session '{search_ssid}'，共 {len(all_results)} 筆")
-        except Exception as e:
-            logging.error(f"[SessionCache] 儲存失敗: {e}")
-            raise
-        
+            for attempt in range(1, Config.SESSION_WRITE_RETRIES + 2):
+                try:
+                    await self.save(search_ssid, all_results)
+                    self._write_stats["succeeded"] += 1
+                    # 寫入成功後才放入 L1，確保 L1 中的 Session 在 Redis 也一定存在
+                    self._put_l1(search_ssid, all_results)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if attempt > Config.SESSION_WRITE_RETRIES:
+                        self._write_stats["failed"] += 1
+                        self._record_failed_write(search_ssid)
+                        logging.error(f"[SessionCache] Session '{search_ssid}' 背景寫入最終失敗 (已重試 {attempt - 1} 次): {e}")
+                        return
+                    self._write_stats["retried"] += 1
+                    await asyncio.sleep(0.05 * attempt)
+        finally:
+            self._pending_writes.pop(search_ssid, None)
 
+    def _record_failed_write(self, search_ssid: str) -> None:
+        self._failed_writes[search_ssid] = time.monotonic() + Config.SEARCH_SESSION_TTL
+        self._failed_writes.move_to_end(search_ssid)
+        while len(self._failed_writes) > self.FAILED_WRITES_MAX:
+            self._failed_writes.popitem(last=False)
+
+    def write_failed(self, search_ssid: str) -> bool:
+        """此 search_ssid 是否因背景寫入最終失敗而從未存入 Redis (僅限本 Worker 建立的 Session)。"""
+        expires_at = self._failed_writes.get(search_ssid)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del self._failed_writes[search_ssid]
+            return False
+        return True
+
+    async def drain(self, timeout: float = 5.0) -> None:
+        """等待所有尚未完成的背景寫入 (服務關閉前呼叫，避免最後幾筆 Session 遺失)。"""
+        tasks = [task for task, _ in self._pending_writes.values()]
+        if not tasks:
+            return
+        logging.info(f"[SessionCache] 等待 {len(tasks)} 筆背景寫入完成...")
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logging.warning(f"[SessionCache] 仍有 {len(pending)} 筆背景寫入未在 {timeout}s 內完成")
+
+    def stats(self) -> Dict[str, Any]:
+        """背景寫入與 L1 快取統計，供監控與除錯使用。"""
+        return {
+            "write_behind": {
+                **self._write_stats,
+                "mode": self._write_mode,
+                "pending": len(self._pending_writes),
+                "failed_tracked": len(self._failed_writes),
+            },
+            "l1": self._l1.stats() if self._l1 is not None else None,
+        }
+
+    def _put_l1(self, search_ssid: str, all_results: List[Dict[str, Any]], ttl: float = None) -> None:
+        if self._l1 is not None:
+            self._l1.put(search_ssid, all_results, ttl=ttl)
+
+    # ── 以下原始方法保持不變，但可被內部調用 ──────────────────────────────
+
+    @traced("session_cache.save")
     async def save(
         self,
         search_ssid: str,
@@ -114,21 +208,18 @@ class SearchSessionCache:
         key = self._build_key(search_ssid)
 
         try:
-            # 3. 在這裡傳入 cls=DecimalEncoder
-            serialized = json.dumps(
-                all_results, 
-                ensure_ascii=False, 
-                cls=DecimalEncoder
-            )
+            # 由 Codec 負責 Decimal / NumPy 型別轉換、序列化與門檻式壓縮
+            serialized = self._codec.encode(all_results)
             await self._redis.set(key, serialized, ex=effective_ttl)
             logging.info(
                 f"[SessionCache] 已儲存 Session '{search_ssid}'，"
-                f"共 {len(all_results)} 筆，TTL={effective_ttl}s"
+                f"共 {len(all_results)} 筆，{len(serialized)} bytes，TTL={effective_ttl}s"
             )
         except Exception as e:
             logging.error(f"[SessionCache] 儲存 Session '{search_ssid}' 失敗: {e}")
             raise
 
+    @traced("session_cache.get_page")
     async def get_page(
         self,
         search_ssid: str,
@@ -137,22 +228,125 @@ class SearchSessionCache:
     ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
         """
         從 Redis 取出指定頁的店家資料，同時回傳分頁元數據。
+        Session 不存在或已過期時回傳 ([], {"error": "session_expired"})，
+        背景寫入最終失敗 (Session 從未存入) 時回傳 ([], {"error": "session_write_failed"})；
+        呼叫端不需要再額外呼叫 exists()，一次往返即可同時判斷存活與取得資料。
         """
-        effective_size = page_size if page_size is not None else Config.PAGE_SIZE
+        all_results = await self.get_results(search_ssid)
+        if all_results is None:
+            if self.write_failed(search_ssid):
+                logging.warning(f"[SessionCache] Session '{search_ssid}' 背景寫入失敗，從未存入 Redis")
+                return [], {"error": "session_write_failed"}
+            logging.warning(f"[SessionCache] Session '{search_ssid}' 不存在或已過期")
+            return [], {"error": "session_expired"}
+        return self._slice_page(search_ssid, all_results, page=page, page_size=page_size)
+
+    async def get_results(self, search_ssid: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        取得 Session 的全量排序結果 (背景寫入暫存 → L1 → Redis)；不存在或已過期時回傳 None。
+        回傳的 list 與其中的 dict 可能同時被 L1 / 背景寫入引用，呼叫端不可就地修改。
+        """
+        pending = self._pending_writes.get(search_ssid)
+        if pending is not None:
+            # 背景寫入尚未完成：直接使用記憶體中的同一份資料
+            return pending[1]
+
+        if self._l1 is not None:
+            cached = self._l1.get(search_ssid)
+            if cached is not None:
+                return cached
+
         key = self._build_key(search_ssid)
 
         try:
-            raw = await self._redis.get(key)
+            # 以 pipeline 一次取回資料與剩餘存活時間 (同一次往返)，
+            # 讓 L1 的到期時間與 Redis 對齊，不會比 Redis 活得更久
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.pttl(key)
+                raw, pttl_ms = await pipe.execute()
         except Exception as e:
             logging.error(f"[SessionCache] 讀取 Session '{search_ssid}' 失敗: {e}")
             raise
 
         if raw is None:
-            logging.warning(f"[SessionCache] Session '{search_ssid}' 不存在或已過期")
-            return [], {"error": "session_expired"}
+            return None
 
-        # json.loads 不需要特別處理，因為讀回來的已經是 JSON 格式中的 number/string
-        all_results: List[Dict] = json.loads(raw)
+        # Codec 依資料標頭自動判斷格式 (含升級前的舊版 JSON Session)
+        all_results: List[Dict] = self._codec.decode(raw)
+        if pttl_ms and pttl_ms > 0:
+            self._put_l1(search_ssid, all_results, ttl=pttl_ms / 1000)
+        return all_results
+
+    @traced("session_cache.replace")
+    async def replace_session_and_get_first_page(
+        self,
+        search_ssid: str,
+        all_results: List[Dict[str, Any]],
+        page_size: int = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        以新內容覆寫既有 Session (重新排序)，TTL 重新計算，並通知所有 Worker 讓該筆 L1 失效。
+        回傳: (第 1 頁結果, 分頁元數據)，與 create_session_and_get_first_page 相同由記憶體切頁
+        為什麼要廣播：L1 假設 Session 寫入後不再改變；其他 Worker 的 L1 若仍持有舊順序，
+        翻頁會在 SESSION_L1_TTL 內讀到舊的排序。
+        """
+        pending = self._pending_writes.get(search_ssid)
+        if pending is not None:
+            # 先等原本的背景寫入完成，避免它晚一步把舊順序寫回 Redis
+            await asyncio.wait({pending[0]})
+
+        await self.save(search_ssid, all_results)
+        self._put_l1(search_ssid, all_results)
+
+        if self._l1 is not None:
+            try:
+                await self._redis.publish(self.INVALIDATION_CHANNEL, f"{self._instance_id}:{search_ssid}")
+            except Exception as e:
+                # 通知失敗時其他 Worker 最多在 SESSION_L1_TTL 內讀到舊順序，不影響本次結果
+                logging.warning(f"[SessionCache] L1 失效通知發送失敗 ({search_ssid}): {e}")
+
+        return self._slice_page(search_ssid, all_results, page=1, page_size=page_size)
+
+    def start_invalidation_listener(self) -> None:
+        """訂閱其他 Worker 的 L1 失效通知 (未啟用 L1 時不需要)；Redis 就緒後呼叫一次。"""
+        if self._l1 is None or self._invalidation_task is not None:
+            return
+        self._invalidation_task = asyncio.create_task(self._listen_invalidations())
+
+    async def _listen_invalidations(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    origin, _, search_ssid = message["data"].decode("utf-8", "replace").partition(":")
+                    if origin != self._instance_id:
+                        self._l1.invalidate(search_ssid)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 斷線期間可能漏掉通知，整個 L1 清空最保險 (之後的翻頁回到 Redis 讀取)
+                logging.warning(f"[SessionCache] L1 失效訂閱中斷，清空 L1 後重新訂閱: {e}")
+                self._l1.clear()
+                await asyncio.sleep(1.0)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+
+    def _slice_page(
+        self,
+        search_ssid: str,
+        all_results: List[Dict[str, Any]],
+        page: int,
+        page_size: int = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """依頁碼切出結果並組裝分頁元數據 (純記憶體運算，不觸及 Redis)。"""
+        effective_size = page_size if page_size is not None else Config.PAGE_SIZE
         total_results = len(all_results)
         total_pages = math.ceil(total_results / effective_size) if total_results > 0 else 0
 
@@ -181,7 +375,12 @@ class SearchSessionCache:
         )
         return page_results, meta
 
+    @traced("session_cache.exists")
     async def exists(self, search_ssid: str) -> bool:
+        if search_ssid in self._pending_writes:
+            return True
+        if self._l1 is not None and self._l1.get(search_ssid) is not None:
+            return True
         key = self._build_key(search_ssid)
         try:
             return bool(await self._redis.exists(key))
@@ -189,8 +388,11 @@ class SearchSessionCache:
             logging.error(f"[SessionCache] 檢查 Session '{search_ssid}' 存活失敗: {e}")
             return False
 
+    @traced("session_cache.delete")
     async def delete(self, search_ssid: str) -> None:
         key = self._build_key(search_ssid)
+        if self._l1 is not None:
+            self._l1.invalidate(search_ssid)
         try:
             await self._redis.delete(key)
             logging.info(f"[SessionCache] 已手動刪除 Session '{search_ssid}'")
@@ -199,5 +401,8 @@ class SearchSessionCache:
             raise
 
     async def close(self) -> None:
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+        await self.drain()
         await self._redis.aclose()
         logging.info("[SessionCache] Redis 連線池已關閉")
\ No newline at end of file
@@ -0,0 +1,224 @@
+# app/utils/session_codec.py
+"""
+搜尋 Session 的序列化編解碼器 (Codec)
+
+為什麼要獨立成模組：
+    SearchSessionCache 原本以 json.dumps(ensure_ascii=False) 存入整包排序結果，
+    每筆店家帶有中文 review_summary、10 張照片 URL 與巢狀 score_analysis，
+    在 600 秒 TTL 內 Redis 記憶體是最先撞到的擴展瓶頸。
+    將「序列化格式」與「壓縮演算法」抽成可插拔元件，方便依部署環境切換並用 benchmark 比較。
+
+儲存格式 (v1 Envelope)：
+    ┌────────┬─────────┬──────────┬─────────────┬─────────┐
+    │ MAGIC  │ VERSION │ CODEC_ID │ COMPRESS_ID │ PAYLOAD │
+    │ 2 byte │ 1 byte  │ 1 byte   │ 1 byte      │ ...     │
+    └────────┴─────────┴──────────┴─────────────┴─────────┘
+    • MAGIC 以 0xFF 開頭：合法的 UTF-8 JSON 絕不會以 0xFF 開頭，
+      因此舊版純 JSON 字串 (Legacy) 與新版二進位格式可以零歧義地區分。
+    • 每一筆資料自帶 codec / 壓縮方式，讀取端不需知道寫入當下的 Config，
+      切換設定後舊 Session 仍可正常解碼，直到 TTL 自然過期。
+"""
+import json
+import zlib
+from decimal import Decimal
+from typing import Any, Callable, Dict, Tuple, Union
+
+from app.config import Config
+from app.utils.app_logger import logger
+
+# ── 選用依賴 (Optional Dependencies) ─────────────────────────────────
+# 為什麼不直接 import：這些套件屬於效能優化，缺少時應自動退回標準庫實作，而非讓服務無法啟動
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+MAGIC = b"\xffS"
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 3
+
+CODEC_IDS = {"json": 1, "orjson": 2, "msgpack": 3}
+COMPRESSION_IDS = {"none": 0, "zlib": 1, "zstd": 2, "lz4": 3}
+_CODEC_NAMES = {v: k for k, v in CODEC_IDS.items()}
+_COMPRESSION_NAMES = {v: k for k, v in COMPRESSION_IDS.items()}
+
+
+def default_serializer(obj: Any) -> Any:
+    """
+    處理標準序列化器不支援的型別。
+    • Decimal：MySQL DECIMAL 欄位 (rating、座標) 轉為 float，與原本 DecimalEncoder 行為一致
+    • NumPy 純量：排序階段產生的 np.float64 等型別，透過 .item() 轉回 Python 原生型別
+    """
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, "item") and callable(obj.item):
+        return obj.item()
+    raise TypeError(f"Type is not serializable: {type(obj).__name__}")
+
+
+class _JsonDefaultEncoder(json.JSONEncoder):
+    def default(self, obj):
+        try:
+            return default_serializer(obj)
+        except TypeError:
+            return super().default(obj)
+
+
+# ── 序列化器 (Codec) ────────────────────────────────────────────────
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), cls=_JsonDefaultEncoder).encode("utf-8")
+
+
+def _json_loads(data: bytes) -> Any:
+    return json.loads(data)
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=default_serializer, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def _orjson_loads(data: bytes) -> Any:
+    return orjson.loads(data)
+
+
+def _msgpack_dumps(obj: Any) -> bytes:
+    return msgpack.packb(obj, default=default_serializer, use_bin_type=True)
+
+
+def _msgpack_loads(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+def _available_codecs() -> Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]]:
+    codecs = {"json": (_json_dumps, _json_loads)}
+    if orjson is not None:
+        codecs["orjson"] = (_orjson_dumps, _orjson_loads)
+    if msgpack is not None:
+        codecs["msgpack"] = (_msgpack_dumps, _msgpack_loads)
+    return codecs
+
+
+# ── 壓縮器 (Compression) ───────────────────────────────────────────
+
+def _available_compressors(level: int) -> Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]]:
+    compressors = {
+        "none": (lambda b: b, lambda b: b),
+        # zlib 屬於標準庫，作為任何環境都可用的保底選項
+        "zlib": (lambda b: zlib.compress(b, level if 0 < level <= 9 else 6), zlib.decompress),
+    }
+    if zstandard is not None:
+        # 為什麼每次新建 Compressor：zstd 的 (De)Compressor 物件並非執行緒安全，
+        # 建立成本僅數微秒，遠低於共用物件加鎖的風險
+        compressors["zstd"] = (
+            lambda b: zstandard.ZstdCompressor(level=level).compress(b),
+            lambda b: zstandard.ZstdDecompressor().decompress(b),
+        )
+    if lz4_frame is not None:
+        compressors["lz4"] = (
+            lambda b: lz4_frame.compress(b, compression_level=level),
+            lz4_frame.decompress,
+        )
+    return compressors
+
+
+class SessionCodec:
+    """
+    可插拔的 Session 編解碼器。
+
+    :param codec:              序列化格式 (json / orjson / msgpack)
+    :param compression:        壓縮演算法 (none / zlib / zstd / lz4)
+    :param compress_threshold: 序列化後大於此位元組數才壓縮；小 payload 壓縮反而更大且浪費 CPU
+    :param level:              壓縮等級
+    """
+
+    def __init__(
+        self,
+        codec: str = "json",
+        compression: str = "none",
+        compress_threshold: int = 2048,
+        level: int = 3
+    ):
+        self._codecs = _available_codecs()
+        self._compressors = _available_compressors(level)
+
+        if codec not in self._codecs:
+            logger.warning(f"[SessionCodec] 序列化格式 '{codec}' 不可用 (套件未安裝或名稱錯誤)，退回 json")
+            codec = "json"
+        if compression not in self._compressors:
+            logger.warning(f"[SessionCodec] 壓縮演算法 '{compression}' 不可用，退回 none")
+            compression = "none"
+
+        self.codec = codec
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+
+    def describe(self) -> str:
+        return f"{self.codec}+{self.compression}(>{self.compress_threshold}B)"
+
+    def encode(self, obj: Any) -> bytes:
+        """將物件編碼為帶版本標頭的位元組串。"""
+        dumps, _ = self._codecs[self.codec]
+        payload = dumps(obj)
+
+        compression = "none"
+        if self.compression != "none" and len(payload) > self.compress_threshold:
+            compress, _ = self._compressors[self.compression]
+            payload = compress(payload)
+            compression = self.compression
+
+        header = MAGIC + bytes((FORMAT_VERSION, CODEC_IDS[self.codec], COMPRESSION_IDS[compression]))
+        return header + payload
+
+    def decode(self, blob: Union[bytes, str]) -> Any:
+        """
+        解碼 Redis 讀回的資料。
+        不依賴目前的 Config：以資料本身的標頭決定解碼方式，確保切換設定後舊 Session 仍可讀取。
+        """
+        if isinstance(blob, str):
+            return json.loads(blob)
+
+        if not blob.startswith(MAGIC):
+            # Legacy：升級前以 json.dumps 寫入的純文字 Session
+            return json.loads(blob)
+
+        version, codec_id, compression_id = blob[len(MAGIC):HEADER_SIZE]
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported session format version: {version}")
+
+        codec_name = _CODEC_NAMES.get(codec_id)
+        compression_name = _COMPRESSION_NAMES.get(compression_id)
+        if codec_name not in self._codecs:
+            raise ValueError(f"Session codec '{codec_name}' is not available in this worker")
+        if compression_name not in self._compressors:
+            raise ValueError(f"Session compression '{compression_name}' is not available in this worker")
+
+        _, decompress = self._compressors[compression_name]
+        _, loads = self._codecs[codec_name]
+        return loads(decompress(blob[HEADER_SIZE:]))
+
+
+def get_session_codec() -> SessionCodec:
+    """依 Config 建立 Session Codec。"""
+    return SessionCodec(
+        codec=Config.SESSION_CODEC,
+        compression=Config.SESSION_COMPRESSION,
+        compress_threshold=Config.SESSION_COMPRESS_THRESHOLD,
+        level=Config.SESSION_COMPRESS_LEVEL
+    )
@@ -0,0 +1,85 @@
+# app/utils/single_flight.py
+"""
+Single-Flight：合併「同時進行」的相同計算
+
+為什麼需要：
+    尖峰時段 (例如許多聊天使用者同時問同一個熱門問題) 會有多個相同意圖的 /place_search 幾乎同時抵達。
+    意圖結果快取只能擋下「之後」的重複請求；在第一筆尚未算完前抵達的請求仍會各自跑一次 SQL、Embedding 與 Qdrant。
+    Single-Flight 讓同一個 key 在任一時刻只有一個計算在執行，其餘請求等待並共用同一份結果。
+
+與快取的差異：
+    計算完成後立即從 in-flight 表移除，不保留結果；因此不會提供過期資料，只會「攤平」同一瞬間的重複負載。
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.utils.app_logger import logger
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._stats = {"leaders": 0, "coalesced": 0, "abandoned": 0}
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        join: Optional[Callable[[Awaitable[Any]], Awaitable[Any]]] = None
+    ) -> Tuple[Any, bool]:
+        """
+        執行 (或加入) key 對應的計算。
+
+        :param join: 只套用在「加入」他人計算的等待上 (例如以自己的截止時間包住等待)；
+                     發起者不套用，它的計算本身已在自己的請求範圍內執行
+        :return: (結果, 是否為共用他人的計算結果)
+
+        為什麼把計算包成獨立 Task 並以 shield 等待：
+        若發起計算的請求被取消 (例如用戶端斷線)，其他仍在等待的請求不應跟著失敗；
+        只有當「所有」等待者都離開時，才真正取消底層計算，釋放資源。
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+
+        if flight is None:
+            flight = _Flight(asyncio.create_task(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _t, k=key, f=flight: self._release(k, f))
+            self._stats["leaders"] += 1
+        else:
+            self._stats["coalesced"] += 1
+            logger.info(f"[SingleFlight] 合併進行中的相同計算 (key={key}, 等待者={flight.waiters + 1})")
+
+        flight.waiters += 1
+        try:
+            waiting = asyncio.shield(flight.task)
+            result = await (join(waiting) if shared and join is not None else waiting)
+        except BaseException:
+            # 取消或 join 逾時都算離開；計算本身失敗時 task 已結束，不受影響
+            if not flight.task.done() and flight.waiters == 1:
+                # 最後一位等待者也離開了：沒有人需要這個結果，取消底層計算
+                flight.task.cancel()
+                self._stats["abandoned"] += 1
+            raise
+        finally:
+            flight.waiters -= 1
+        return result, shared
+
+    def _release(self, key: str, flight: _Flight) -> None:
+        # 只移除自己：避免誤刪同一個 key 在之後新建立的計算
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # 取出例外，避免無人等待時出現 "Task exception was never retrieved" 警告
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._stats, "in_flight": len(self._flights)}
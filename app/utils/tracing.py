@@ -0,0 +1,362 @@
+# app/utils/tracing.py
+"""
+輕量級請求追蹤 (Contextvar-based Tracing Spans)
+
+為什麼需要：
+    原本的計時散落在 Route、HybridSQLBuilder、VectorService 內成對的 time.perf_counter()，
+    且必須把 s_id 一路手動傳遞；只能看到幾個固定階段的總和，看不出一個慢請求「到底卡在哪一段」。
+
+設計：
+    • 目前所在的 Span 存放於 contextvars：asyncio Task 建立時會複製 Context，
+      因此 asyncio.gather / create_task (例如 Single-Flight 的計算 Task) 產生的子 Span 會自動掛在正確的父節點下。
+    • 以裝飾器 @traced(...) 或 with span(...) / async with span(...) 包住要量測的區塊。
+    • 沒有進行中的 Trace 時 (離線腳本、背景工作)，span() 直接回傳共用的 no-op 物件，成本只有一次 ContextVar 讀取。
+    • 尾端取樣 (Tail-based Sampling)：請求結束後才決定是否匯出；超過 Config.TRACE_SLOW_MS 的慢請求一律匯出。
+    • 匯出透過 MetricsSink 背景寫入 (jsonl)：
+        - trace       ：每個請求一棵 Span 樹，附上關鍵路徑 (critical_path)
+        - trace_otlp  ：OTLP/JSON (resourceSpans)，可直接送入 OpenTelemetry Collector / Jaeger / Tempo
+"""
+import functools
+import inspect
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import Config
+from app.utils.metrics_sink import metrics_sink
+
+metrics_sink.register_stream("trace", Config.TRACE_LOG_PATH, output_format="jsonl")
+metrics_sink.register_stream("trace_otlp", Config.TRACE_OTLP_PATH, output_format="jsonl")
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_trace_span", default=None)
+
+# @traced 產生的包裝函式 code object；取樣分析器 (sampling_profiler) 據此從呼叫堆疊辨認所在的 Span
+_TRACED_WRAPPER_CODES = set()
+
+
+class Trace:
+    """單一請求的追蹤資料 (所有 Span 共用)。"""
+
+    __slots__ = ("trace_id", "root", "span_count", "finished", "force_export")
+
+    def __init__(self, force_export: bool = False):
+        self.trace_id = os.urandom(16).hex()
+        self.root: Optional[Span] = None
+        self.span_count = 0
+        self.finished = False
+        self.force_export = force_export
+
+
+class Span:
+    __slots__ = (
+        "name", "trace", "span_id", "parent", "attributes", "children",
+        "start_unix_ns", "start_perf_ns", "duration_ns", "error",
+    )
+
+    def __init__(self, name: str, trace: Trace, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.attributes = attributes
+        self.children: List[Span] = []
+        self.start_unix_ns = time.time_ns()
+        self.start_perf_ns = time.perf_counter_ns()
+        self.duration_ns: Optional[int] = None
+        self.error: Optional[str] = None
+        trace.span_count += 1
+        if parent is not None:
+            parent.children.append(self)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def finish(self, exc: Optional[BaseException] = None) -> None:
+        if self.duration_ns is not None:
+            return
+        self.duration_ns = time.perf_counter_ns() - self.start_perf_ns
+        if exc is not None:
+            self.error = f"{type(exc).__name__}: {exc}"
+
+    @property
+    def end_unix_ns(self) -> int:
+        return self.start_unix_ns + (self.duration_ns or 0)
+
+    def to_dict(self, origin_ns: int) -> Dict[str, Any]:
+        """轉成巢狀 dict；時間以相對於 Root 起點的毫秒表示，方便肉眼閱讀。"""
+        node = {
+            "name": self.name,
+            "span_id": self.span_id,
+            "start_ms": round((self.start_unix_ns - origin_ns) / 1e6, 3),
+            "duration_ms": round((self.duration_ns or 0) / 1e6, 3),
+        }
+        if self.attributes:
+            node["attributes"] = self.attributes
+        if self.error:
+            node["error"] = self.error
+        if self.children:
+            node["children"] = [child.to_dict(origin_ns) for child in self.children]
+        return node
+
+
+class _NoopSpan:
+    """沒有進行中的 Trace 時使用的替身；同時支援 with / async with。"""
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _SpanScope:
+    """Span 的 Context Manager：進入時設為目前 Span，離開時結束計時並還原父 Span。"""
+
+    __slots__ = ("_span", "_token")
+
+    def __init__(self, span_obj: Span):
+        self._span = span_obj
+        self._token = None
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.finish(exc)
+        _current_span.reset(self._token)
+        return False
+
+    async def __aenter__(self) -> Span:
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class _TraceScope(_SpanScope):
+    """Root Span：離開時標記 Trace 結束並決定是否匯出。"""
+
+    __slots__ = ()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        trace = self._span.trace
+        trace.finished = True
+        if _should_export(trace):
+            export_trace(trace)
+        return False
+
+
+# ── 公開 API ─────────────────────────────────────────────────────────
+
+def start_trace(name: str, force_export: bool = False, **attributes) -> Any:
+    """
+    開始一個請求層級的 Trace (通常由 HTTP Middleware 呼叫)。
+    TRACE_ENABLED=false 時回傳 no-op，呼叫端不需判斷。
+    """
+    if not Config.TRACE_ENABLED:
+        return _NOOP_SPAN
+    trace = Trace(force_export=force_export)
+    root = Span(name, trace, None, attributes)
+    trace.root = root
+    return _TraceScope(root)
+
+
+def span(name: str, **attributes) -> Any:
+    """
+    建立子 Span；用法：with span("embedding.encode"): ... 或 async with span(...): ...
+    沒有進行中的 Trace、Trace 已結束 (例如 Write-Behind 背景寫入) 或超過 TRACE_MAX_SPANS 時回傳 no-op。
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    trace = parent.trace
+    if trace.finished or trace.span_count >= Config.TRACE_MAX_SPANS:
+        return _NOOP_SPAN
+    return _SpanScope(Span(name, trace, parent, attributes))
+
+
+def traced(name: Optional[str] = None, **attributes) -> Callable:
+    """
+    將函式 (同步或 async) 整段包成一個 Span。
+    :param name: Span 名稱；預設為 函式的 __qualname__
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, **attributes):
+                    return await func(*args, **kwargs)
+            _TRACED_WRAPPER_CODES.add(async_wrapper.__code__)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return func(*args, **kwargs)
+        _TRACED_WRAPPER_CODES.add(sync_wrapper.__code__)
+        return sync_wrapper
+
+    return decorator
+
+
+def annotate(**attributes) -> None:
+    """
+    在目前的 Span 加上屬性 (例如查詢筆數)；沒有 Trace 時不做任何事。
+    Root 結束後 Trace 已交給匯出執行緒序列化 (例如 Single-Flight 的共用計算在發起請求回應後才完成)，
+    此時再改動屬性 dict 會與序列化競爭，直接忽略。
+    """
+    current = _current_span.get()
+    if current is not None and not current.trace.finished:
+        current.attributes.update(attributes)
+
+
+def annotate_root(**attributes) -> None:
+    """在 Root Span 加上屬性 (例如 s_id)，讓匯出的 Trace 可以用業務識別碼搜尋。"""
+    current = _current_span.get()
+    # 與 annotate 相同：Trace 結束後不再改動 (見上)
+    if current is not None and current.trace.root is not None and not current.trace.finished:
+        current.trace.root.attributes.update(attributes)
+
+
+def current_trace_id() -> Optional[str]:
+    current = _current_span.get()
+    return current.trace.trace_id if current is not None else None
+
+
+def traced_span_name(frame) -> Optional[str]:
+    """
+    若 frame 是 @traced 的包裝函式，回傳其 Span 名稱。
+    為什麼從堆疊判斷而不讀 ContextVar：取樣分析器在另一個執行緒取樣，讀不到目標執行緒 (或 Task) 的 Context；
+    而 await 鏈上的包裝函式 frame 在協程執行期間都留在堆疊上。
+    """
+    if frame.f_code in _TRACED_WRAPPER_CODES:
+        return frame.f_locals.get("span_name")
+    return None
+
+
+# ── 匯出 ─────────────────────────────────────────────────────────────
+
+def _should_export(trace: Trace) -> bool:
+    if Config.TRACE_EXPORT not in ("json", "otlp", "both"):
+        return False
+    if trace.force_export:
+        return True
+    if (trace.root.duration_ns or 0) / 1e6 >= Config.TRACE_SLOW_MS:
+        return True
+    return random.random() < Config.TRACE_SAMPLE_RATE
+
+
+def critical_path(root: Span) -> List[Dict[str, Any]]:
+    """
+    關鍵路徑：決定 Root 何時結束的那一串 Span。
+    從父節點的結束時間往回走：挑「最晚結束」的子 Span，再從它的起點往前找下一個，依序串起；
+    gather 併行的子 Span 只會保留最後完成的那一個 (它才是真正拖住父節點的)。
+    """
+    path: List[Dict[str, Any]] = []
+
+    def walk(node: Span, depth: int) -> None:
+        path.append({
+            "name": node.name,
+            "depth": depth,
+            "duration_ms": round((node.duration_ns or 0) / 1e6, 3),
+        })
+        chain = []
+        cursor = node.end_unix_ns
+        remaining = [child for child in node.children if child.duration_ns is not None]
+        while remaining:
+            candidates = [child for child in remaining if child.end_unix_ns <= cursor]
+            if not candidates:
+                break
+            last = max(candidates, key=lambda child: child.end_unix_ns)
+            chain.append(last)
+            cursor = last.start_unix_ns
+            remaining = [child for child in candidates if child is not last]
+        for child in reversed(chain):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return path
+
+
+def trace_to_json(trace: Trace) -> Dict[str, Any]:
+    root = trace.root
+    return {
+        "trace_id": trace.trace_id,
+        "name": root.name,
+        "start_time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(root.start_unix_ns / 1e9)),
+        "duration_ms": round((root.duration_ns or 0) / 1e6, 3),
+        "span_count": trace.span_count,
+        "critical_path": critical_path(root),
+        "root": root.to_dict(root.start_unix_ns),
+    }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def trace_to_otlp(trace: Trace) -> Dict[str, Any]:
+    """轉成 OTLP/JSON (ExportTraceServiceRequest)；traceId / spanId 依規範使用 hex 字串。"""
+    spans = []
+    stack = [trace.root]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.children)
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": node.span_id,
+            "name": node.name,
+            # 1 = INTERNAL, 2 = SERVER
+            "kind": 2 if node.parent is None else 1,
+            "startTimeUnixNano": str(node.start_unix_ns),
+            "endTimeUnixNano": str(node.end_unix_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in node.attributes.items()],
+            # 1 = OK, 2 = ERROR
+            "status": {"code": 2, "message": node.error} if node.error else {"code": 1},
+        }
+        if node.parent is not None:
+            otlp_span["parentSpanId"] = node.parent.span_id
+        spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": Config.TRACE_SERVICE_NAME}},
+            ]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]
+    }
+
+
+def export_trace(trace: Trace) -> None:
+    """交給 MetricsSink 背景寫入，不在請求端做任何檔案 I/O。"""
+    if Config.TRACE_EXPORT in ("json", "both"):
+        metrics_sink.emit("trace", trace_to_json(trace))
+    if Config.TRACE_EXPORT in ("otlp", "both"):
+        metrics_sink.emit("trace_otlp", trace_to_otlp(trace))
@@ -0,0 +1,81 @@
+# benchmarks/bench_session_codec.py
+"""
+Session Codec Benchmark
+
+量測每種「序列化格式 × 壓縮演算法」組合在典型 Session 大小下的：
+    • bytes/session：實際寫入 Redis 的位元組數 (含版本標頭)
+    • encode / decode：單次編碼與解碼耗時 (毫秒，取多輪中位數)
+
+執行方式 (於專案根目錄)：
+    python -m benchmarks.bench_session_codec
+    python -m benchmarks.bench_session_codec --sizes 30 150 --repeat 50 --json
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app.utils.session_codec import SessionCodec, _available_codecs, _available_compressors
+from benchmarks.fixtures import make_ranked_results
+
+
+def _median_ms(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def run(sizes, repeat, threshold):
+    rows = []
+    codecs = list(_available_codecs().keys())
+    compressions = list(_available_compressors(3).keys())
+
+    for n in sizes:
+        results = make_ranked_results(n)
+        for codec_name in codecs:
+            for compression in compressions:
+                codec = SessionCodec(codec=codec_name, compression=compression, compress_threshold=threshold)
+                blob = codec.encode(results)
+                # 解碼結果必須與 JSON 基準一致，避免 benchmark 量到「錯誤但很快」的實作
+                assert len(codec.decode(blob)) == n
+
+                rows.append({
+                    "results": n,
+                    "codec": codec_name,
+                    "compression": compression,
+                    "bytes": len(blob),
+                    "encode_ms": round(_median_ms(lambda: codec.encode(results), repeat), 4),
+                    "decode_ms": round(_median_ms(lambda: codec.decode(blob), repeat), 4),
+                })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session payload codecs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 30, 150], help="每個 Session 的店家筆數")
+    parser.add_argument("--repeat", type=int, default=30, help="每個組合的量測輪數")
+    parser.add_argument("--threshold", type=int, default=0, help="壓縮門檻 (bytes)；預設 0 代表一律壓縮以比較壓縮率")
+    parser.add_argument("--json", action="store_true", help="輸出機器可讀的 JSON")
+    args = parser.parse_args()
+
+    rows = run(args.sizes, args.repeat, args.threshold)
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+
+    baseline = {r["results"]: r["bytes"] for r in rows if r["codec"] == "json" and r["compression"] == "none"}
+    print(f"{'rows':>5} {'codec':>8} {'compress':>8} {'bytes':>9} {'ratio':>6} {'enc ms':>8} {'dec ms':>8}")
+    for r in rows:
+        ratio = r["bytes"] / baseline[r["results"]]
+        print(
+            f"{r['results']:>5} {r['codec']:>8} {r['compression']:>8} {r['bytes']:>9} "
+            f"{ratio:>6.2f} {r['encode_ms']:>8.3f} {r['decode_ms']:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
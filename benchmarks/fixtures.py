@@ -0,0 +1,169 @@
+# benchmarks/fixtures.py
+"""
+Benchmark 共用的合成資料 (Synthetic Fixtures)
+
+為什麼使用固定亂數種子：同一份程式碼在不同時間、不同機器上要產生「完全相同」的輸入，
+benchmark 數字之間的差異才能歸因於程式碼本身，而不是資料分布改變。
+"""
+import json
+import random
+from decimal import Decimal
+from typing import Any, Dict, List
+
+SEED = 20260326
+
+_DISTRICTS = ["東區", "中西區", "北區", "南區", "安平區", "永康區", "仁德區", "歸仁區"]
+_CATEGORIES = ["拉麵", "牛肉湯", "咖啡廳", "火鍋", "早午餐", "燒肉", "甜點", "小吃"]
+_TAGS = ["內用", "冷氣", "外帶", "吃到飽", "特約停車場", "行動支付", "現金支付", "信用卡"]
+_SUMMARY_PHRASES = [
+    "湯頭濃郁鮮甜", "服務親切", "份量十足", "價格實惠", "環境乾淨明亮",
+    "排隊人潮多", "適合家庭聚餐", "停車方便", "麵條Q彈有嚼勁", "甜點精緻",
+]
+
+
+def make_ranked_results(n: int, seed: int = SEED, photos: int = 10) -> List[Dict[str, Any]]:
+    """
+    產生與 VectorService._apply_hybrid_ranking + format_response_data 輸出同構的排序結果。
+    欄位涵蓋中文摘要、照片 URL 與巢狀 score_analysis，與正式環境 Session 的內容結構一致。
+    """
+    rng = random.Random(seed)
+    results = []
+    for i in range(n):
+        place_id = 100 + i
+        store_id = str(place_id).zfill(3)
+        sim = rng.uniform(0.3, 0.9)
+        rating = round(rng.uniform(3.0, 5.0), 1)
+        results.append({
+            "id": place_id,
+            "restaurant_name": f"{rng.choice(_DISTRICTS)}{rng.choice(_CATEGORIES)}{i}號店",
+            "address": f"台南市{rng.choice(_DISTRICTS)}崑大路{rng.randint(1, 300)}號",
+            "rating": Decimal(str(rating)),
+            "phone": f"06-{rng.randint(2000000, 2999999)}",
+            "website": f"https://example.com/store/{place_id}",
+            "opening_hours": {"週一": "11:00–21:00", "週二": "11:00–21:00", "週三": "休息"},
+            "user_ratings_total": rng.randint(5, 5000),
+            "cuisine_type": rng.choice(["日式", "台式", "美式", "義式"]),
+            "merchant_category": rng.choice(_CATEGORIES),
+            "facility_tags": rng.sample(_TAGS, rng.randint(1, 5)),
+            "lat": Decimal(f"{22.99 + rng.uniform(-0.05, 0.05):.7f}"),
+            "lng": Decimal(f"{120.25 + rng.uniform(-0.05, 0.05):.7f}"),
+            "distance": f"{rng.uniform(0.1, 9.9):.2f} km",
+            "review_summary": "，".join(rng.sample(_SUMMARY_PHRASES, 5)) + "。",
+            "ranking_reason": "高度符合需求，且高分評價推薦",
+            "applied_strategy": "預設語意優先",
+            "hybrid_score": round(sim * 0.8, 4),
+            "semantic_similarity": round(sim, 4),
+            "score_analysis": {
+                "similarity": round(sim, 2),
+                "rating": round(rating / 5.0, 2),
+                "popularity": round(rng.random(), 2),
+                "distance": round(rng.random(), 2),
+            },
+            "photos": [f"http://localhost/images/{store_id}{str(p).zfill(2)}.jpg" for p in range(1, photos + 1)],
+        })
+    return results
+
+
+_CUISINES = ["日式", "台式", "美式", "義式", "韓式", "泰式"]
+_FLAG_COLUMNS = {
+    "內用": "has_dine_in",
+    "冷氣": "has_air_conditioner",
+    "外帶": "has_takeout",
+    "吃到飽": "is_all_you_can_eat",
+    "特約停車場": "has_private_parking",
+}
+
+
+def make_places(n: int, seed: int = SEED) -> List[Dict[str, Any]]:
+    """
+    產生 all_places + Place_Attributes 的合成店家資料 (壓測用)。
+    每筆同時帶有 Qdrant payload 所需的 review_summary，讓 SQL 與向量庫描述的是同一批店家。
+    """
+    rng = random.Random(seed)
+    places = []
+    for i in range(n):
+        place_id = 100 + i
+        district = rng.choice(_DISTRICTS)
+        category = rng.choice(_CATEGORIES)
+        tags = rng.sample(_TAGS, rng.randint(1, 5))
+        place = {
+            "id": place_id,
+            "name": f"{district}{category}{i}號店",
+            "address": f"台南市{district}崑大路{rng.randint(1, 300)}號",
+            "rating": round(rng.uniform(3.0, 5.0), 1),
+            "phone": f"06-{rng.randint(2000000, 2999999)}",
+            "website": f"https://example.com/store/{place_id}",
+            "opening_hours": '{"週一": "11:00–21:00", "週二": "11:00–21:00", "週三": "休息"}',
+            "user_ratings_total": rng.randint(5, 5000),
+            "lat": round(22.99 + rng.uniform(-0.05, 0.05), 7),
+            "lng": round(120.25 + rng.uniform(-0.05, 0.05), 7),
+            "cuisine_type": rng.choice(_CUISINES),
+            "merchant_category": category,
+            "facility_tags": tags,
+            "review_summary": f"{category}專賣，" + "，".join(rng.sample(_SUMMARY_PHRASES, 4)) + "。",
+        }
+        for tag, column in _FLAG_COLUMNS.items():
+            place[column] = 1 if tag in tags else 0
+        places.append(place)
+    return places
+
+
+# 邏輯樹葉節點：涵蓋 HybridSQLBuilder._recursive_parse 的每一條分支
+# (一般比較 / 強制 LIKE / Full-Text / IN 集合 / 設施旗標 / 向量欄位攔截)
+def _leaf(rng: random.Random, i: int) -> Dict[str, Any]:
+    kind = i % 6
+    if kind == 0:
+        return {"rating": {"cmp": ">=", "value": rng.choice([3.5, 4.0, 4.5])}}
+    if kind == 1:
+        return {"merchant_category": {"cmp": "=", "value": [rng.choice(_CATEGORIES)]}}
+    if kind == 2:
+        return {"address": {"cmp": "=", "value": [rng.choice(_DISTRICTS)]}}
+    if kind == 3:
+        return {"id": {"cmp": "in", "value": rng.sample(range(100, 5000), 4)}}
+    if kind == 4:
+        return {rng.choice(list(_FLAG_COLUMNS)): {"cmp": "=", "value": True}}
+    return {"food_type": {"cmp": "=", "value": [rng.choice(_CATEGORIES)]}}
+
+
+def make_logic_tree(depth: int, width: int, seed: int = SEED) -> Dict[str, Any]:
+    """
+    產生 depth 層、每層 width 個子節點的 logic_tree (葉節點數 = width ** depth)。
+    AND / OR 逐層交替，與 LLM 產出的巢狀條件同構。
+    """
+    rng = random.Random(seed)
+    counter = [0]
+
+    def build(level: int) -> Dict[str, Any]:
+        if level == depth:
+            counter[0] += 1
+            return _leaf(rng, counter[0] - 1)
+        return {
+            "op": "and" if level % 2 == 0 else "or",
+            "conditions": [build(level + 1) for _ in range(width)],
+        }
+
+    return build(0)
+
+
+def make_db_rows(n: int, seed: int = SEED) -> List[Dict[str, Any]]:
+    """
+    產生 RdbmsRepository.execute_dynamic_query 回傳的原始列 (排序與格式化之前)：
+    opening_hours / facility_tags 仍是 JSON 字串，distance 為公尺數值，與 aiomysql 回傳的型態一致。
+    """
+    rows = []
+    for place in make_places(n, seed):
+        rows.append({
+            "id": place["id"],
+            "restaurant_name": place["name"],
+            "address": place["address"],
+            "rating": Decimal(str(place["rating"])),
+            "reviews_count": place["user_ratings_total"],
+            "user_ratings_total": place["user_ratings_total"],
+            "phone": place["phone"],
+            "opening_hours": place["opening_hours"],
+            "facility_tags": json.dumps(place["facility_tags"], ensure_ascii=False),
+            "lat": Decimal(str(place["lat"])),
+            "lng": Decimal(str(place["lng"])),
+            "distance": round(random.Random(seed + place["id"]).uniform(50, 9000), 2),
+        })
+    return rows
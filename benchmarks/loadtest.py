@@ -0,0 +1,355 @@
+# benchmarks/loadtest.py
+"""
+/place_search 端對端壓測 (End-to-end Load Test)
+
+在本機以替身取代外部服務，直接對 FastAPI app (ASGI，不經網路) 送出併發請求：
+    • MySQL  → 合成資料的 SQLite 記憶體資料庫 (benchmarks/standins.py)
+    • Qdrant → qdrant_client 本機模式 location=":memory:"
+    • Redis  → fakeredis
+    • BGE-M3 → HashingEncoder (可用 --encode-ms 模擬 GPU 推論耗時)
+
+報表內容：
+    • 吞吐量 (req/s)、HTTP 狀態碼分布
+    • 各階段 (sql_service / transition / qdrant / ranking / app) 的 p50 / p95 / p99，取自回應的 Server-Timing 標頭
+    • 各意圖類型的用戶端延遲分位數與翻頁延遲
+
+執行方式 (於專案根目錄)：
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --places 5000 --concurrency 32 --requests 2000 --encode-ms 15
+    python -m benchmarks.loadtest --mix semantic_food=5,nearby_sorted=3,rating_filter=2 --repeat-ratio 0.5 --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.fixtures import SEED, _CATEGORIES, _CUISINES, _DISTRICTS, make_places
+
+# 壓測一律輸出 Server-Timing；需在匯入 app 之前設定，Config 於匯入時讀取環境變數
+os.environ.setdefault("SERVER_TIMING_ENABLED", "true")
+
+_BASE_LOCATION = (22.99, 120.25)
+_SERVER_TIMING_RE = re.compile(r"(\w+);dur=([\d.]+)")
+
+
+# ── 意圖組合 (Intent Mix) ─────────────────────────────────────────────
+
+def _semantic_food(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "main_intent": "recommend",
+        "logic_tree": {"op": "and", "conditions": [
+            {"food_type": {"cmp": "=", "value": [rng.choice(_CATEGORIES)]}},
+            {"cuisine_type": {"cmp": "=", "value": [rng.choice(_CUISINES)]}},
+        ]},
+    }
+
+
+def _rating_filter(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "main_intent": "query",
+        "info_needed": ["phone", "opening_hours"],
+        "sort_conditions": [{"field": "rating", "method": "DESC"}],
+        "logic_tree": {"op": "and", "conditions": [
+            {"rating": {"cmp": ">=", "value": rng.choice([3.5, 4.0, 4.5])}},
+        ]},
+    }
+
+
+def _nearby_sorted(rng: random.Random) -> Dict[str, Any]:
+    lat, lng = _BASE_LOCATION
+    return {
+        "main_intent": "query",
+        "info_needed": ["distance", "photos"],
+        "user_location": {"lat": lat + rng.uniform(-0.03, 0.03), "lng": lng + rng.uniform(-0.03, 0.03)},
+        "sort_conditions": [{"field": "distance", "method": "ASC"}],
+        "logic_tree": {"op": "and", "conditions": [
+            {"merchant_category": {"cmp": "LIKE", "value": [rng.choice(_CATEGORIES)]}},
+        ]},
+    }
+
+
+def _facility_tags(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "main_intent": "query",
+        "info_needed": ["facility_tags"],
+        "logic_tree": {"op": "and", "conditions": [
+            {"service_tags": {"cmp": "=", "value": rng.sample(["有冷氣", "停車", "可外帶", "氣氛好", "適合聚餐"], 2)}},
+            {"food_type": {"cmp": "=", "value": [rng.choice(_CATEGORIES)]}},
+        ]},
+    }
+
+
+def _address_fulltext(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "main_intent": "query",
+        "sort_conditions": [{"field": "rating", "method": "DESC"}],
+        "logic_tree": {"op": "and", "conditions": [
+            {"address": {"cmp": "=", "value": [rng.choice(_DISTRICTS)]}},
+        ]},
+    }
+
+
+INTENT_BUILDERS: Dict[str, Callable[[random.Random], Dict[str, Any]]] = {
+    "semantic_food": _semantic_food,
+    "rating_filter": _rating_filter,
+    "nearby_sorted": _nearby_sorted,
+    "facility_tags": _facility_tags,
+    "address_fulltext": _address_fulltext,
+}
+DEFAULT_MIX = "semantic_food=4,rating_filter=2,nearby_sorted=2,facility_tags=1,address_fulltext=1"
+
+
+def parse_mix(raw: str) -> List[Tuple[str, float]]:
+    mix = []
+    for item in raw.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in INTENT_BUILDERS:
+            raise SystemExit(f"未知的意圖類型 '{name}'，可用：{', '.join(INTENT_BUILDERS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+class IntentGenerator:
+    """
+    依權重產生請求內容。
+    :param repeat_ratio: 重送先前意圖的比例；用來模擬正式流量中的熱門查詢 (意圖快取 / Single-Flight 的命中來源)
+    """
+
+    def __init__(self, mix: List[Tuple[str, float]], repeat_ratio: float, seed: int):
+        self.names = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.repeat_ratio = repeat_ratio
+        self.rng = random.Random(seed)
+        self.history: List[Tuple[str, Dict[str, Any]]] = []
+        self.counter = 0
+
+    def next(self) -> Tuple[str, Dict[str, Any]]:
+        self.counter += 1
+        if self.history and self.rng.random() < self.repeat_ratio:
+            name, body = self.rng.choice(self.history)
+        else:
+            name = self.rng.choices(self.names, weights=self.weights)[0]
+            body = INTENT_BUILDERS[name](self.rng)
+            if len(self.history) < 256:
+                self.history.append((name, body))
+        return name, {**body, "s_id": f"loadtest-{self.counter}"}
+
+
+# ── 建立 App 與替身 ───────────────────────────────────────────────────
+
+async def build_app(args):
+    """比照 app/__init__.py 的 startup_event 組裝單例，但改用本機替身 (ASGITransport 不會觸發 startup)。"""
+    from fakeredis.aioredis import FakeRedis
+    from qdrant_client import AsyncQdrantClient
+
+    from app import app
+    from app.config import Config
+    from app.repository.vector_repository import VectorRepository
+    from app.services.hybrid_SQL_builder_service_v2 import HybridSQLBuilder
+    from app.services.search_pipeline_service import SearchPipelineService
+    from app.services.vector_service import VectorService
+    from app.utils.intent_result_cache import GeoCandidateCache, IntentResultCache
+    from app.utils.search_session_cache import SearchSessionCache
+    from app.utils.single_flight import SingleFlight
+    from benchmarks.standins import HashingEncoder, SqliteRdbmsRepository, seed_qdrant
+
+    places = make_places(args.places, seed=args.seed)
+
+    rdbms_repo = SqliteRdbmsRepository(name=f"loadtest_{os.getpid()}")
+    rdbms_repo.seed(places)
+
+    encoder = HashingEncoder(latency_ms=args.encode_ms)
+    qdrant = AsyncQdrantClient(location=":memory:")
+    collection_name = "loadtest_places"
+    await seed_qdrant(qdrant, collection_name, places, encoder)
+
+    app.state.builder = HybridSQLBuilder()
+    app.state.rdbms_repo = rdbms_repo
+    app.state.session_cache = SearchSessionCache(redis_client=FakeRedis())
+    app.state.vector_service = VectorService(
+        encoder=encoder,
+        repo=VectorRepository(client=qdrant, collection_name=collection_name),
+    )
+    app.state.intent_cache = (
+        IntentResultCache(redis_client=app.state.session_cache.redis)
+        if Config.INTENT_CACHE_ENABLED and not args.no_intent_cache else None
+    )
+    app.state.geo_cache = (
+        GeoCandidateCache(redis_client=app.state.session_cache.redis)
+        if Config.GEO_CACHE_ENABLED and not args.no_geo_cache else None
+    )
+    app.state.search_pipeline = SearchPipelineService(
+        builder=app.state.builder,
+        rdbms_repo=app.state.rdbms_repo,
+        vector_service=app.state.vector_service,
+        result_cache=app.state.intent_cache,
+        single_flight=SingleFlight() if Config.SINGLE_FLIGHT_ENABLED and not args.no_single_flight else None,
+        geo_cache=app.state.geo_cache,
+    )
+    return app
+
+
+# ── 壓測執行 ─────────────────────────────────────────────────────────
+
+class Recorder:
+    def __init__(self):
+        self.status = defaultdict(int)
+        self.stage_ms: Dict[str, List[float]] = defaultdict(list)
+        self.intent_ms: Dict[str, List[float]] = defaultdict(list)
+        self.sources = defaultdict(int)
+        self.errors: List[str] = []
+
+    def record(self, intent: str, status: int, latency_ms: float, server_timing: Optional[str]) -> None:
+        self.status[status] += 1
+        self.intent_ms[intent].append(latency_ms)
+        if not server_timing:
+            return
+        match = re.search(r'source;desc="(\w+)"', server_timing)
+        source = match.group(1) if match else "unknown"
+        self.sources[source] += 1
+        for stage, dur in _SERVER_TIMING_RE.findall(server_timing):
+            # 快取命中 / 合併的請求各階段皆為 0，只計入 app 總耗時，避免把 SQL / Qdrant 的分位數拉向 0
+            if stage == "app" or source == "executed":
+                self.stage_ms[stage].append(float(dur))
+
+
+async def _worker(client, generator: IntentGenerator, recorder: Recorder, budget: Dict[str, Any], page_follow: float):
+    rng = random.Random(id(recorder) ^ budget["next_seed"])
+    budget["next_seed"] += 1
+    while budget["remaining"] > 0 and time.perf_counter() < budget["deadline"]:
+        budget["remaining"] -= 1
+        intent, body = generator.next()
+
+        t0 = time.perf_counter()
+        try:
+            resp = await client.post("/place_search", json=body)
+        except Exception as e:
+            recorder.errors.append(f"{intent}: {e!r}")
+            recorder.status["exception"] += 1
+            continue
+        recorder.record(intent, resp.status_code, (time.perf_counter() - t0) * 1000, resp.headers.get("server-timing"))
+
+        if resp.status_code != 200 or rng.random() >= page_follow:
+            continue
+        payload = resp.json()
+        pagination = payload.get("data", {}).get("pagination", {})
+        if payload.get("search_ssid") and pagination.get("total_pages", 0) >= 2:
+            t1 = time.perf_counter()
+            page_resp = await client.get("/place_search/page", params={"search_ssid": payload["search_ssid"], "page": 2})
+            recorder.record("page", page_resp.status_code, (time.perf_counter() - t1) * 1000, None)
+
+
+async def run_load(app, args) -> Dict[str, Any]:
+    import httpx
+
+    generator = IntentGenerator(parse_mix(args.mix), args.repeat_ratio, args.seed)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+        # 暖身：讓 numpy / Qdrant 本機索引 / SQLite 連線都先初始化，避免第一批請求污染分位數
+        warm = Recorder()
+        warm_budget = {"remaining": args.warmup, "deadline": float("inf"), "next_seed": 0}
+        await asyncio.gather(*(_worker(client, generator, warm, warm_budget, 0.0) for _ in range(min(args.concurrency, 4))))
+
+        recorder = Recorder()
+        budget = {
+            "remaining": args.requests,
+            "deadline": time.perf_counter() + args.duration if args.duration else float("inf"),
+            "next_seed": 1000,
+        }
+        t_start = time.perf_counter()
+        await asyncio.gather(*(_worker(client, generator, recorder, budget, args.page_follow) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - t_start
+
+    await app.state.session_cache.close()
+    return summarize(recorder, elapsed, args)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """最近序數法 (nearest-rank)：回傳實際觀測到的值，而非內插值。"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(q / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def _distribution(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": round(_percentile(ordered, 50), 2),
+        "p95": round(_percentile(ordered, 95), 2),
+        "p99": round(_percentile(ordered, 99), 2),
+        "max": round(ordered[-1], 2) if ordered else 0.0,
+    }
+
+
+def summarize(recorder: Recorder, elapsed: float, args) -> Dict[str, Any]:
+    searches = sum(len(v) for k, v in recorder.intent_ms.items() if k != "page")
+    return {
+        "config": {
+            "places": args.places, "concurrency": args.concurrency, "mix": args.mix,
+            "repeat_ratio": args.repeat_ratio, "encode_ms": args.encode_ms,
+            "intent_cache": not args.no_intent_cache, "single_flight": not args.no_single_flight,
+            "geo_cache": not args.no_geo_cache,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(searches / elapsed, 2) if elapsed > 0 else 0.0,
+        "status": {str(k): v for k, v in sorted(recorder.status.items(), key=lambda kv: str(kv[0]))},
+        "pipeline_source": dict(recorder.sources),
+        "stages_ms": {stage: _distribution(v) for stage, v in recorder.stage_ms.items()},
+        "client_ms": {intent: _distribution(v) for intent, v in sorted(recorder.intent_ms.items())},
+        "errors": recorder.errors[:10],
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n吞吐量: {report['throughput_rps']} req/s  (耗時 {report['elapsed_s']} s)")
+    print(f"狀態碼: {report['status']}   結果來源: {report['pipeline_source']}")
+
+    header = f"{'':<18}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    for title, table in (("Server-Timing 各階段 (ms)", report["stages_ms"]), ("用戶端延遲 (ms)", report["client_ms"])):
+        print(f"\n{title}")
+        print(header)
+        for name, d in table.items():
+            print(f"{name:<18}{d['count']:>8}{d['p50']:>10}{d['p95']:>10}{d['p99']:>10}{d['max']:>10}")
+    if report["errors"]:
+        print("\n錯誤範例:", *report["errors"], sep="\n  ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test for /place_search with local stand-ins")
+    parser.add_argument("--places", type=int, default=2000, help="合成店家筆數")
+    parser.add_argument("--concurrency", type=int, default=16, help="併發用戶數")
+    parser.add_argument("--requests", type=int, default=500, help="搜尋請求總數 (不含翻頁)")
+    parser.add_argument("--duration", type=float, default=0, help="最長執行秒數；0 代表只看 --requests")
+    parser.add_argument("--warmup", type=int, default=20, help="暖身請求數 (不列入統計)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"意圖權重，例如 {DEFAULT_MIX}")
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="重送先前意圖的比例 (模擬熱門查詢)")
+    parser.add_argument("--page-follow", type=float, default=0.3, help="搜尋後接著翻到第 2 頁的比例")
+    parser.add_argument("--encode-ms", type=float, default=0.0, help="模擬每次 embedding 推論的耗時 (毫秒)")
+    parser.add_argument("--no-intent-cache", action="store_true", help="停用意圖結果快取")
+    parser.add_argument("--no-single-flight", action="store_true", help="停用 Single-Flight 合併")
+    parser.add_argument("--no-geo-cache", action="store_true", help="停用位置感知候選快取")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出報表")
+    args = parser.parse_args()
+
+    async def _main():
+        app = await build_app(args)
+        return await run_load(app, args)
+
+    report = asyncio.run(_main())
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+# benchmarks/microbench.py
+"""
+CPU 熱路徑微基準 (Microbenchmark Suite)
+
+為什麼需要：
+    loadtest 量的是整條請求，數字混入了 I/O 與排程雜訊；
+    這裡把純 CPU 的元件單獨拉出來，並對輸入規模做掃描 (scaling sweep)，
+    讓「某次改動讓 build_sql 在深層邏輯樹下慢了 40%」這種退化能以數字呈現，而不是體感。
+
+涵蓋的元件與掃描參數：
+    • builder.analyze_intent / builder.build_sql  ：logic_tree 的寬度 (width) 與深度 (depth)
+    • vector.apply_hybrid_ranking                 ：候選店家數 (candidates)
+    • vector.dynamic_threshold                    ：語意維度數 (dims)
+    • formatter.format_response_data[+photos]     ：結果筆數 (rows)，有無照片需求分開量測
+    • session.encode / session.decode             ：Session 結果筆數 (results)，使用 Config 設定的 Codec
+
+量測方式：
+    每個案例先自動決定迴圈次數 (單輪至少 --min-time 秒)，再重複 --repeat 輪，回報每次呼叫的中位數 / 最小值 (微秒)。
+    會修改輸入的函式 (format_response_data) 於計時前預先複製好每次呼叫的輸入，複製成本不計入。
+    未呼叫 setup_logging，Root Logger 維持 WARNING：INFO 日誌不輸出，但 f-string 的組字成本仍會計入，與正式環境一致。
+
+基準線 (Baseline)：
+    python -m benchmarks.microbench --save-baseline benchmarks/baseline.json
+    python -m benchmarks.microbench --baseline benchmarks/baseline.json --tolerance 0.15
+    比較時任一案例的中位數超過基準線 (1 + tolerance) 倍即視為退化，程式以 exit code 1 結束，可直接接在 CI。
+    基準線只在同一台機器、同一個 Python 版本之間有意義；metadata 不一致時會提出警告。
+
+其他用法：
+    python -m benchmarks.microbench --filter builder --repeat 11
+    python -m benchmarks.microbench --json > result.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from app.models.search_dto import VectorSearchResult
+from app.repository.vector_repository import VectorRepository
+from app.services.hybrid_SQL_builder_service_v2 import HybridSQLBuilder
+from app.services.vector_service import VectorService
+from app.utils.data_formatter import format_response_data
+from app.utils.session_codec import get_session_codec
+from benchmarks.fixtures import SEED, make_db_rows, make_logic_tree, make_ranked_results
+
+SCHEMA_VERSION = 1
+
+
+class Case:
+    """
+    單一量測案例。
+    :param prepare: 依掃描值建立輸入；回傳「產生單次呼叫參數」的函式
+    :param fresh:   函式會修改輸入時設為 True，每次呼叫前都重新產生參數
+    """
+
+    __slots__ = ("name", "param", "values", "func", "prepare", "fresh")
+
+    def __init__(self, name: str, param: str, values: List[int], func: Callable,
+                 prepare: Callable[[int], Callable[[], tuple]], fresh: bool = False):
+        self.name = name
+        self.param = param
+        self.values = values
+        self.func = func
+        self.prepare = prepare
+        self.fresh = fresh
+
+
+# ── 案例定義 ─────────────────────────────────────────────────────────
+
+def _intent(depth: int, width: int) -> Dict[str, Any]:
+    return {
+        "s_id": "bench",
+        "main_intent": "query",
+        "info_needed": ["phone", "opening_hours"],
+        "sort_conditions": [{"field": "rating", "method": "DESC"}],
+        "logic_tree": make_logic_tree(depth, width),
+    }
+
+
+def _builder_cases() -> List[Case]:
+    builder = HybridSQLBuilder()
+
+    def analyze_args(depth: int, width: int):
+        intent = _intent(depth, width)
+        return lambda: (intent,)
+
+    def build_args(depth: int, width: int):
+        plan = builder.analyze_intent(_intent(depth, width))
+        return lambda: (plan,)
+
+    return [
+        Case("builder.analyze_intent", "width", [2, 8, 32, 128], builder.analyze_intent,
+             lambda w: analyze_args(1, w)),
+        Case("builder.analyze_intent", "depth", [1, 2, 3, 4], builder.analyze_intent,
+             lambda d: analyze_args(d, 3)),
+        Case("builder.build_sql", "width", [2, 8, 32, 128], builder.build_sql,
+             lambda w: build_args(1, w)),
+        Case("builder.build_sql", "depth", [1, 2, 3, 4], builder.build_sql,
+             lambda d: build_args(d, 3)),
+    ]
+
+
+def _vector_cases() -> List[Case]:
+    # 只量排序與門檻計算，不需要模型與 Qdrant：以 __new__ 略過 __init__ 的模型載入
+    service = VectorService.__new__(VectorService)
+    service.repo = VectorRepository(client=object())
+
+    def ranking_args(n: int):
+        rng = random.Random(SEED)
+        rows = make_db_rows(n)
+        hits = [
+            VectorSearchResult(id=row["id"], score=rng.uniform(0.2, 0.9), review_summary="湯頭濃郁鮮甜，服務親切。")
+            for row in rows
+        ]
+        rng.shuffle(hits)
+        plan = {"s_id": "bench", "sort_conditions": [{"field": "rating", "method": "DESC"}]}
+        return lambda: (hits, rows, plan, 0.3)
+
+    dim_keys = ["cuisine_type", "food_type", "flavor", "service_tags"]
+
+    def threshold_args(dims: int):
+        keywords = {key: ["關鍵字"] for key in dim_keys[:dims]}
+        return lambda: (keywords, ["氣氛好"] if dims > len(dim_keys) else [])
+
+    return [
+        Case("vector.apply_hybrid_ranking", "candidates", [10, 50, 150, 500], service._apply_hybrid_ranking,
+             ranking_args),
+        Case("vector.dynamic_threshold", "dims", [0, 2, 5], service._calculate_dynamic_threshold,
+             threshold_args),
+    ]
+
+
+def _formatter_cases() -> List[Case]:
+    builder = HybridSQLBuilder()
+
+    def format_args(photos: bool):
+        def prepare(n: int):
+            intent = _intent(1, 2)
+            intent["info_needed"] = ["phone", "opening_hours", "distance"] + (["photos"] if photos else [])
+            plan = builder.analyze_intent(intent)
+            builder.build_sql(plan)
+            rows = make_db_rows(n)
+            # format_response_data 會就地改寫每一列，因此每次呼叫都給一份新的複本
+            return lambda: ([dict(row) for row in rows], plan)
+        return prepare
+
+    return [
+        Case("formatter.format_response_data", "rows", [3, 30, 150], format_response_data,
+             format_args(False), fresh=True),
+        Case("formatter.format_response_data+photos", "rows", [3, 30, 150], format_response_data,
+             format_args(True), fresh=True),
+    ]
+
+
+def _session_cases() -> List[Case]:
+    # 與 SearchSessionCache 使用同一個 Codec 設定 (SESSION_CODEC / SESSION_COMPRESSION)
+    codec = get_session_codec()
+
+    def encode_args(n: int):
+        results = make_ranked_results(n)
+        return lambda: (results,)
+
+    def decode_args(n: int):
+        blob = codec.encode(make_ranked_results(n))
+        return lambda: (blob,)
+
+    return [
+        Case("session.encode", "results", [3, 30, 150, 500], codec.encode, encode_args),
+        Case("session.decode", "results", [3, 30, 150, 500], codec.decode, decode_args),
+    ]
+
+
+def all_cases() -> List[Case]:
+    return _builder_cases() + _vector_cases() + _formatter_cases() + _session_cases()
+
+
+# ── 計時 ─────────────────────────────────────────────────────────────
+
+def _run_batch(func: Callable, arg_sets: List[tuple]) -> float:
+    t0 = time.perf_counter()
+    for args in arg_sets:
+        func(*args)
+    return time.perf_counter() - t0
+
+
+async def _run_batch_async(func: Callable, arg_sets: List[tuple]) -> float:
+    t0 = time.perf_counter()
+    for args in arg_sets:
+        await func(*args)
+    return time.perf_counter() - t0
+
+
+def _make_args(make: Callable[[], tuple], number: int, fresh: bool) -> List[tuple]:
+    if fresh:
+        return [make() for _ in range(number)]
+    args = make()
+    return [args] * number
+
+
+def measure(case: Case, value: int, repeat: int, min_time: float, loop: asyncio.AbstractEventLoop) -> Dict[str, Any]:
+    make = case.prepare(value)
+    is_async = asyncio.iscoroutinefunction(case.func)
+
+    def run(number: int) -> float:
+        arg_sets = _make_args(make, number, case.fresh)
+        if is_async:
+            # 整批呼叫在同一個 Event Loop 內執行，避免把 run_until_complete 的排程成本算進每次呼叫
+            return loop.run_until_complete(_run_batch_async(case.func, arg_sets))
+        return _run_batch(case.func, arg_sets)
+
+    # 自動決定迴圈次數 (同 timeit.autorange)：1, 2, 5, 10, 20, 50 ... 直到單輪超過 min_time
+    number, scale = 1, 1
+    run(1)  # 暖身：第一次呼叫可能觸發延遲初始化 (regex 編譯、numpy 載入等)
+    while True:
+        for base in (1, 2, 5):
+            number = base * scale
+            if run(number) >= min_time:
+                break
+        else:
+            scale *= 10
+            continue
+        break
+
+    samples = sorted(run(number) / number * 1e6 for _ in range(repeat))
+    return {
+        "case": case.name,
+        "param": case.param,
+        "value": value,
+        "number": number,
+        "median_us": round(statistics.median(samples), 3),
+        "min_us": round(samples[0], 3),
+        "stdev_us": round(statistics.stdev(samples), 3) if len(samples) > 1 else 0.0,
+    }
+
+
+def run(filter_text: Optional[str], repeat: int, min_time: float) -> List[Dict[str, Any]]:
+    loop = asyncio.new_event_loop()
+    rows = []
+    try:
+        for case in all_cases():
+            if filter_text and filter_text not in case.name:
+                continue
+            for value in case.values:
+                rows.append(measure(case, value, repeat, min_time, loop))
+                print(f"  ✓ {case.name} [{case.param}={value}]", file=sys.stderr)
+    finally:
+        loop.close()
+    return rows
+
+
+# ── 基準線 ───────────────────────────────────────────────────────────
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def build_report(rows: List[Dict[str, Any]], repeat: int, min_time: float) -> Dict[str, Any]:
+    return {
+        "schema": SCHEMA_VERSION,
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "session_codec": get_session_codec().describe(),
+            "git_commit": _git_commit(),
+            "seed": SEED,
+            "repeat": repeat,
+            "min_time": min_time,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": rows,
+    }
+
+
+def _key(row: Dict[str, Any]) -> tuple:
+    return row["case"], row["param"], row["value"]
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, noise_floor_us: float) -> List[Dict[str, Any]]:
+    """
+    逐案例比較中位數。
+    為什麼需要 noise_floor_us：個位數微秒的案例 (例如 dynamic_threshold) 受 CPU 頻率與快取影響很大，
+    相對比例容易大幅跳動；絕對差距低於門檻時不視為退化。
+    """
+    for field in ("python", "implementation", "machine", "session_codec"):
+        if report["meta"].get(field) != baseline.get("meta", {}).get(field):
+            print(
+                f"[Microbench] 警告: 基準線的 {field}={baseline.get('meta', {}).get(field)} "
+                f"與本次 {report['meta'].get(field)} 不同，比較結果僅供參考",
+                file=sys.stderr,
+            )
+
+    base_map = {_key(row): row for row in baseline.get("results", [])}
+    diffs = []
+    for row in report["results"]:
+        base = base_map.get(_key(row))
+        if base is None:
+            continue
+        ratio = row["median_us"] / base["median_us"] if base["median_us"] > 0 else 1.0
+        regressed = ratio > 1 + tolerance and row["median_us"] - base["median_us"] > noise_floor_us
+        diffs.append({**row, "baseline_us": base["median_us"], "ratio": round(ratio, 3), "regressed": regressed})
+    return diffs
+
+
+# ── 輸出 ─────────────────────────────────────────────────────────────
+
+def _print_rows(rows: List[Dict[str, Any]]) -> None:
+    print(f"{'case':<40} {'param':>12} {'median µs':>12} {'min µs':>10} {'base µs':>10} {'ratio':>7}")
+    for row in rows:
+        label = f"{row['param']}={row['value']}"
+        base = f"{row['baseline_us']:>10.2f}" if "baseline_us" in row else f"{'-':>10}"
+        ratio = f"{row['ratio']:>6.2f}{'!' if row.get('regressed') else ' '}" if "ratio" in row else f"{'-':>7}"
+        print(f"{row['case']:<40} {label:>12} {row['median_us']:>12.2f} {row['min_us']:>10.2f} {base} {ratio}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for CPU-bound search components")
+    parser.add_argument("--filter", help="只執行名稱包含此字串的案例 (例如 builder / session)")
+    parser.add_argument("--repeat", type=int, default=7, help="每個掃描點的量測輪數")
+    parser.add_argument("--min-time", type=float, default=0.05, help="單輪最短量測秒數")
+    parser.add_argument("--json", action="store_true", help="輸出機器可讀的 JSON")
+    parser.add_argument("--save-baseline", metavar="PATH", help="將本次結果寫成基準線檔案")
+    parser.add_argument("--baseline", metavar="PATH", help="與指定的基準線比較，有退化時以 exit code 1 結束")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允許的中位數增幅比例 (預設 0.15 = 15%%)")
+    parser.add_argument("--noise-floor-us", type=float, default=2.0, help="絕對差距低於此值 (微秒) 不視為退化")
+    args = parser.parse_args()
+
+    rows = run(args.filter, args.repeat, args.min_time)
+    report = build_report(rows, args.repeat, args.min_time)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[Microbench] 基準線已寫入 {args.save_baseline}", file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["comparison"] = compare(report, baseline, args.tolerance, args.noise_floor_us)
+        regressions = [row for row in report["comparison"] if row["regressed"]]
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_rows(report.get("comparison") or rows)
+        if args.baseline:
+            print(f"\n退化案例: {len(regressions)} / {len(report['comparison'])} (tolerance {args.tolerance:.0%})")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
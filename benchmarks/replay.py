@@ -0,0 +1,254 @@
+# benchmarks/replay.py
+"""
+擷取流量重播 (Deterministic Replay of Captured Traffic)
+
+讀取 app/utils/request_capture.py 產生的擷取檔 (jsonl 或 jsonl.zst，含輪替後的舊檔)，
+依原始時間間隔 (可加速 / 減速) 對目標服務重新送出 /place_search 與其後的翻頁請求，
+讓不同版本在「同一份真實工作負載」下比較延遲。
+
+重播規則：
+    • 請求依擷取時間排序；第 i 筆於 (ts_i - ts_0) / speed 秒後送出，--speed 0 代表不等待、只受 --concurrency 限制
+    • --max-gap 會壓縮過長的閒置間隔 (抽樣率低時，原始間隔多半是空等)
+    • 翻頁請求會等待對應的搜尋完成，並改用重播當下取得的新 search_ssid
+    • 報表中的 schedule lag 是「實際送出時間 - 預定時間」；若 p99 明顯偏大，代表瓶頸在重播端而非目標服務
+
+執行方式 (於專案根目錄)：
+    python -m benchmarks.replay logs/capture/requests.jsonl.zst* --target http://127.0.0.1:5003
+    python -m benchmarks.replay capture.jsonl.zst --target http://staging:5003 --speed 5 --max-gap 2 --json
+    python -m benchmarks.replay capture.jsonl.zst --local --places 5000 --speed 0 --concurrency 32
+"""
+import argparse
+import asyncio
+import glob
+import io
+import json
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from benchmarks.fixtures import SEED
+from benchmarks.loadtest import Recorder, _distribution, build_app
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+# ── 讀取擷取檔 ───────────────────────────────────────────────────────
+
+def _iter_lines(path: str) -> Iterable[str]:
+    with open(path, "rb") as f:
+        head = f.read(4)
+        f.seek(0)
+        if head == _ZSTD_MAGIC:
+            import zstandard
+            # 擷取檔由多個 zstd frame 串接而成 (每次批次寫入一個 frame)
+            reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+            yield from io.TextIOWrapper(reader, encoding="utf-8")
+        else:
+            yield from io.TextIOWrapper(f, encoding="utf-8")
+
+
+def load_capture(patterns: List[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    paths = sorted({path for pattern in patterns for path in (glob.glob(pattern) or [pattern])})
+    records, skipped = [], 0
+    for path in paths:
+        for line in _iter_lines(path):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 輪替或程序中止時最後一行可能不完整
+                skipped += 1
+                continue
+            if record.get("v") == 1 and record.get("kind") in ("search", "page"):
+                records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    if skipped:
+        print(f"[Replay] 略過 {skipped} 行無法解析的紀錄")
+    return records[:limit] if limit else records
+
+
+def build_schedule(records: List[Dict[str, Any]], speed: float, max_gap: float) -> List[float]:
+    """回傳每筆紀錄相對於重播起點的預定送出秒數。"""
+    offsets, elapsed = [], 0.0
+    for i, record in enumerate(records):
+        if i > 0:
+            gap = record["ts"] - records[i - 1]["ts"]
+            elapsed += min(gap, max_gap) if max_gap > 0 else gap
+        offsets.append(elapsed / speed if speed > 0 else 0.0)
+    return offsets
+
+
+# ── 重播 ─────────────────────────────────────────────────────────────
+
+class ReplayState:
+    def __init__(self, concurrency: int):
+        self.recorder = Recorder()
+        self.limiter = asyncio.Semaphore(concurrency)
+        self.sessions: Dict[str, asyncio.Future] = {}
+        self.lag_ms: List[float] = []
+        self.captured_ms: Dict[str, List[float]] = defaultdict(list)
+        self.skipped = defaultdict(int)
+
+    def session_future(self, captured_ssid: str) -> asyncio.Future:
+        if captured_ssid not in self.sessions:
+            self.sessions[captured_ssid] = asyncio.get_running_loop().create_future()
+        return self.sessions[captured_ssid]
+
+
+async def _replay_search(client, record: Dict[str, Any], state: ReplayState) -> None:
+    new_ssid = None
+    try:
+        t0 = time.perf_counter()
+        resp = await client.post("/place_search", json=record["payload"])
+        state.recorder.record("search", resp.status_code, (time.perf_counter() - t0) * 1000, resp.headers.get("server-timing"))
+        if resp.status_code == 200:
+            new_ssid = resp.json().get("search_ssid")
+    except Exception as e:
+        state.recorder.errors.append(f"search: {e!r}")
+        state.recorder.status["exception"] += 1
+    finally:
+        if record.get("search_ssid"):
+            future = state.session_future(record["search_ssid"])
+            if not future.done():
+                future.set_result(new_ssid)
+
+
+async def _replay_page(client, record: Dict[str, Any], state: ReplayState, session_timeout: float) -> None:
+    future = state.session_future(record["search_ssid"])
+    try:
+        new_ssid = await asyncio.wait_for(asyncio.shield(future), timeout=session_timeout)
+    except asyncio.TimeoutError:
+        new_ssid = None
+    if not new_ssid:
+        # 對應的搜尋不在重播範圍內 (例如 --limit 截斷) 或重播時失敗
+        state.skipped["page_without_session"] += 1
+        return
+    try:
+        t0 = time.perf_counter()
+        resp = await client.get("/place_search/page", params={"search_ssid": new_ssid, "page": record["page"]})
+        state.recorder.record("page", resp.status_code, (time.perf_counter() - t0) * 1000, resp.headers.get("server-timing"))
+    except Exception as e:
+        state.recorder.errors.append(f"page: {e!r}")
+        state.recorder.status["exception"] += 1
+
+
+async def _dispatch(client, record: Dict[str, Any], due: float, state: ReplayState, session_timeout: float) -> None:
+    delay = due - time.perf_counter()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    async with state.limiter:
+        state.lag_ms.append(max(time.perf_counter() - due, 0.0) * 1000)
+        state.captured_ms[record["kind"]].append(record.get("total_ms", 0.0))
+        if record["kind"] == "search":
+            await _replay_search(client, record, state)
+        else:
+            await _replay_page(client, record, state, session_timeout)
+
+
+async def replay(client, records: List[Dict[str, Any]], offsets: List[float], args) -> Dict[str, Any]:
+    state = ReplayState(args.concurrency)
+    # 先登記所有搜尋的 Future，翻頁請求可能比對應的搜尋更早被排程
+    for record in records:
+        if record["kind"] == "search" and record.get("search_ssid"):
+            state.session_future(record["search_ssid"])
+
+    t_start = time.perf_counter()
+    await asyncio.gather(*(
+        _dispatch(client, record, t_start + offset, state, args.session_timeout)
+        for record, offset in zip(records, offsets)
+    ))
+    elapsed = time.perf_counter() - t_start
+
+    recorder = state.recorder
+    searches = len(recorder.intent_ms.get("search", []))
+    return {
+        "config": {
+            "target": "local" if args.local else args.target,
+            "records": len(records), "speed": args.speed, "max_gap": args.max_gap, "concurrency": args.concurrency,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(searches / elapsed, 2) if elapsed > 0 else 0.0,
+        "status": {str(k): v for k, v in sorted(recorder.status.items(), key=lambda kv: str(kv[0]))},
+        "pipeline_source": dict(recorder.sources),
+        "stages_ms": {stage: _distribution(v) for stage, v in recorder.stage_ms.items()},
+        "client_ms": {kind: _distribution(v) for kind, v in sorted(recorder.intent_ms.items())},
+        # 擷取當下的伺服器端總耗時，作為對照 (注意：不含網路往返)
+        "captured_ms": {kind: _distribution(v) for kind, v in sorted(state.captured_ms.items())},
+        "schedule_lag_ms": _distribution(state.lag_ms),
+        "skipped": dict(state.skipped),
+        "errors": recorder.errors[:10],
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n重播 {report['config']['records']} 筆，耗時 {report['elapsed_s']} s，搜尋吞吐量 {report['throughput_rps']} req/s")
+    print(f"狀態碼: {report['status']}   結果來源: {report['pipeline_source']}   略過: {report['skipped']}")
+
+    header = f"{'':<18}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    tables = (
+        ("重播延遲 (ms)", report["client_ms"]),
+        ("擷取時的伺服器耗時 (ms)", report["captured_ms"]),
+        ("Server-Timing 各階段 (ms)", report["stages_ms"]),
+        ("排程延遲 (ms)", {"lag": report["schedule_lag_ms"]}),
+    )
+    for title, table in tables:
+        if not table:
+            continue
+        print(f"\n{title}")
+        print(header)
+        for name, d in table.items():
+            print(f"{name:<18}{d['count']:>8}{d['p50']:>10}{d['p95']:>10}{d['p99']:>10}{d['max']:>10}")
+    if report["errors"]:
+        print("\n錯誤範例:", *report["errors"], sep="\n  ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured /place_search traffic against a target instance")
+    parser.add_argument("capture", nargs="+", help="擷取檔路徑或 glob (支援 .jsonl / .jsonl.zst 與輪替後的檔案)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--target", help="目標服務的 Base URL，例如 http://127.0.0.1:5003")
+    target.add_argument("--local", action="store_true", help="改對本機替身 (同 benchmarks.loadtest) 重播")
+    parser.add_argument("--speed", type=float, default=1.0, help="重播速度倍率；2 = 兩倍速，0 = 不等待")
+    parser.add_argument("--max-gap", type=float, default=0, help="單一閒置間隔的上限秒數；0 代表不壓縮")
+    parser.add_argument("--concurrency", type=int, default=64, help="同時進行中的請求上限")
+    parser.add_argument("--limit", type=int, default=0, help="只重播前 N 筆紀錄")
+    parser.add_argument("--timeout", type=float, default=30.0, help="單一請求逾時秒數")
+    parser.add_argument("--session-timeout", type=float, default=60.0, help="翻頁請求等待對應搜尋完成的上限秒數")
+    parser.add_argument("--places", type=int, default=2000, help="--local 模式的合成店家筆數")
+    parser.add_argument("--encode-ms", type=float, default=0.0, help="--local 模式模擬 embedding 推論耗時 (毫秒)")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出報表")
+    args = parser.parse_args()
+    # build_app 需要的旗標；重播時維持正式環境預設的快取設定
+    args.no_intent_cache = args.no_single_flight = args.no_geo_cache = False
+
+    records = load_capture(args.capture, args.limit or None)
+    if not records:
+        raise SystemExit("[Replay] 擷取檔中沒有可重播的紀錄")
+    offsets = build_schedule(records, args.speed, args.max_gap)
+
+    async def _main():
+        import httpx
+
+        limits = httpx.Limits(max_connections=args.concurrency)
+        if args.local:
+            app = await build_app(args)
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=args.timeout) as client:
+                report = await replay(client, records, offsets, args)
+            await app.state.session_cache.close()
+            return report
+        async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout, limits=limits) as client:
+            return await replay(client, records, offsets, args)
+
+    report = asyncio.run(_main())
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# benchmarks/standins.py
+"""
+壓測用的本機替身 (Local Stand-ins)
+
+讓 /place_search 在筆電上就能跑完整條流程，不依賴正式環境的 MySQL / Qdrant / Redis / GPU：
+    • SqliteRdbmsRepository：RdbmsRepository 的 SQLite 方言轉接層 (記憶體資料庫)
+    • HashingEncoder       ：以字元 n-gram 雜湊產生向量，介面與 SentenceTransformer.encode 相同
+    • seed_qdrant          ：以 qdrant_client 本機模式 (location=":memory:") 建立並寫入 Collection
+    • Redis 由 fakeredis 的 FakeRedis 取代 (見 benchmarks/loadtest.py)
+
+注意：這些替身的目的是量測「本服務程式碼」的吞吐與各階段延遲分布；
+SQL 與向量庫本身的絕對耗時和正式環境不同，只適合比較部署前後的相對差異。
+"""
+import asyncio
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from qdrant_client.http import models as qmodels
+
+from app.repository.rdbms_repository import RdbmsRepository
+from app.utils.tracing import annotate, traced
+
+_PARAM_RE = re.compile(r"%\((\w+)\)s")
+_FULLTEXT_RE = re.compile(
+    r"MATCH\(([\w\.]+)\)\s+AGAINST\((:\w+)\s+IN NATURAL LANGUAGE MODE\)", re.IGNORECASE
+)
+
+_SCHEMA = """
+CREATE TABLE all_places (
+    id INTEGER PRIMARY KEY,
+    name TEXT, address TEXT, rating REAL, phone TEXT, website TEXT,
+    opening_hours TEXT, user_ratings_total INTEGER, lat REAL, lng REAL
+);
+CREATE TABLE Place_Attributes (
+    place_id INTEGER PRIMARY KEY,
+    cuisine_type TEXT, merchant_category TEXT, facility_tags TEXT,
+    has_dine_in INTEGER, has_air_conditioner INTEGER, has_takeout INTEGER,
+    is_all_you_can_eat INTEGER, has_private_parking INTEGER
+);
+CREATE INDEX idx_places_rating ON all_places (rating DESC, user_ratings_total DESC);
+"""
+
+
+def translate_mysql(sql: str) -> str:
+    """
+    把 HybridSQLBuilder 產生的 MySQL 方言轉成 SQLite 可執行的語法：
+        • %(p0)s                                → :p0
+        • MATCH(col) AGAINST(:p IN NATURAL ...) → col LIKE '%' || :p || '%'  (以子字串比對近似全文檢索)
+    Haversine 使用的 acos / cos / sin / radians 於連線建立時註冊為 SQLite 函式。
+    """
+    sql = _PARAM_RE.sub(r":\1", sql)
+    return _FULLTEXT_RE.sub(r"(\1 LIKE '%' || \2 || '%')", sql)
+
+
+def _register_math(conn: sqlite3.Connection) -> None:
+    # 浮點誤差可能讓 acos 的輸入略超過 ±1，先截斷避免回傳 NULL
+    conn.create_function("acos", 1, lambda x: math.acos(max(-1.0, min(1.0, x))), deterministic=True)
+    conn.create_function("cos", 1, math.cos, deterministic=True)
+    conn.create_function("sin", 1, math.sin, deterministic=True)
+    conn.create_function("radians", 1, math.radians, deterministic=True)
+
+
+class SqliteRdbmsRepository(RdbmsRepository):
+    """
+    以共享快取 (shared-cache) 的記憶體 SQLite 取代 MySQL。
+    查詢在 asyncio.to_thread 中執行，每個執行緒各自持有連線，模擬連線池下的併發查詢。
+    """
+
+    def __init__(self, name: str = "loadtest"):
+        super().__init__(use_mock=False)
+        self._uri = f"file:{name}?mode=memory&cache=shared"
+        self._local = threading.local()
+        # 保留一條連線直到物件釋放：記憶體資料庫在最後一條連線關閉時就會消失
+        self._keeper = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        _register_math(conn)
+        return conn
+
+    def _thread_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def seed(self, places: List[Dict[str, Any]]) -> None:
+        conn = self._keeper
+        conn.executescript(_SCHEMA)
+        conn.executemany(
+            "INSERT INTO all_places VALUES (:id, :name, :address, :rating, :phone, :website,"
+            " :opening_hours, :user_ratings_total, :lat, :lng)",
+            places,
+        )
+        conn.executemany(
+            "INSERT INTO Place_Attributes VALUES (:id, :cuisine_type, :merchant_category, :facility_tags_json,"
+            " :has_dine_in, :has_air_conditioner, :has_takeout, :is_all_you_can_eat, :has_private_parking)",
+            [{**p, "facility_tags_json": json.dumps(p["facility_tags"], ensure_ascii=False)} for p in places],
+        )
+        conn.commit()
+
+    def _query(self, sql: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        cursor = self._thread_conn().execute(translate_mysql(sql), params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    @traced("sqlite.execute_dynamic_query")
+    async def execute_dynamic_query(
+        self, sql: str, params: Dict[str, Any], s_id: str = None
+    ) -> Tuple[List[Dict[str, Any]], float]:
+        start_time = time.perf_counter()
+        records = await asyncio.to_thread(self._query, sql, params or {})
+        annotate(rows=len(records))
+        return records, time.perf_counter() - start_time
+
+    async def explain_query(
+        self, sql: str, params: Dict[str, Any], analyze: bool = False, s_id: str = None
+    ) -> Dict[str, Any]:
+        # SQLite 沒有 EXPLAIN ANALYZE，一律回傳 EXPLAIN QUERY PLAN (索引選擇)
+        start_time = time.perf_counter()
+        rows = await asyncio.to_thread(self._query, "EXPLAIN QUERY PLAN " + sql, params or {})
+        return {
+            "mode": "sqlite_query_plan",
+            "plan": [row.get("detail") for row in rows],
+            "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2),
+        }
+
+
+class HashingEncoder:
+    """
+    SentenceTransformer 的替身：字元 n-gram 特徵雜湊 (Feature Hashing) 成固定維度向量。
+    共享越多字元片段的兩段文字，餘弦相似度越高，足以讓語意門檻與混合排序走到與正式環境相同的分支。
+
+    :param latency_ms: 每次 encode 額外同步等待的毫秒數，用來模擬 GPU 推論耗時 (與正式環境相同在執行緒池中執行，受 inference 名額限制)
+    """
+
+    def __init__(self, dim: int = 384, ngram: int = 2, latency_ms: float = 0.0):
+        self.dim = dim
+        self.ngram = ngram
+        self.latency_ms = latency_ms
+
+    def _encode_one(self, text: str, normalize_embeddings: bool) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for i in range(max(len(text) - self.ngram + 1, 1)):
+            gram = text[i:i + self.ngram].encode("utf-8")
+            digest = int.from_bytes(hashlib.blake2b(gram, digest_size=8).digest(), "little")
+            vec[digest % self.dim] += 1.0 if (digest >> 63) == 0 else -1.0
+        if normalize_embeddings:
+            norm = np.linalg.norm(vec)
+            if norm > 0:
+                vec /= norm
+        return vec
+
+    def encode(self, sentences, normalize_embeddings: bool = False, **kwargs):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+        if isinstance(sentences, str):
+            return self._encode_one(sentences, normalize_embeddings)
+        return np.stack([self._encode_one(s, normalize_embeddings) for s in sentences])
+
+
+def place_document(place: Dict[str, Any]) -> str:
+    """向量化用的店家描述；句型與 VectorService 的語意查詢模板一致，讓相似度分布接近正式環境。"""
+    return (
+        f"推薦{place['cuisine_type']}風味的餐廳。我想找關於{place['merchant_category']}的店家。"
+        f"{place['review_summary']}"
+    )
+
+
+async def seed_qdrant(client, collection_name: str, places: List[Dict[str, Any]], encoder: HashingEncoder) -> None:
+    await client.create_collection(
+        collection_name=collection_name,
+        vectors_config=qmodels.VectorParams(size=encoder.dim, distance=qmodels.Distance.COSINE),
+    )
+    vectors = encoder.encode([place_document(p) for p in places], normalize_embeddings=True)
+    points = [
+        qmodels.PointStruct(
+            id=p["id"],
+            vector=vectors[i].tolist(),
+            payload={
+                "place_id": p["id"],
+                "review_summary": p["review_summary"],
+                "facility_tags": p["facility_tags"],
+                "cuisine_type": [p["cuisine_type"]],
+                "food_type": [p["merchant_category"]],
+                "flavor": [],
+            },
+        )
+        for i, p in enumerate(places)
+    ]
+    # 分批寫入，避免單次請求過大
+    for start in range(0, len(points), 500):
+        await client.upsert(collection_name=collection_name, points=points[start:start + 500])
@@ -1,7 +1,11 @@
 # run.py
 
+import atexit
 import logging
 import os
+import subprocess
+import sys
+import time
 import uvicorn
 from app.__init__ import app  # 確保你將 create_app 產出的 app 實例放在 app/main.py
 from app.config import Config
@@ -27,11 +31,48 @@ logging.info(f"Database: MySQL. Host: {Config.DB_HOST}, Database: {Config.DB_NAM
 logging.info(f"Database: Qdrant. Host: {Config.VECTOR_DB_HOST}")
 logging.info(f"Connect to Photo Service Successfully. URL:{Config.IMAGES_URL}")
 
+def start_embedding_sidecar():
+    """
+    sidecar 模式：先啟動 Embedding Sidecar 子程序，等模型載入完成 (Socket 出現) 才啟動 Worker。
+    為什麼要等：Worker 一啟動就可能收到請求，Sidecar 未就緒時語意搜尋會全部降級為純指標排序。
+    """
+    socket_path = Config.EMBEDDING_SOCKET_PATH
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    proc = subprocess.Popen([sys.executable, "-m", "app.services.embedding_sidecar"])
+    atexit.register(proc.terminate)
+
+    deadline = time.monotonic() + Config.EMBEDDING_SIDECAR_START_TIMEOUT
+    while not os.path.exists(socket_path):
+        if proc.poll() is not None:
+            raise RuntimeError(f"Embedding Sidecar 啟動失敗 (exit code {proc.returncode})")
+        if time.monotonic() > deadline:
+            proc.terminate()
+            raise RuntimeError(f"Embedding Sidecar 未在 {Config.EMBEDDING_SIDECAR_START_TIMEOUT:g} 秒內就緒")
+        time.sleep(0.5)
+    logging.info(f"Embedding Sidecar is ready (pid {proc.pid}, socket {socket_path}).")
+    return proc
+
+
 if __name__ == "__main__":
-    logging.info("Starting FastAPI server via Uvicorn...")
+    workers = max(Config.UVICORN_WORKERS, 1)
+    if Config.EMBEDDING_MODE == "sidecar":
+        if Config.EMBEDDING_SIDECAR_AUTOSTART:
+            start_embedding_sidecar()
+    elif workers > 1:
+        logging.warning(
+            f"EMBEDDING_MODE=local 且 UVICORN_WORKERS={workers}：每個 Worker 都會載入一份 BGE-M3，"
+            f"建議改用 EMBEDDING_MODE=sidecar"
+        )
+    if workers > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        logging.warning("多 Worker 模式未設定 PROMETHEUS_MULTIPROC_DIR，/metrics 只會回報處理該次抓取的 Worker")
+
+    logging.info(f"Starting FastAPI server via Uvicorn ({workers} worker(s), embedding mode: {Config.EMBEDDING_MODE})...")
     
     # 使用 uvicorn 啟動，取代原本的 app.run
     # host: 監聽地址
     # port: 埠號 (你原本設定 5004)
     # reload: 等同於 Flask 的 debug=True (僅建議開發環境使用)
-    uvicorn.run("run:app", host="0.0.0.0", port=5004, reload=False,log_level="info")
\ No newline at end of file
+    # workers: 多個 Worker 時 uvicorn 以 "run:app" 字串在各子程序重新匯入 app，每個 Worker 各自執行 startup
+    uvicorn.run("run:app", host="0.0.0.0", port=5004, reload=False, log_level="info", workers=workers)
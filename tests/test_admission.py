@@ -0,0 +1,128 @@
+# tests/test_admission.py
+import asyncio
+
+import pytest
+
+from app.utils.admission import AdmissionController, AdmissionRejected, StageLimiter, _parse_limits
+
+
+def _available(limiter: StageLimiter) -> int:
+    return limiter._sem._value
+
+
+def test_admits_up_to_concurrency_without_waiting():
+    async def scenario():
+        limiter = StageLimiter("mysql", concurrency=2, max_queue=0, max_wait_ms=0)
+        await limiter.acquire()
+        await limiter.acquire()
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert (stats["admitted"], stats["in_flight"]) == (2, 2)
+
+
+def test_sheds_when_queue_is_full():
+    async def scenario():
+        limiter = StageLimiter("mysql", concurrency=1, max_queue=1, max_wait_ms=0)
+        await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as exc_info:
+            await limiter.acquire()
+        limiter.release()
+        await queued
+        return exc_info.value, limiter.stats()
+
+    rejected, stats = asyncio.run(scenario())
+
+    assert (rejected.stage, rejected.reason) == ("mysql", "queue_full")
+    assert stats["shed_queue_full"] == 1
+    assert stats["waiting"] == 0
+
+
+def test_sheds_after_max_wait_and_keeps_capacity():
+    async def scenario():
+        limiter = StageLimiter("qdrant", concurrency=1, max_queue=4, max_wait_ms=10)
+        await limiter.acquire()
+        with pytest.raises(AdmissionRejected) as exc_info:
+            await limiter.acquire()
+        limiter.release()
+        await asyncio.sleep(0)
+        return exc_info.value, limiter
+
+    rejected, limiter = asyncio.run(scenario())
+
+    assert rejected.reason == "wait_timeout"
+    assert limiter.stats()["shed_wait_timeout"] == 1
+    assert _available(limiter) == 1
+
+
+def test_permit_released_in_the_same_turn_as_the_timeout_is_not_leaked():
+    # 逾時與名額歸還排在同一輪：不論最後是卸載或取得，名額都不能遺失
+    async def scenario():
+        limiter = StageLimiter("qdrant", concurrency=1, max_queue=4, max_wait_ms=20)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        asyncio.get_running_loop().call_later(0.02, limiter.release)
+        try:
+            await waiter
+        except AdmissionRejected:
+            pass
+        else:
+            limiter.release()
+        await asyncio.sleep(0.01)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+
+    assert _available(limiter) == 1
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_permit_handed_to_it():
+    async def scenario():
+        limiter = StageLimiter("inference", concurrency=1, max_queue=4, max_wait_ms=1000)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        # 名額交給等待者的同一輪，等待者被取消 (例如用戶端斷線)
+        limiter.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.01)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+
+    assert _available(limiter) == 1
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_controller_closes_coroutine_of_rejected_work():
+    async def scenario():
+        controller = AdmissionController(True, {"mysql": (1, 0, 0)})
+        async with controller.limit("mysql"):
+            work = asyncio.sleep(0)
+            with pytest.raises(AdmissionRejected):
+                await controller.run("mysql", work)
+        return work
+
+    assert asyncio.run(scenario()).cr_frame is None
+
+
+def test_disabled_controller_does_not_limit():
+    async def scenario():
+        controller = AdmissionController(False, {"mysql": (1, 0, 0)})
+        async with controller.limit("mysql"):
+            return await controller.run("mysql", asyncio.sleep(0, result="ran"))
+
+    assert asyncio.run(scenario()) == "ran"
+
+
+def test_parse_limits_skips_invalid_entries():
+    limits = _parse_limits("mysql=20/64/500, qdrant=bad, inference=0/-1/0,search")
+
+    assert limits == {"mysql": (20, 64, 500.0), "inference": (1, 0, 0.0)}
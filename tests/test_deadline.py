@@ -0,0 +1,100 @@
+# tests/test_deadline.py
+import asyncio
+
+import pytest
+
+from app.utils.deadline import (
+    DeadlineExceeded,
+    budget_allows,
+    current_deadline,
+    deadline_scope,
+    degradations,
+    mark_degraded,
+    split_deadline,
+    within_deadline,
+)
+
+
+def test_unbounded_scope_still_records_degradations():
+    with deadline_scope(None) as deadline:
+        assert not deadline.bounded
+        assert budget_allows(10 ** 9)
+        mark_degraded("vector_shed")
+        mark_degraded("vector_shed")
+        assert degradations() == ["vector_shed"]
+    assert current_deadline() is None
+
+
+@pytest.mark.parametrize("budget_ms", [0, -5])
+def test_non_positive_budget_is_unbounded(budget_ms):
+    with deadline_scope(budget_ms) as deadline:
+        assert not deadline.bounded
+
+
+def test_budget_allows_uses_remaining_time():
+    with deadline_scope(1000):
+        assert budget_allows(500)
+        assert not budget_allows(5000)
+
+
+def test_nested_scope_is_restored_on_exit():
+    with deadline_scope(1000) as outer:
+        with deadline_scope(None):
+            assert not current_deadline().bounded
+        assert current_deadline() is outer
+
+
+def test_split_deadline_shares_expiry_but_not_degradations():
+    with deadline_scope(1000) as parent:
+        with split_deadline() as child:
+            assert child.expires_at == parent.expires_at
+            mark_degraded("count_skipped")
+        assert degradations() == []
+        assert child.degradations == ["count_skipped"]
+
+
+def test_split_deadline_without_parent_is_unbounded():
+    with split_deadline() as child:
+        assert not child.bounded
+
+
+def test_within_deadline_without_scope_just_awaits():
+    async def scenario():
+        return await within_deadline(asyncio.sleep(0.01, result="done"), "sql")
+
+    assert asyncio.run(scenario()) == "done"
+
+
+def test_within_deadline_raises_with_stage_on_timeout():
+    async def scenario():
+        with deadline_scope(20):
+            await within_deadline(asyncio.sleep(1), "qdrant")
+
+    with pytest.raises(DeadlineExceeded) as exc_info:
+        asyncio.run(scenario())
+    assert exc_info.value.stage == "qdrant"
+
+
+def test_within_deadline_fails_fast_when_reserve_exceeds_budget():
+    async def scenario():
+        pending = asyncio.sleep(0)
+        with deadline_scope(50):
+            try:
+                await within_deadline(pending, "count", reserve_ms=100)
+            finally:
+                # 預算不足時不能留下從未 await 的 coroutine
+                assert pending.cr_frame is None
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+
+
+def test_tasks_inherit_the_scope_deadline():
+    async def read_deadline():
+        return current_deadline()
+
+    async def scenario():
+        with deadline_scope(1000) as deadline:
+            return await asyncio.ensure_future(read_deadline()) is deadline
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,130 @@
+# tests/test_geo_candidate_cache.py
+import asyncio
+import copy
+import math
+
+import pytest
+
+from app.config import Config
+from app.services.search_pipeline_service import SearchPipelineService
+from app.services.vector_service import VectorService
+from app.utils.distance_utils import R_EARTH_METERS, geohash_encode, haversine_distances
+from app.utils.intent_result_cache import GeoCandidateCache, compute_geo_key, compute_intent_fingerprint
+
+PLAN = {
+    "s_id": "geo",
+    "raw_logic_tree": {"cuisine_type": {"value": "拉麵"}},
+    "sort_conditions": [{"field": "distance"}],
+    "select_fields": ["p.id AS id"],
+    "distance_needed": True,
+    "deferred_sorting": True,
+    "location_source": "user",
+    "user_location": {"lat": 22.9750, "lng": 120.2530},
+}
+
+# 兩家店：A 在使用者北方約 550 公尺，B 在南方約 550 公尺；語意相似度相同
+ENTRY = {
+    "db_results": [
+        {"id": 1, "restaurant_name": "北邊拉麵", "rating": 4.5, "user_ratings_total": 300, "lat": 22.9800, "lng": 120.2530},
+        {"id": 2, "restaurant_name": "南邊拉麵", "rating": 4.5, "user_ratings_total": 300, "lat": 22.9700, "lng": 120.2530},
+    ],
+    "vector_results": [
+        {"id": 1, "score": 0.8, "review_summary": "湯頭濃郁"},
+        {"id": 2, "score": 0.8, "review_summary": "叉燒軟嫩"},
+    ],
+    "threshold": 0.3,
+    "total_count": 2,
+    "rdb_info": {"status": "success"},
+    "vector_search_info": {"query": "拉麵"},
+}
+
+
+def _plan(**overrides):
+    plan = copy.deepcopy(PLAN)
+    plan.update(overrides)
+    return plan
+
+
+def test_geohash_matches_reference_value():
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash_encode(57.64911, 10.40744, 5) == "u4pru"
+
+
+def test_haversine_distances_matches_scalar_formula():
+    lats, lngs = [0.0, 23.0], [1.0, 120.0]
+    expected = []
+    for lat, lng in zip(lats, lngs):
+        a = math.sin(math.radians(lat) / 2) ** 2 + math.cos(math.radians(lat)) * math.sin(math.radians(lng) / 2) ** 2
+        expected.append(2 * R_EARTH_METERS * math.asin(math.sqrt(a)))
+
+    assert haversine_distances(0.0, 0.0, lats, lngs).tolist() == pytest.approx(expected)
+
+
+def test_geo_key_is_shared_within_a_cell_and_ignores_exact_position():
+    nearby = _plan(user_location={"lat": 22.9751, "lng": 120.2531})
+
+    assert compute_geo_key(nearby, 6) == compute_geo_key(_plan(), 6)
+    # 候選快取 key 的前半段是不含位置的意圖指紋
+    assert compute_intent_fingerprint(nearby, include_location=False) == compute_intent_fingerprint(_plan(), include_location=False)
+
+
+def test_geo_key_changes_with_cell_and_intent():
+    far = _plan(user_location={"lat": 23.0500, "lng": 120.2530})
+
+    assert compute_geo_key(far, 6) != compute_geo_key(_plan(), 6)
+    assert compute_geo_key(_plan(raw_logic_tree={"cuisine_type": {"value": "咖哩"}}), 6) != compute_geo_key(_plan(), 6)
+
+
+@pytest.mark.parametrize("location", [None, {}, {"lat": None, "lng": 120.0}, {"lat": "north", "lng": 120.0}])
+def test_geo_key_requires_valid_coordinates(location):
+    assert compute_geo_key(_plan(user_location=location), 6) is None
+
+
+def test_geo_cache_uses_its_own_settings():
+    cache = GeoCandidateCache()
+
+    assert cache.ttl == Config.GEO_CACHE_TTL
+    assert cache.stats()["l1"]["max_bytes"] == Config.GEO_CACHE_MAX_BYTES
+    assert cache._build_key("k") == "geo_candidates:k"
+
+
+@pytest.fixture
+def pipeline():
+    vector_service = VectorService(encoder=object(), repo=object())
+    return SearchPipelineService(builder=None, rdbms_repo=None, vector_service=vector_service, geo_cache=GeoCandidateCache())
+
+
+def test_geo_key_only_for_location_independent_candidates(pipeline):
+    assert pipeline._geo_key(_plan()) is not None
+    assert pipeline._geo_key(_plan(distance_needed=False)) is None
+    # 一般模式由 SQL 依距離分頁時，取回哪些店家隨位置改變，不能跨座標重用
+    assert pipeline._geo_key(_plan(deferred_sorting=False)) is None
+    assert pipeline._geo_key(_plan(deferred_sorting=False, sort_conditions=[{"field": "rating"}])) is not None
+
+
+def test_cached_candidates_are_reranked_for_the_new_position(pipeline):
+    near_north = _plan(user_location={"lat": 22.9795, "lng": 120.2530})
+    near_south = _plan(user_location={"lat": 22.9705, "lng": 120.2530})
+
+    north = asyncio.run(pipeline._rank_geo_candidates(near_north, ENTRY))
+    south = asyncio.run(pipeline._rank_geo_candidates(near_south, ENTRY))
+
+    assert [row["id"] for row in north["results"]] == [1, 2]
+    assert [row["id"] for row in south["results"]] == [2, 1]
+    # 距離以本次座標重算 (約 55 公尺)，而非沿用快取
+    assert north["results"][0]["distance"] == "55 m"
+    assert north["geo_rerank"] and north["vector_search_info"]["geo_cache_hit"]
+    assert north["total_count"] == ENTRY["total_count"]
+    # 快取內容不能被就地修改
+    assert "distance" not in ENTRY["db_results"][0]
+
+
+def test_geo_entry_skips_rows_without_coordinates(pipeline):
+    sink = {
+        "db_results": [{"id": 1, "lat": None, "lng": 120.0}],
+        "vector_results": [],
+        "threshold": 0.3,
+    }
+    outcome = {"total_count": 1, "rdb_info": {}, "vector_search_info": {}}
+
+    assert pipeline._geo_entry(outcome, sink) is None
@@ -0,0 +1,117 @@
+# tests/test_intent_result_cache.py
+import asyncio
+import copy
+
+import fakeredis.aioredis
+
+from app.config import Config
+from app.utils.intent_result_cache import IntentResultCache, compute_intent_fingerprint
+
+PLAN = {
+    "s_id": "session-a",
+    "raw_logic_tree": {"op": "AND", "conditions": [{"cuisine_type": {"value": "拉麵"}}, {"rating": {"value": 4, "cmp": ">="}}]},
+    "sort_conditions": [{"field": "rating"}],
+    "select_fields": ["p.id AS id", "p.name AS restaurant_name", "p.rating AS rating"],
+    "photos_needed": False,
+    "distance_needed": True,
+    "location_source": "user",
+    "user_location": {"lat": 22.99731, "lng": 120.21212},
+}
+
+OUTCOME = {
+    "results": [{"id": 1, "restaurant_name": "老王拉麵"}],
+    "total_count": 1,
+    "vector_search_info": {"query": "拉麵"},
+    "rdb_info": {"status": "success"},
+}
+
+
+def _plan(**overrides):
+    plan = copy.deepcopy(PLAN)
+    plan.update(overrides)
+    return plan
+
+
+def test_fingerprint_ignores_session_id_and_select_field_order():
+    reordered = _plan(s_id="session-b", select_fields=list(reversed(PLAN["select_fields"])))
+
+    assert compute_intent_fingerprint(_plan()) == compute_intent_fingerprint(reordered)
+
+
+def test_fingerprint_ignores_dict_key_order():
+    reordered = _plan(raw_logic_tree={"conditions": PLAN["raw_logic_tree"]["conditions"], "op": "AND"})
+
+    assert compute_intent_fingerprint(_plan()) == compute_intent_fingerprint(reordered)
+
+
+def test_fingerprint_changes_with_intent():
+    base = compute_intent_fingerprint(_plan())
+
+    assert compute_intent_fingerprint(_plan(sort_conditions=[{"field": "distance"}])) != base
+    assert compute_intent_fingerprint(_plan(photos_needed=True)) != base
+    assert compute_intent_fingerprint(_plan(page_size=10)) != base
+
+
+def test_fingerprint_rounds_location_to_grid():
+    step = 10 ** -Config.INTENT_CACHE_GRID_DECIMALS
+    nearby = _plan(user_location={"lat": PLAN["user_location"]["lat"] + step / 10, "lng": PLAN["user_location"]["lng"]})
+    far = _plan(user_location={"lat": PLAN["user_location"]["lat"] + step * 5, "lng": PLAN["user_location"]["lng"]})
+
+    assert compute_intent_fingerprint(nearby) == compute_intent_fingerprint(_plan())
+    assert compute_intent_fingerprint(far) != compute_intent_fingerprint(_plan())
+    # 不含位置的指紋供位置感知候選快取使用
+    assert compute_intent_fingerprint(far, include_location=False) == compute_intent_fingerprint(_plan(), include_location=False)
+
+
+def test_l1_hit_and_miss():
+    async def scenario():
+        cache = IntentResultCache()
+        assert await cache.get("fp") is None
+        await cache.put("fp", OUTCOME)
+        return await cache.get("fp"), cache.stats()
+
+    cached, stats = asyncio.run(scenario())
+
+    assert cached == OUTCOME
+    assert (stats["l1_hits"], stats["misses"], stats["stores"]) == (1, 1, 1)
+
+
+def test_redis_layer_is_shared_between_workers(monkeypatch):
+    monkeypatch.setattr(Config, "INTENT_CACHE_REDIS_ENABLED", True)
+
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        await IntentResultCache(redis).put("fp", OUTCOME)
+        # 另一個 Worker 的 L1 是空的，從 Redis 讀回後寫入自己的 L1
+        other = IntentResultCache(redis)
+        first, second = await other.get("fp"), await other.get("fp")
+        return first, second, other.stats()
+
+    first, second, stats = asyncio.run(scenario())
+
+    assert first == second == OUTCOME
+    assert (stats["redis_hits"], stats["l1_hits"]) == (1, 1)
+
+
+def test_redis_errors_are_treated_as_misses(monkeypatch):
+    monkeypatch.setattr(Config, "INTENT_CACHE_REDIS_ENABLED", True)
+
+    class BrokenRedis:
+        async def get(self, key):
+            raise ConnectionError("redis down")
+
+        async def set(self, key, value, ex=None):
+            raise ConnectionError("redis down")
+
+    async def scenario():
+        cache = IntentResultCache(BrokenRedis())
+        missed = await cache.get("fp")
+        await cache.put("fp", OUTCOME)
+        return missed, await cache.get("fp"), cache.stats()
+
+    missed, cached, stats = asyncio.run(scenario())
+
+    assert missed is None
+    # 寫入 Redis 失敗時仍保留 L1
+    assert cached == OUTCOME
+    assert stats["redis_errors"] == 2
@@ -0,0 +1,77 @@
+# tests/test_local_session_cache.py
+from app.config import Config
+from app.utils.local_session_cache import ByteLRUCache, LocalSessionCache, estimate_size
+
+
+def _payload(n: int):
+    return [{"id": i, "restaurant_name": f"店家{i}"} for i in range(n)]
+
+
+def test_evicts_least_recently_read_entry_when_over_capacity():
+    size = estimate_size(_payload(10))
+    cache = ByteLRUCache(max_bytes=size * 2 + size // 2, ttl=60)
+    cache.put("a", _payload(10))
+    cache.put("b", _payload(10))
+
+    # 讀取 a 之後，最久未被讀取的是 b
+    assert cache.get("a") is not None
+    cache.put("c", _payload(10))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_rejects_single_entry_larger_than_capacity():
+    cache = ByteLRUCache(max_bytes=estimate_size(_payload(10)), ttl=60)
+    cache.put("small", _payload(1))
+    cache.put("huge", _payload(1000))
+
+    assert cache.get("huge") is None
+    # 拒收超大資料時不能把既有資料擠掉
+    assert cache.get("small") is not None
+    assert cache.stats()["rejected"] == 1
+
+
+def test_replacing_a_key_does_not_double_count_bytes():
+    cache = ByteLRUCache(max_bytes=10 ** 6, ttl=60)
+    cache.put("a", _payload(10))
+    cache.put("a", _payload(10))
+
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == estimate_size(_payload(10))
+
+
+def test_entry_expires_with_the_shorter_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.utils.local_session_cache.time.monotonic", lambda: now[0])
+    cache = ByteLRUCache(max_bytes=10 ** 6, ttl=60)
+    cache.put("a", _payload(1), ttl=5)
+
+    now[0] += 4
+    assert cache.get("a") is not None
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_non_positive_ttl_is_not_stored():
+    cache = ByteLRUCache(max_bytes=10 ** 6, ttl=60)
+    cache.put("a", _payload(1), ttl=0)
+
+    assert cache.get("a") is None
+
+
+def test_estimate_size_counts_shared_objects_once():
+    row = {"review_summary": "湯頭濃郁" * 100}
+
+    assert estimate_size([row, row]) < 2 * estimate_size([row])
+
+
+def test_local_session_cache_never_outlives_redis_session():
+    cache = LocalSessionCache(max_bytes=10 ** 6, ttl=Config.SEARCH_SESSION_TTL + 600)
+
+    assert cache.ttl == Config.SEARCH_SESSION_TTL
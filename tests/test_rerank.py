@@ -0,0 +1,82 @@
+# tests/test_rerank.py
+import copy
+
+import pytest
+
+from app.services.vector_service import VectorService
+
+
+@pytest.fixture
+def service():
+    # 注入替身 encoder / repo：rerank 只做記憶體內的權重計算，不載入模型也不連線 Qdrant
+    return VectorService(encoder=object(), repo=object())
+
+
+def _row(row_id, similarity, rating, popularity, distance):
+    return {"id": row_id, "restaurant_name": f"店家{row_id}", "_rank_features": [similarity, rating, popularity, distance]}
+
+
+ROWS = [
+    _row(1, 0.9, 0.6, 0.5, 0.2),   # 語意最接近，但最遠
+    _row(2, 0.6, 0.7, 0.6, 0.95),  # 最近
+    _row(3, 0.7, 0.95, 0.9, 0.5),  # 評分、人氣最高
+]
+
+
+def _ids(rows):
+    return [row["id"] for row in rows]
+
+
+def test_sort_conditions_change_the_order(service):
+    by_distance, strategy = service.rerank(ROWS, [{"field": "distance"}])
+    by_rating, _ = service.rerank(ROWS, [{"field": "rating"}])
+
+    assert _ids(by_distance)[0] == 2
+    assert _ids(by_rating)[0] == 3
+    assert "distance" in strategy
+
+
+def test_empty_sort_conditions_restore_semantic_default(service):
+    reranked, strategy = service.rerank(ROWS, [])
+
+    assert _ids(reranked)[0] == 1
+    assert strategy == "預設語意優先"
+
+
+def test_invalid_fields_are_ignored(service):
+    assert _ids(service.rerank(ROWS, [{"field": "price"}, "distance", None])[0]) == _ids(service.rerank(ROWS, [])[0])
+
+
+def test_ties_keep_the_original_relative_order(service):
+    rows = [_row(row_id, 0.8, 0.8, 0.8, 0.8) for row_id in (5, 3, 9, 1)]
+
+    assert _ids(service.rerank(rows, [{"field": "distance"}])[0]) == [5, 3, 9, 1]
+
+
+def test_rerank_is_idempotent(service):
+    once, _ = service.rerank(ROWS, [{"field": "popularity"}])
+    twice, _ = service.rerank(once, [{"field": "popularity"}])
+
+    assert _ids(once) == _ids(twice)
+
+
+def test_does_not_mutate_session_rows(service):
+    rows = copy.deepcopy(ROWS)
+    reranked, _ = service.rerank(rows, [{"field": "distance"}])
+
+    assert rows == ROWS
+    assert all("hybrid_score" in row and "ranking_reason" in row for row in reranked)
+    assert all(row["applied_strategy"] == reranked[0]["applied_strategy"] for row in reranked)
+
+
+def test_legacy_rows_fall_back_to_score_analysis(service):
+    legacy = [
+        {"id": 1, "score_analysis": {"similarity": 0.9, "rating": 0.5, "popularity": 0.5, "distance": 0.1}},
+        {"id": 2, "score_analysis": {"similarity": 0.5, "rating": 0.5, "popularity": 0.5, "distance": 0.9}},
+    ]
+
+    assert _ids(service.rerank(legacy, [{"field": "distance"}])[0]) == [2, 1]
+
+
+def test_empty_rows(service):
+    assert service.rerank([], [{"field": "distance"}])[0] == []
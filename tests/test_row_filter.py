@@ -0,0 +1,81 @@
+# tests/test_row_filter.py
+import pytest
+
+from app.services.hybrid_SQL_builder_service_v2 import HybridSQLBuilder
+
+# 一般查詢模式的 Session 欄位 (評論數的別名為 reviews_count)
+QUERY_ROWS = [
+    {"id": 1, "restaurant_name": "老王拉麵", "address": "台南市永康區中正路", "rating": 4.6, "reviews_count": 820, "facility_tags": ["冷氣", "內用"]},
+    {"id": 2, "restaurant_name": "小李便當", "address": "台南市東區大學路", "rating": 3.9, "reviews_count": 45, "facility_tags": ["外帶"]},
+    {"id": 3, "restaurant_name": "阿明拉麵", "address": "台南市永康區大灣路", "rating": None, "reviews_count": 300, "facility_tags": None},
+]
+
+
+@pytest.fixture
+def builder():
+    return HybridSQLBuilder()
+
+
+def _matching(builder, logic_tree, rows=QUERY_ROWS):
+    predicate, ignored = builder.build_row_filter(logic_tree, rows[0].keys())
+    matched = [row["id"] for row in rows if predicate is None or predicate(row)]
+    return matched, ignored
+
+
+def test_numeric_comparison_treats_null_as_no_match(builder):
+    assert _matching(builder, {"rating": {"value": "4.5", "cmp": ">="}}) == ([1], [])
+
+
+def test_facility_requires_tag_only_when_true(builder):
+    assert _matching(builder, {"冷氣": {"value": True}}) == ([1], [])
+    assert _matching(builder, {"冷氣": {"value": False}}) == ([1, 2, 3], [])
+
+
+def test_text_fields_match_by_substring(builder):
+    assert _matching(builder, {"address": {"value": "永康"}}) == ([1, 3], [])
+    assert _matching(builder, {"restaurant_name": {"value": "拉麵"}}) == ([1, 3], [])
+
+
+def test_in_and_not_in(builder):
+    assert _matching(builder, {"id": {"value": [1, 3], "cmp": "in"}}) == ([1, 3], [])
+    assert _matching(builder, {"id": {"value": [1, 3], "cmp": "not in"}}) == ([2], [])
+
+
+def test_and_or_nodes(builder):
+    tree = {"op": "OR", "conditions": [
+        {"op": "AND", "conditions": [{"address": {"value": "永康"}}, {"rating": {"value": 4, "cmp": ">"}}]},
+        {"外帶": {"value": True}},
+    ]}
+
+    assert _matching(builder, tree) == ([1, 2], [])
+
+
+def test_user_ratings_total_resolves_to_query_mode_alias(builder):
+    assert _matching(builder, {"user_ratings_total": {"value": 100, "cmp": ">="}}) == ([1, 3], [])
+
+
+def test_user_ratings_total_in_recommend_mode_session(builder):
+    rows = [{"id": 1, "user_ratings_total": 820}, {"id": 2, "user_ratings_total": 45}]
+
+    assert _matching(builder, {"user_ratings_total": {"value": 100, "cmp": ">="}}, rows) == ([1], [])
+
+
+def test_conditions_that_cannot_be_checked_in_memory_are_ignored(builder):
+    tree = {"op": "AND", "conditions": [
+        {"flavor": {"value": "濃郁"}},
+        {"time": {"value": "營業中"}},
+        {"phone": {"value": "06"}},
+        {"rating": {"value": 4, "cmp": ">"}},
+    ]}
+
+    matched, ignored = _matching(builder, tree)
+
+    assert matched == [1]
+    assert ignored == ["flavor", "time", "phone"]
+
+
+def test_no_applicable_condition_returns_no_filter(builder):
+    predicate, ignored = builder.build_row_filter({"flavor": {"value": "濃郁"}}, QUERY_ROWS[0].keys())
+
+    assert predicate is None
+    assert ignored == ["flavor"]
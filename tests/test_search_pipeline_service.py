@@ -0,0 +1,105 @@
+# tests/test_search_pipeline_service.py
+import asyncio
+
+import pytest
+
+from app.services.search_pipeline_service import SearchPipelineService
+from app.utils.deadline import DeadlineExceeded, current_deadline, deadline_scope, degradations, mark_degraded
+from app.utils.single_flight import SingleFlight
+
+PLAN = {
+    "raw_logic_tree": {"cuisine_type": {"value": "拉麵"}},
+    "sort_conditions": [],
+    "select_fields": ["p.id AS id"],
+}
+
+
+class StubPipeline(SearchPipelineService):
+    """以替身取代 SQL / 向量檢索：有截止時間時依預算降級，或在主 SQL 階段逾時。"""
+
+    def __init__(self, delay: float = 0.05, fail_when_bounded: bool = False):
+        super().__init__(builder=None, rdbms_repo=None, vector_service=None, single_flight=SingleFlight())
+        self.delay = delay
+        self.fail_when_bounded = fail_when_bounded
+        self.executions = 0
+
+    async def _execute(self, plan, vector_batch=None, candidate_sink=None):
+        self.executions += 1
+        await asyncio.sleep(self.delay)
+        if current_deadline().bounded:
+            if self.fail_when_bounded:
+                raise DeadlineExceeded("sql")
+            mark_degraded("count_skipped")
+        return {
+            "results": [{"id": 1}],
+            "total_count": 1,
+            "vector_search_info": {},
+            "rdb_info": {},
+            "timings": {"sql_service": 0.0, "transition": 0.0, "qdrant": 0.0, "ranking": 0.0},
+            "cache_hit": False,
+            "coalesced": False,
+            "geo_rerank": False,
+            "degraded": degradations(),
+        }
+
+
+async def _search(pipeline, budget_ms=None, start_after=0.0):
+    await asyncio.sleep(start_after)
+    with deadline_scope(budget_ms):
+        return await pipeline.run(dict(PLAN, s_id="s"))
+
+
+def test_identical_searches_share_one_execution():
+    async def scenario():
+        pipeline = StubPipeline()
+        outcomes = await asyncio.gather(_search(pipeline), _search(pipeline, start_after=0.01))
+        return pipeline, outcomes
+
+    pipeline, (leader, follower) = asyncio.run(scenario())
+
+    assert pipeline.executions == 1
+    assert (leader["coalesced"], follower["coalesced"]) == (False, True)
+
+
+def test_follower_does_not_inherit_the_leaders_degradation():
+    # 回歸測試：共用計算在發起者的 context 內執行，曾把發起者的降級結果交給沒有截止時間的加入者
+    async def scenario():
+        pipeline = StubPipeline()
+        outcomes = await asyncio.gather(_search(pipeline, budget_ms=5000), _search(pipeline, start_after=0.01))
+        return pipeline, outcomes
+
+    pipeline, (leader, follower) = asyncio.run(scenario())
+
+    assert leader["degraded"] == ["count_skipped"]
+    assert follower["degraded"] == []
+    assert not follower["coalesced"]
+    assert pipeline.executions == 2
+
+
+def test_follower_does_not_inherit_the_leaders_deadline_exceeded():
+    async def scenario():
+        pipeline = StubPipeline(fail_when_bounded=True)
+        return await asyncio.gather(
+            _search(pipeline, budget_ms=5000), _search(pipeline, start_after=0.01), return_exceptions=True
+        )
+
+    leader, follower = asyncio.run(scenario())
+
+    assert isinstance(leader, DeadlineExceeded)
+    assert follower["results"] == [{"id": 1}]
+    assert follower["degraded"] == []
+
+
+def test_follower_waits_only_within_its_own_budget():
+    async def scenario():
+        pipeline = StubPipeline(delay=0.5)
+        leader = asyncio.ensure_future(_search(pipeline))
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            await _search(pipeline, budget_ms=50, start_after=0.01)
+        # 加入者逾時離開不影響發起者的計算
+        return exc_info.value.stage, await leader
+
+    stage, leader = asyncio.run(scenario())
+
+    assert stage == "coalesced"
+    assert leader["degraded"] == [] and not leader["coalesced"]
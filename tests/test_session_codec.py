@@ -0,0 +1,82 @@
+# tests/test_session_codec.py
+import json
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from app.utils.session_codec import HEADER_SIZE, MAGIC, SessionCodec, zstandard
+
+SESSION = [
+    {
+        "id": 1,
+        "restaurant_name": "老王拉麵",
+        "rating": 4.5,
+        "review_summary": "湯頭濃郁，" * 200,
+        "facility_tags": ["冷氣", "內用"],
+        "score_analysis": {"similarity": 0.82, "rating": 0.9},
+    },
+    {"id": 2, "restaurant_name": "小李便當", "rating": 3.2, "facility_tags": [], "score_analysis": {}},
+]
+
+
+@pytest.mark.parametrize("codec", ["json", "orjson"])
+@pytest.mark.parametrize("compression", ["none", "zlib"])
+def test_round_trip(codec, compression):
+    session_codec = SessionCodec(codec=codec, compression=compression, compress_threshold=64)
+    blob = session_codec.encode(SESSION)
+
+    assert blob.startswith(MAGIC)
+    assert session_codec.decode(blob) == SESSION
+
+
+def test_small_payload_is_not_compressed():
+    session_codec = SessionCodec(codec="json", compression="zlib", compress_threshold=4096)
+    blob = session_codec.encode([{"id": 1}])
+
+    # 標頭最後一個位元組為壓縮方式，0 代表 none
+    assert blob[HEADER_SIZE - 1] == 0
+    assert session_codec.decode(blob) == [{"id": 1}]
+
+
+def test_decimal_and_numpy_values_are_serialized_as_floats():
+    session_codec = SessionCodec(codec="json")
+    decoded = session_codec.decode(session_codec.encode({"rating": Decimal("4.5"), "score": np.float64(0.25)}))
+
+    assert decoded == {"rating": 4.5, "score": 0.25}
+
+
+@pytest.mark.parametrize("legacy", [
+    json.dumps(SESSION, ensure_ascii=False),
+    json.dumps(SESSION, ensure_ascii=False).encode("utf-8"),
+])
+def test_decodes_legacy_plain_json_sessions(legacy):
+    # 升級前寫入 Redis 的 Session 沒有標頭，TTL 內仍要能讀取
+    assert SessionCodec(codec="orjson", compression="zlib").decode(legacy) == SESSION
+
+
+def test_decode_follows_the_blob_header_not_the_current_config():
+    blob = SessionCodec(codec="json", compression="zlib", compress_threshold=0).encode(SESSION)
+
+    assert SessionCodec(codec="orjson", compression="none").decode(blob) == SESSION
+
+
+def test_unavailable_codec_falls_back_to_json():
+    session_codec = SessionCodec(codec="no-such-codec", compression="no-such-compression")
+
+    assert (session_codec.codec, session_codec.compression) == ("json", "none")
+
+
+@pytest.mark.skipif(zstandard is None, reason="zstandard 未安裝")
+def test_zstd_round_trip():
+    session_codec = SessionCodec(codec="json", compression="zstd", compress_threshold=0)
+
+    assert session_codec.decode(session_codec.encode(SESSION)) == SESSION
+
+
+def test_rejects_unknown_format_version():
+    blob = bytearray(SessionCodec(codec="json").encode(SESSION))
+    blob[len(MAGIC)] = 99
+
+    with pytest.raises(ValueError):
+        SessionCodec().decode(bytes(blob))
@@ -0,0 +1,161 @@
+# tests/test_single_flight.py
+import asyncio
+
+import pytest
+
+from app.utils.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def scenario():
+        flight = SingleFlight()
+        outcomes = await asyncio.gather(*(flight.do("key", compute) for _ in range(5)))
+        return outcomes, flight.stats()
+
+    outcomes, stats = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert [shared for _, shared in outcomes] == [False, True, True, True, True]
+    assert all(result == "result" for result, _ in outcomes)
+    assert (stats["leaders"], stats["coalesced"], stats["in_flight"]) == (1, 4, 0)
+
+
+def test_finished_flight_is_not_reused():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def scenario():
+        flight = SingleFlight()
+        return [await flight.do("key", compute) for _ in range(2)]
+
+    assert asyncio.run(scenario()) == [(1, False), (2, False)]
+
+
+def test_exception_is_shared_with_every_waiter():
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def scenario():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("key", compute) for _ in range(3)), return_exceptions=True), flight
+
+    outcomes, flight = asyncio.run(scenario())
+
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cancelling_the_leader_keeps_computation_for_other_waiters():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return "result"
+
+        leader = asyncio.ensure_future(flight.do("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("key", compute))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, flight.stats()
+
+    (result, shared), stats = asyncio.run(scenario())
+
+    assert (result, shared) == ("result", True)
+    assert stats["abandoned"] == 0
+
+
+def test_computation_is_cancelled_when_the_last_waiter_leaves():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.ensure_future(flight.do("key", compute)) for _ in range(2)]
+        await started.wait()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0)
+        return flight.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert stats["abandoned"] == 1
+    assert stats["in_flight"] == 0
+
+
+
+def test_join_is_applied_to_followers_only():
+    joined = []
+
+    async def scenario():
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        def join(waiting):
+            joined.append(1)
+            return waiting
+
+        return await asyncio.gather(*(flight.do("key", compute, join=join) for _ in range(3)))
+
+    outcomes = asyncio.run(scenario())
+
+    assert [shared for _, shared in outcomes] == [False, True, True]
+    assert len(joined) == 2
+
+
+def test_follower_leaving_through_join_timeout_abandons_orphaned_computation():
+    async def scenario():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        leader = asyncio.ensure_future(flight.do("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(
+            flight.do("key", compute, join=lambda waiting: asyncio.wait_for(waiting, 0.01))
+        )
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await follower
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return flight.stats()
+
+    assert asyncio.run(scenario())["abandoned"] == 1